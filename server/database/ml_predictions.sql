@@ -41,6 +41,7 @@ CREATE TABLE IF NOT EXISTS ml_predictions (
     age_multiplier DECIMAL(3,2) NOT NULL,
     recommendation TEXT NOT NULL,
     risk_factors TEXT[], -- Array of risk factors identified
+    risk_factor_mask INTEGER, -- Coded risk factors (see ml_predictions_risk_factor_mask.sql)
     
     -- Metadata
     predicted_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
@@ -0,0 +1,8 @@
+-- Coded risk factors for ml_predictions
+-- risk_factor_mask holds the bits of server/src/services/risk_factors.py (RISK_FACTOR_CODES,
+-- bit i = code i). Readers use the risk_factors text, which is still written next to the mask;
+-- the mask serves queries and rollups by code.
+
+ALTER TABLE ml_predictions ADD COLUMN IF NOT EXISTS risk_factor_mask INTEGER;
+
+COMMENT ON COLUMN ml_predictions.risk_factor_mask IS 'Bitmask of risk factor codes (risk_factors.RISK_FACTOR_CODES); NULL for rows that store risk_factors text';
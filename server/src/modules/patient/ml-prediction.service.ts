@@ -1,6 +1,7 @@
 import { Injectable, Logger } from '@nestjs/common';
 import { CreatePredictionDto, PredictionResultDto } from './dto/create-prediction.dto';
 import { SupabaseService } from '../supabase/supabase.service';
+import { PortableModel, loadVerifiedModel } from './portable-model';
 
 @Injectable()
 export class MLPredictionService {
@@ -49,7 +50,32 @@ export class MLPredictionService {
     multiple_comorbidities: 0.18
   };
 
-  constructor(private readonly supabaseService: SupabaseService) {}
+  // Trained ensemble exported by portable_export.py; null falls back to the simulated score
+  private readonly portableModel: PortableModel | null;
+
+  constructor(private readonly supabaseService: SupabaseService) {
+    this.portableModel = this.loadPortableModel(process.env.RELAYLOOP_PORTABLE_MODEL);
+  }
+
+  /**
+   * Load the portable model, refusing it if it does not reproduce its golden set
+   */
+  private loadPortableModel(path?: string): PortableModel | null {
+    if (!path) return null;
+    try {
+      const { model, report } = loadVerifiedModel(path);
+      if (report && !report.passed) {
+        this.logger.error(`Portable model ${path} failed ${report.failures.length} golden cases; using simulated scores`);
+        return null;
+      }
+      this.logger.log(`Scoring with portable model ${model.modelVersion ?? path}` +
+        (report ? ` (${report.cases} golden cases, max diff ${report.max_abs_diff.toExponential(2)})` : ' (no golden set)'));
+      return model;
+    } catch (error) {
+      this.logger.error(`Could not load portable model ${path}: ${error.message}`);
+      return null;
+    }
+  }
 
   /**
    * Standardize age group based on patient age
@@ -284,8 +310,15 @@ export class MLPredictionService {
       // Calculate clinical risk score
       const { score: clinicalScore, riskFactors } = this.calculateClinicalScore(patient, predictionData);
 
-      // Get ML prediction
-      const mlProbability = this.simulateMLPrediction(patient, predictionData);
+      // Get ML prediction: the exported ensemble when one is loaded
+      const mlProbability = this.portableModel
+        ? this.portableModel.predict({
+            ...predictionData,
+            age: patient.age || this.calculateAge(patient.dob),
+            // An absent gender takes the exported default, as in the Python predictor
+            ...(patient.gender != null ? { gender: patient.gender } : {}),
+          }).ml_probability
+        : this.simulateMLPrediction(patient, predictionData);
 
       // Get age group and multiplier
       const age = patient.age || this.calculateAge(patient.dob);
@@ -0,0 +1,312 @@
+import { existsSync, readFileSync } from 'fs';
+
+/**
+ * Evaluator for portable model documents ('relayloop-portable', version 1)
+ * written by server/src/services/portable_export.py.
+ *
+ * Mirrors the Python reference evaluator in that file: inputs are validated
+ * against the exported schema, rounded to float32 and walked through flat
+ * node arrays, so the trained ensemble can be scored without spawning Python.
+ */
+
+export const PORTABLE_FORMAT = 'relayloop-portable';
+export const PORTABLE_VERSION = 1;
+
+const NUMBER = /^[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$/;
+
+interface DerivedOp {
+  op: 'sum' | 'copy' | 'below' | 'above' | 'outside' | 'any';
+  field?: string;
+  fields?: string[];
+  value?: number;
+  low?: number;
+  high?: number;
+  terms?: DerivedOp[];
+}
+
+interface PortableColumn extends DerivedOp {
+  name: string;
+  kind: 'numeric' | 'derived' | 'categorical';
+  codes?: Record<string, number>;
+  default?: string;
+}
+
+interface PortableTreeModel {
+  type: 'forest' | 'boosting';
+  roots: number[];
+  feature: number[];
+  threshold: number[];
+  left: number[];
+  right: number[];
+  value: number[];
+  value_scale?: number;
+  init_raw?: number;
+  divergence_bound: number;
+}
+
+interface PortableLogisticModel {
+  type: 'logistic';
+  coef: number[];
+  intercept: number;
+  divergence_bound: number;
+}
+
+export interface PortableDocument {
+  format: string;
+  version: number;
+  model_version: string | null;
+  input: { schema: Record<string, [string, number, number]>; binary_words: Record<string, number> };
+  age_group: {
+    field: string;
+    fallback_field: string;
+    default_age: number;
+    labels: Record<string, string>;
+    ranges: Record<string, [number, number]>;
+    unknown: string;
+  };
+  context: Record<string, string>;
+  numeric_inputs: Record<string, number>;
+  columns: PortableColumn[];
+  scaler?: { mean: number[]; scale: number[]; precision?: 'float32' | 'float64' };
+  models: Record<string, PortableTreeModel | PortableLogisticModel>;
+  ensemble: { combine: 'mean'; default_probability: number; tolerance: number };
+}
+
+export interface PortablePrediction {
+  ml_probability: number;
+  models: Record<string, number>;
+}
+
+export interface GoldenReport {
+  cases: number;
+  max_abs_diff: number;
+  tolerance: number;
+  passed: boolean;
+  failures: { case: number; diff: number; models: string[] }[];
+}
+
+export interface VerifiedModel {
+  model: PortableModel;
+  report: GoldenReport | null;
+}
+
+const sigmoid = (x: number): number => 1.0 / (1.0 + Math.exp(-x));
+
+function derive(column: DerivedOp, values: Record<string, number>): number {
+  switch (column.op) {
+    case 'sum': {
+      let total = 0.0;
+      for (const field of column.fields) {
+        total = Math.fround(total + values[field]);
+      }
+      return total;
+    }
+    case 'copy':
+      return values[column.field];
+    case 'below':
+      return values[column.field] < column.value ? 1 : 0;
+    case 'above':
+      return values[column.field] > column.value ? 1 : 0;
+    case 'outside': {
+      const value = values[column.field];
+      return value < column.low || value > column.high ? 1 : 0;
+    }
+    case 'any':
+      return column.terms.some((term) => derive(term, values) === 1) ? 1 : 0;
+    default:
+      throw new Error(`Unknown derived op: ${column.op}`);
+  }
+}
+
+/**
+ * Category codes are keyed by Python's str() of the value
+ */
+function categoryText(value: any): string {
+  if (value === null) return 'None';
+  if (value === true) return 'True';
+  if (value === false) return 'False';
+  return String(value);
+}
+
+export class PortableModel {
+  readonly modelVersion: string | null;
+
+  constructor(private readonly document: PortableDocument) {
+    if (document.format !== PORTABLE_FORMAT) {
+      throw new Error(`Not a ${PORTABLE_FORMAT} document`);
+    }
+    if ((document.version || 0) > PORTABLE_VERSION) {
+      throw new Error(`Unsupported portable version ${document.version}`);
+    }
+    this.modelVersion = document.model_version;
+  }
+
+  static load(path: string): PortableModel {
+    return new PortableModel(JSON.parse(readFileSync(path, 'utf-8')));
+  }
+
+  /**
+   * Validated number for a field, or null when the feature default applies
+   */
+  private inputValue(field: string, raw: any): number | null {
+    const limits = this.document.input.schema[field];
+    const binary = limits !== undefined && limits[0] === 'binary';
+    let value: number;
+    if (raw === null || raw === undefined) {
+      return null;
+    } else if (typeof raw === 'boolean') {
+      value = raw ? 1 : 0;
+    } else if (typeof raw === 'number') {
+      value = raw;
+    } else if (typeof raw === 'string') {
+      const text = raw.trim();
+      const word = this.document.input.binary_words[text.toLowerCase()];
+      if (binary && word !== undefined) {
+        value = word;
+      } else if (NUMBER.test(text)) {
+        value = parseFloat(text);
+      } else {
+        return null;
+      }
+    } else {
+      return null;
+    }
+    if (!Number.isFinite(value)) return null;
+    if (limits === undefined) return value;
+    if (binary) return value === 0 || value === 1 ? value : null;
+    return limits[1] <= value && value <= limits[2] ? value : null;
+  }
+
+  private ageGroup(record: Record<string, any>): string {
+    const spec = this.document.age_group;
+    let age = record[spec.field];
+    if (!(spec.field in record)) {
+      age = spec.fallback_field in record ? record[spec.fallback_field] : spec.default_age;
+    }
+    if (typeof age === 'string') {
+      return spec.labels[age.trim()] ?? spec.unknown;
+    }
+    if (typeof age === 'number' && !Number.isNaN(age)) {
+      for (const [group, [low, high]] of Object.entries(spec.ranges)) {
+        if (low <= age && age <= high) return group;
+      }
+    }
+    return spec.unknown;
+  }
+
+  /**
+   * Model input row (float32 values) of one payload
+   */
+  features(record: Record<string, any>): Float32Array {
+    const context = { ...this.document.context, age_group: this.ageGroup(record) };
+    const numeric: Record<string, number> = {};
+    for (const [field, fallback] of Object.entries(this.document.numeric_inputs)) {
+      const value = this.inputValue(field, record[field]);
+      numeric[field] = Math.fround(value === null ? fallback : value);
+    }
+
+    const columns = this.document.columns;
+    const row = new Float32Array(columns.length);
+    columns.forEach((column, j) => {
+      if (column.kind === 'numeric') {
+        row[j] = numeric[column.field];
+      } else if (column.kind === 'derived') {
+        row[j] = derive(column, numeric);
+      } else {
+        const field = column.field;
+        const value = field in context ? context[field] : field in record ? record[field] : column.default;
+        row[j] = column.codes[categoryText(value)] ?? 0;
+      }
+    });
+    return row;
+  }
+
+  private treeOutput(model: PortableTreeModel, row: Float32Array): number {
+    const { feature, threshold, left, right, value } = model;
+    const boosting = model.type === 'boosting';
+    let total = 0.0;
+    for (const root of model.roots) {
+      let node = root;
+      while (feature[node] >= 0) {
+        node = row[feature[node]] <= Math.fround(threshold[node]) ? left[node] : right[node];
+      }
+      // Boosting leaf values are float32; forest values are integer counts of value_scale
+      total += boosting ? Math.fround(value[node]) : value[node];
+    }
+    if (model.type === 'forest') {
+      return total / model.roots.length / model.value_scale;
+    }
+    return sigmoid(model.init_raw + total);
+  }
+
+  predict(record: Record<string, any>): PortablePrediction {
+    const row = this.features(record);
+    const outputs: Record<string, number> = {};
+    for (const [name, model] of Object.entries(this.document.models)) {
+      if (model.type === 'logistic') {
+        const { mean, scale, precision } = this.document.scaler;
+        const rounded = precision === 'float32';
+        let z = model.intercept;
+        for (let i = 0; i < model.coef.length; i++) {
+          const scaled = rounded
+            ? Math.fround(Math.fround(row[i] - Math.fround(mean[i])) / Math.fround(scale[i]))
+            : (row[i] - mean[i]) / scale[i];
+          z += scaled * model.coef[i];
+        }
+        outputs[name] = sigmoid(z);
+      } else {
+        outputs[name] = this.treeOutput(model, row);
+      }
+    }
+    const values = Object.values(outputs);
+    const mlProbability = values.length
+      ? values.reduce((sum, v) => sum + v, 0) / values.length
+      : this.document.ensemble.default_probability;
+    return { ml_probability: mlProbability, models: outputs };
+  }
+}
+
+/**
+ * Golden set written next to a portable model: model.json -> model.golden.json
+ */
+export function goldenPath(path: string): string {
+  return path.endsWith('.json') ? `${path.slice(0, -'.json'.length)}.golden.json` : `${path}.golden.json`;
+}
+
+/**
+ * Compare the evaluator against the golden outputs of the Python predictor
+ */
+export function verifyGoldenSet(model: PortableModel, golden: any): GoldenReport {
+  let maxDiff = 0;
+  const failures: GoldenReport['failures'] = [];
+  golden.cases.forEach((testCase: any, i: number) => {
+    const actual = model.predict(testCase.input);
+    const diff = Math.abs(actual.ml_probability - testCase.ml_probability);
+    maxDiff = Math.max(maxDiff, diff);
+    const bad = Object.entries(testCase.models as Record<string, number>)
+      .filter(([name, expected]) => !(Math.abs(actual.models[name] - expected) <= golden.model_tolerance[name]))
+      .map(([name]) => name);
+    if (!(diff <= golden.tolerance) || bad.length) {
+      failures.push({ case: i, diff, models: bad });
+    }
+  });
+  return {
+    cases: golden.cases.length,
+    max_abs_diff: maxDiff,
+    tolerance: golden.tolerance,
+    passed: failures.length === 0,
+    failures: failures.slice(0, 10),
+  };
+}
+
+/**
+ * Load a portable model and check it against its golden set when one is present
+ */
+export function loadVerifiedModel(path: string): VerifiedModel {
+  const model = PortableModel.load(path);
+  const golden = goldenPath(path);
+  if (!existsSync(golden)) {
+    return { model, report: null };
+  }
+  return { model, report: verifyGoldenSet(model, JSON.parse(readFileSync(golden, 'utf-8'))) };
+}
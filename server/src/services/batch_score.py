@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch Scoring for RelayLoop
+Rescores a patient CSV (e.g. dataset/cleaned_patient_dataset.csv or
+data/hospital_readmissions.csv) with the enhanced model in a process pool and
+streams the results to an output CSV.
+
+The model is loaded once in the parent before the pool starts, so forked
+workers share it copy-on-write. Progress is checkpointed next to the output
+after every chunk; --resume continues from the last completed chunk.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import pandas as pd
+from multiprocessing import Pool
+from typing import Dict, Any, Optional
+
+OUTPUT_COLUMNS = [
+    'row', 'patient_id', 'risk_level', 'risk_percentage', 'ml_probability', 'clinical_score',
+    'confidence', 'age_group', 'risk_factor_mask'
+]
+
+# Set in the parent (inherited by forked workers) or by _init_worker
+_PREDICTOR = None
+
+
+def load_predictor(artifact: Optional[str] = None, data_path: Optional[str] = None):
+    """Load a compact artifact, or train the enhanced model from data_path"""
+    if artifact:
+        from model_artifacts import load_compact_predictor
+        return load_compact_predictor(artifact)
+
+    from enhanced_predictor import MLPredictionService
+    service = MLPredictionService()
+    # Training progress goes to stderr so it cannot be confused with results
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        service.initialize(data_path)
+    finally:
+        sys.stdout = stdout
+    return service.predictor
+
+
+def _init_worker(artifact: Optional[str], data_path: Optional[str]):
+    global _PREDICTOR
+    if _PREDICTOR is None:
+        _PREDICTOR = load_predictor(artifact, data_path)
+
+
+def _score_chunk(chunk: pd.DataFrame):
+    """Worker entry point: score one chunk and render it as CSV text"""
+    results = _PREDICTOR.predict_batch(chunk)
+    results.insert(0, 'row', chunk.index)
+    results.insert(1, 'patient_id', chunk['patient_id'].to_numpy() if 'patient_id' in chunk.columns else chunk.index)
+    return results[OUTPUT_COLUMNS].to_csv(index=False, header=False), len(chunk)
+
+
+class Checkpoint:
+    """Progress file written atomically after each completed chunk"""
+
+    def __init__(self, output: str):
+        self.path = output + '.progress'
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def save(self, state: Dict[str, Any]):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+
+def score_file(input_path: str, output_path: str, chunk_size: int = 50000, workers: Optional[int] = None,
+               artifact: Optional[str] = None, data_path: Optional[str] = None, resume: bool = False,
+               progress: bool = True) -> Dict[str, Any]:
+    """Score every row of input_path and write one result row per input row"""
+    global _PREDICTOR
+
+    checkpoint = Checkpoint(output_path)
+    state = checkpoint.load() if resume else None
+    if state and (state['input'] != os.path.abspath(input_path) or state['chunk_size'] != chunk_size):
+        raise ValueError(f'{checkpoint.path} belongs to a different input or chunk size')
+    if state is None:
+        state = {'input': os.path.abspath(input_path), 'chunk_size': chunk_size,
+                 'rows_done': 0, 'output_bytes': 0, 'complete': False}
+    if state['complete']:
+        return state
+
+    _PREDICTOR = load_predictor(artifact, data_path)
+
+    # Drop anything written after the last checkpoint, then append
+    mode = 'r+b' if state['output_bytes'] else 'wb'
+    start = time.perf_counter()
+    rows_at_start = state['rows_done']
+    total_rows = count_rows(input_path) if progress else 0
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    with open(output_path, mode) as out:
+        if state['output_bytes']:
+            out.seek(state['output_bytes'])
+            out.truncate()
+        else:
+            out.write((','.join(OUTPUT_COLUMNS) + '\n').encode('utf-8'))
+
+        reader = pd.read_csv(input_path, chunksize=chunk_size, skiprows=range(1, state['rows_done'] + 1))
+        chunks = _numbered_chunks(reader, state['rows_done'])
+
+        with Pool(processes=workers, initializer=_init_worker, initargs=(artifact, data_path)) as pool:
+            for rendered, rows in pool.imap(_score_chunk, chunks):
+                out.write(rendered.encode('utf-8'))
+                out.flush()
+                state['rows_done'] += rows
+                state['output_bytes'] = out.tell()
+                checkpoint.save(state)
+
+                if progress:
+                    rate = (state['rows_done'] - rows_at_start) / max(time.perf_counter() - start, 1e-9)
+                    print(f"\r{state['rows_done']:,}/{total_rows:,} rows scored ({rate:,.0f} rows/s)",
+                          end='', file=sys.stderr)
+
+    if progress:
+        print(file=sys.stderr)
+    state['complete'] = True
+    checkpoint.save(state)
+    state['seconds'] = round(time.perf_counter() - start, 2)
+    return state
+
+
+def count_rows(path: str) -> int:
+    """Count data rows by scanning for newlines (much faster than parsing)"""
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def _numbered_chunks(reader, first_row: int):
+    """Give each chunk a global row index so output rows can be traced back"""
+    for chunk in reader:
+        chunk.index = pd.RangeIndex(first_row, first_row + len(chunk))
+        first_row += len(chunk)
+        yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a patient CSV with the enhanced readmission model')
+    parser.add_argument('input', help='Input CSV file')
+    parser.add_argument('output', help='Output CSV file')
+    parser.add_argument('--artifact', default=None, help='Compact model artifact (.npz); trains from --data-path if omitted')
+    parser.add_argument('--data-path', default=None, help='Training data directory when no artifact is given')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='Rows per chunk')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--resume', action='store_true', help='Continue from the last checkpoint')
+    args = parser.parse_args()
+
+    summary = score_file(args.input, args.output, args.chunk_size, args.workers,
+                         args.artifact, args.data_path, args.resume)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
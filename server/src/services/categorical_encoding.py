@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sparse Categorical Encoding for RelayLoop
+Encodes high-cardinality categoricals such as medical_specialty and the
+diag_1..diag_3 groups of hospital_readmissions.csv into a CSR block instead
+of label codes or keyword-matched numeric columns.
+
+Two modes, both with a fixed upper bound on width and memory:
+  onehot  one column per value seen in training (at most max_categories per
+          column, by frequency) plus one '<column>=__other__' column for the rest
+  hash    every 'column=value' pair hashed (CRC32) into n_features shared
+          columns; no vocabulary to grow, collisions add up
+
+Missing values produce no entry. The fitted vocabulary round-trips through
+to_dict/from_dict so serving uses the exact training layout, and encoding a
+request is one dict lookup per column.
+
+Inspect the encoding of a CSV:
+    python categorical_encoding.py ../../../dataset/hospital_readmissions.csv --mode hash
+"""
+
+import argparse
+import json
+import zlib
+from collections import Counter
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Categorical columns of the hospital readmissions dataset
+HOSPITAL_CATEGORICALS = ['medical_specialty', 'diag_1', 'diag_2', 'diag_3',
+                         'glucose_test', 'A1Ctest', 'change', 'diabetes_med']
+
+OTHER = '__other__'
+
+DEFAULT_MAX_CATEGORIES = 64
+DEFAULT_HASH_FEATURES = 1024
+
+# Hash memo entries kept before the memo is reset
+HASH_MEMO_LIMIT = 100000
+
+
+def _normalize(value) -> Optional[str]:
+    """Category text of a raw value, None when missing"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    text = str(value).strip()
+    return text or None
+
+
+class SparseCategoricalEncoder:
+    """One-hot or hashed encoding of categorical columns into a bounded CSR block"""
+
+    def __init__(self, columns: Optional[List[str]] = None, mode: str = 'onehot',
+                 max_categories: int = DEFAULT_MAX_CATEGORIES, n_features: int = DEFAULT_HASH_FEATURES,
+                 min_count: int = 1):
+        if mode not in ('onehot', 'hash'):
+            raise ValueError(f'Unknown encoding mode: {mode}')
+        self.columns = list(columns or HOSPITAL_CATEGORICALS)
+        self.mode = mode
+        self.max_categories = max_categories
+        self.n_features = n_features
+        self.min_count = min_count
+        self.vocabulary = {}  # onehot: column -> kept values, in output order
+        self._index = {}  # column -> {value: output column}
+        self._hash_memo = {}
+        self.feature_names = []
+        if mode == 'hash':
+            self._build_layout()
+
+    @property
+    def fitted(self) -> bool:
+        return self.mode == 'hash' or bool(self.vocabulary)
+
+    @property
+    def width(self) -> int:
+        return len(self.feature_names)
+
+    def fit(self, df: pd.DataFrame) -> 'SparseCategoricalEncoder':
+        """Learn the per-column vocabulary (no-op in hash mode)"""
+        if self.mode == 'hash':
+            return self
+        for col in self.columns:
+            counts = Counter()
+            if col in df.columns:
+                values = df[col].map(_normalize).dropna()
+                counts.update(values.tolist())
+            kept = [value for value, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+                    if count >= self.min_count]
+            self.vocabulary[col] = kept[:self.max_categories]
+        self._build_layout()
+        return self
+
+    def _build_layout(self):
+        if self.mode == 'hash':
+            self.feature_names = [f'hash_{i:05d}' for i in range(self.n_features)]
+            return
+        self._index, self.feature_names = {}, []
+        for col in self.columns:
+            index = {}
+            for value in self.vocabulary.get(col, []) + [OTHER]:
+                index[value] = len(self.feature_names)
+                self.feature_names.append(f'{col}={value}')
+            self._index[col] = index
+
+    def _lookup(self, col: str, value: str) -> int:
+        """Output column of one category: a dict lookup (hash mode memoizes the CRC)"""
+        if self.mode == 'onehot':
+            index = self._index[col]
+            return index.get(value, index[OTHER])
+        key = f'{col}={value}'
+        position = self._hash_memo.get(key)
+        if position is None:
+            if len(self._hash_memo) >= HASH_MEMO_LIMIT:
+                self._hash_memo.clear()
+            position = self._hash_memo[key] = zlib.crc32(key.encode('utf-8')) % self.n_features
+        return position
+
+    def transform(self, df: pd.DataFrame) -> sp.csr_matrix:
+        """(n, width) float32 CSR; each distinct value is looked up once per column"""
+        if not self.fitted:
+            raise ValueError('Encoder must be fitted before transform')
+        n = len(df)
+        rows, cols = [], []
+        for col in self.columns:
+            if col not in df.columns:
+                continue
+            codes, uniques = pd.factorize(df[col].map(_normalize))
+            if not len(uniques):
+                continue
+            positions = np.array([self._lookup(col, value) for value in uniques], dtype=np.int32)
+            present = codes >= 0
+            rows.append(np.flatnonzero(present).astype(np.int32))
+            cols.append(positions[codes[present]])
+        if not rows:
+            return sp.csr_matrix((n, self.width), dtype=np.float32)
+        row, col = np.concatenate(rows), np.concatenate(cols)
+        # Hash collisions within a row add up
+        return sp.csr_matrix((np.ones(len(row), dtype=np.float32), (row, col)), shape=(n, self.width))
+
+    def transform_records(self, records: List[Dict[str, Any]]) -> np.ndarray:
+        """(n, width) float32 dense block for request payloads"""
+        out = np.zeros((len(records), self.width), dtype=np.float32)
+        for i, record in enumerate(records):
+            for col in self.columns:
+                value = _normalize(record.get(col))
+                if value is not None:
+                    out[i, self._lookup(col, value)] += 1.0
+        return out
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'mode': self.mode, 'columns': self.columns, 'max_categories': self.max_categories,
+                'n_features': self.n_features, 'min_count': self.min_count, 'vocabulary': self.vocabulary}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'SparseCategoricalEncoder':
+        encoder = cls(data['columns'], data.get('mode', 'onehot'), data.get('max_categories', DEFAULT_MAX_CATEGORIES),
+                      data.get('n_features', DEFAULT_HASH_FEATURES), data.get('min_count', 1))
+        if encoder.mode == 'onehot':
+            encoder.vocabulary = {col: list(values) for col, values in data.get('vocabulary', {}).items()}
+            encoder._build_layout()
+        return encoder
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the sparse categorical encoding of a CSV')
+    parser.add_argument('csv', help='Input CSV')
+    parser.add_argument('--mode', choices=['onehot', 'hash'], default='onehot')
+    parser.add_argument('--columns', default=','.join(HOSPITAL_CATEGORICALS), help='Comma-separated columns')
+    parser.add_argument('--max-categories', type=int, default=DEFAULT_MAX_CATEGORIES)
+    parser.add_argument('--n-features', type=int, default=DEFAULT_HASH_FEATURES)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv)
+    encoder = SparseCategoricalEncoder(args.columns.split(','), args.mode, args.max_categories,
+                                       args.n_features).fit(df)
+    X = encoder.transform(df)
+    print(json.dumps({
+        'rows': len(df),
+        'mode': encoder.mode,
+        'width': encoder.width,
+        'nnz': int(X.nnz),
+        'csr_bytes': int(X.data.nbytes + X.indices.nbytes + X.indptr.nbytes),
+        'dense_float32_bytes': len(df) * encoder.width * 4,
+        'vocabulary_sizes': {col: len(values) for col, values in encoder.vocabulary.items()}
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
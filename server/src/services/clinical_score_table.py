@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Clinical Score Table for RelayLoop
+Compiles the rule-based clinical score into a packed condition index and a
+precomputed table, so scoring a request is one lookup instead of
+re-evaluating the rules and summing weights.
+
+The index packs the age group (3 bits) and one bit per rule condition. Every
+index maps to the clinical score, the risk factor mask, the critical-override
+flag, and the probability and recommendation id the service returns when the
+clinical score stands alone (no model output). Sums are taken in the same
+order as the rules, so table scores equal the per-call ones exactly.
+
+ClinicalWeights is a dict that counts its changes; a table is rebuilt on
+first use after its weights or age multipliers change.
+
+    python clinical_score_table.py '{"age": 82, "diabetes": 1, "urea": 9.1}'
+"""
+
+import json
+import sys
+import time
+from typing import Dict, Any, Tuple
+
+import numpy as np
+
+from risk_factors import BIT, CONDITION_CODES, VALUE_FEATURES
+
+AGE_GROUPS = ['Young_Adult', 'Middle_Adult', 'Mature_Adult', 'Senior', 'Elderly']
+AGE_BITS = 3
+
+# Conditions after the age group, in index bit order; critical_labs is the
+# critical override other than ICU (severe anemia, thrombocytopenia, uremia or a very long stay)
+CONDITIONS = CONDITION_CODES + ['icu_admission', 'low_hemoglobin', 'low_platelets', 'high_urea',
+                                'covid_positive', 'long_stay', 'frequent_admissions', 'high_medications',
+                                'critical_labs']
+INDEX_BIT = {condition: 1 << (AGE_BITS + i) for i, condition in enumerate(CONDITIONS)}
+TABLE_SIZE = 1 << (AGE_BITS + len(CONDITIONS))
+
+# Risk level thresholds and the floor applied by the critical override
+HIGH_RISK = 0.55
+MEDIUM_RISK = 0.25
+URGENT_RISK = 0.75
+CRITICAL_FLOOR = 0.70
+
+RECOMMENDATIONS = [
+    "LOW RISK: Standard discharge planning, routine follow-up in 1-2 weeks, patient education materials",
+    "MODERATE RISK: Enhanced discharge planning, medication reconciliation, patient education, 3-7 day follow-up",
+    "HIGH RISK: Comprehensive discharge planning, case management, transitional care, 24-48h post-discharge contact",
+    "URGENT: Comprehensive discharge planning, intensive case management, transitional care team, 24h post-discharge contact, consider delaying discharge"
+]
+
+
+def risk_level(probability: float) -> str:
+    if probability >= HIGH_RISK:
+        return 'high'
+    elif probability >= MEDIUM_RISK:
+        return 'medium'
+    return 'low'
+
+
+def recommendation_id(probability: float) -> int:
+    """Index into RECOMMENDATIONS for a final probability"""
+    if probability >= HIGH_RISK:
+        return 3 if probability >= URGENT_RISK else 2
+    return 1 if probability >= MEDIUM_RISK else 0
+
+
+def age_band(age: float) -> int:
+    """Index into AGE_GROUPS"""
+    if age < 35:
+        return 0
+    elif age < 50:
+        return 1
+    elif age < 65:
+        return 2
+    elif age < 80:
+        return 3
+    return 4
+
+
+def condition_index(patient_data: Dict[str, Any]) -> int:
+    """Packed condition index of a validated payload (absent fields take the rule defaults)"""
+    get = patient_data.get
+    index = age_band(get('age', 50))
+    for condition in CONDITION_CODES:
+        if get(condition, 0) == 1:
+            index |= INDEX_BIT[condition]
+    if get('intensive_care_unit_admission', 0) == 1:
+        index |= INDEX_BIT['icu_admission']
+    hb = get('hemoglobin', 13.0)
+    if 0 < hb < 12:
+        index |= INDEX_BIT['low_hemoglobin']
+    platelets = get('platelets', 250.0)
+    if 0 < platelets < 150:
+        index |= INDEX_BIT['low_platelets']
+    urea = get('urea', 5.0)
+    if urea > 7.5:
+        index |= INDEX_BIT['high_urea']
+    if get('sars_cov2_exam_result', 0) == 1:
+        index |= INDEX_BIT['covid_positive']
+    los = get('length_of_stay', 5)
+    if los > 10:
+        index |= INDEX_BIT['long_stay']
+    if get('previous_admissions', 0) >= 2:
+        index |= INDEX_BIT['frequent_admissions']
+    if get('num_medications', 5) >= 10:
+        index |= INDEX_BIT['high_medications']
+    if hb < 8 or platelets < 50 or urea > 20 or los > 20:
+        index |= INDEX_BIT['critical_labs']
+    return index
+
+
+class ClinicalWeights(dict):
+    """Weight dict whose version changes on every modification"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def _changed(self):
+        self.version += 1
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def __ior__(self, other):
+        result = super().__ior__(other)
+        self._changed()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._changed()
+        return super().setdefault(key, default)
+
+    def pop(self, key, *default):
+        self._changed()
+        return super().pop(key, *default)
+
+    def popitem(self):
+        self._changed()
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+
+def _state(weights: Dict[str, float]):
+    """What a table must match: the version of a ClinicalWeights, a snapshot of a plain dict"""
+    version = getattr(weights, 'version', None)
+    return version if version is not None else dict(weights)
+
+
+class ClinicalScoreTable:
+    """Scores, masks, critical flags and clinical-only outcomes for every condition index"""
+
+    def __init__(self, weights: Dict[str, float], age_multipliers: Dict[str, float]):
+        start = time.perf_counter()
+        self.weights = weights
+        self.age_multipliers = age_multipliers
+        self._state = (_state(weights), _state(age_multipliers))
+
+        index = np.arange(TABLE_SIZE, dtype=np.int64)
+        band = index & ((1 << AGE_BITS) - 1)
+        has = {condition: (index & bit) != 0 for condition, bit in INDEX_BIT.items()}
+
+        # Same addition order as the rules; adding 0.0 for an unset condition leaves the sum unchanged
+        score = np.zeros(TABLE_SIZE, dtype=np.float64)
+        mask = np.zeros(TABLE_SIZE, dtype=np.int64)
+
+        def add(flag, code, weight):
+            nonlocal score
+            score = score + np.where(flag, weight, 0.0)
+            mask[flag] |= BIT[code]
+
+        add(band == 4, 'age_elderly', weights['age_elderly'])
+        add(band == 3, 'age_senior', weights['age_senior'])
+        active = np.zeros(TABLE_SIZE, dtype=np.int64)
+        for condition in CONDITION_CODES:
+            add(has[condition], condition, weights.get(condition, 0.08))
+            active += has[condition]
+        add(active >= 3, 'multiple_comorbidities', weights['multiple_comorbidities'])
+        for condition in CONDITIONS[len(CONDITION_CODES):-1]:
+            add(has[condition], condition, weights[condition])
+        score = np.minimum(score, 1.0)
+
+        critical = has['icu_admission'] | has['critical_labs']
+        mask[critical] |= BIT['critical_conditions']
+
+        # Clinical-only outcome: the score times the age multiplier, then the critical floor
+        multiplier = np.array([age_multipliers.get(group, 1.0) for group in AGE_GROUPS] + [1.0] * 3)[band]
+        probability = np.minimum(score * multiplier, 1.0)
+        probability = np.where(critical, np.maximum(probability, CRITICAL_FLOOR), probability)
+        recommendation = np.where(probability >= HIGH_RISK, np.where(probability >= URGENT_RISK, 3, 2),
+                                  np.where(probability >= MEDIUM_RISK, 1, 0))
+
+        self.score = score
+        self.mask = mask.astype(np.int32)
+        self.critical = critical
+        self.clinical_probability = probability
+        self.recommendation = recommendation.astype(np.uint8)
+        self.build_seconds = time.perf_counter() - start
+
+    def matches(self, weights: Dict[str, float], age_multipliers: Dict[str, float]) -> bool:
+        """True while built from these weight objects and neither has changed since"""
+        return (weights is self.weights and age_multipliers is self.age_multipliers
+                and self._state == (_state(weights), _state(age_multipliers)))
+
+    def lookup(self, patient_data: Dict[str, Any]) -> Tuple[int, float, int, bool]:
+        """(index, clinical score, risk factor mask without critical_conditions, critical) of a payload"""
+        index = condition_index(patient_data)
+        mask = int(self.mask[index])
+        return index, float(self.score[index]), mask & ~BIT['critical_conditions'], bool(self.critical[index])
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.score, self.mask, self.critical, self.clinical_probability,
+                                      self.recommendation))
+
+
+def quoted_values(mask: int, patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Measurements quoted by the value-carrying risk factors of a mask"""
+    return {code: patient_data[feature] for code, feature in VALUE_FEATURES.items() if mask & BIT[code]}
+
+
+def main():
+    from ml_prediction_service import ml_service
+    patient = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+    table = ml_service.clinical_table()
+    index, score, mask, critical = table.lookup(patient)
+    print(json.dumps({
+        'index': index,
+        'age_group': AGE_GROUPS[index & ((1 << AGE_BITS) - 1)],
+        'conditions': [c for c in CONDITIONS if index & INDEX_BIT[c]],
+        'clinical_score': score,
+        'risk_factor_mask': mask,
+        'critical': critical,
+        'clinical_only_probability': float(table.clinical_probability[index]),
+        'clinical_only_recommendation': RECOMMENDATIONS[table.recommendation[index]],
+        'table_entries': TABLE_SIZE,
+        'table_bytes': table.nbytes(),
+        'build_seconds': round(table.build_seconds, 4)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cohort Risk Rollups for RelayLoop
+Maintains admin analytics (risk-level counts, mean risk percentage, risk
+percentage histogram and top risk factors, by code for coded predictions)
+per department, age group and day as predictions are produced, instead of
+scanning ml_predictions for every dashboard request.
+
+Every prediction updates one bucket in each view (day, department,
+age_group, their pairs and the overall total), so adding costs O(1) and a
+dashboard query is a dictionary lookup. Buckets are plain counters, so two
+rollups (e.g. from different runner processes) merge by addition. Departments
+come from the prescribing doctor (users.department), supplied as a
+doctor_id -> department mapping.
+
+Rebuild from the table in one streaming pass:
+    python cohort_rollups.py rollups.json.gz --sqlite predictions.db --departments doctors.json
+Query:
+    python cohort_rollups.py rollups.json.gz --query department=Cardiology --query day=2026-10-19
+"""
+
+import argparse
+import gzip
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Iterable, Tuple
+
+from risk_factors import factor_codes
+
+RISK_LEVELS = ('low', 'medium', 'high')
+DIMENSIONS = ('day', 'department', 'age_group')
+
+# Every dashboard slice that is answered without a scan
+VIEWS = [(), ('day',), ('department',), ('age_group',),
+         ('day', 'department'), ('day', 'age_group'), ('department', 'age_group')]
+
+# Risk percentage histogram: HISTOGRAM_BINS equal bins over 0-100
+HISTOGRAM_BINS = 20
+
+UNASSIGNED = 'Unassigned'
+
+# Rollup file layout version
+FORMAT_VERSION = 1
+
+
+class RiskBucket:
+    """Mergeable counters for one cohort slice"""
+
+    __slots__ = ('count', 'levels', 'risk_sum', 'histogram', 'factors')
+
+    def __init__(self):
+        self.count = 0
+        self.levels = [0] * len(RISK_LEVELS)
+        self.risk_sum = 0.0
+        self.histogram = [0] * HISTOGRAM_BINS
+        self.factors = Counter()
+
+    def add(self, level_index: int, risk_percentage: float, bin_index: int, risk_factors: Iterable[str]):
+        self.count += 1
+        self.levels[level_index] += 1
+        self.risk_sum += risk_percentage
+        self.histogram[bin_index] += 1
+        self.factors.update(risk_factors)
+
+    def merge(self, other: 'RiskBucket'):
+        self.count += other.count
+        self.risk_sum += other.risk_sum
+        for i, value in enumerate(other.levels):
+            self.levels[i] += value
+        for i, value in enumerate(other.histogram):
+            self.histogram[i] += value
+        self.factors.update(other.factors)
+
+    def summary(self, top_factors: int = 5) -> Dict[str, Any]:
+        return {
+            'predictions': self.count,
+            'risk_levels': dict(zip(RISK_LEVELS, self.levels)),
+            'mean_risk_percentage': round(self.risk_sum / self.count, 2) if self.count else None,
+            'risk_histogram': self.histogram,
+            'top_risk_factors': self.factors.most_common(top_factors)
+        }
+
+    def to_list(self) -> List[Any]:
+        return [self.count, self.levels, round(self.risk_sum, 4), self.histogram, dict(self.factors)]
+
+    @classmethod
+    def from_list(cls, data: List[Any]) -> 'RiskBucket':
+        bucket = cls()
+        bucket.count, bucket.levels, bucket.risk_sum, bucket.histogram = data[0], list(data[1]), data[2], list(data[3])
+        bucket.factors = Counter(data[4])
+        return bucket
+
+
+def _day(timestamp) -> str:
+    """UTC calendar day of a datetime, ISO string or epoch seconds (today when None)"""
+    if timestamp is None:
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    if isinstance(timestamp, (int, float)):
+        return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+    if not isinstance(timestamp, datetime):
+        timestamp = datetime.fromisoformat(str(timestamp).replace('Z', '+00:00'))
+    # Naive timestamps (SQLite CURRENT_TIMESTAMP) are already UTC
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return timestamp.strftime('%Y-%m-%d')
+
+
+class CohortRollups:
+    """Incrementally maintained risk rollups for every dashboard view"""
+
+    def __init__(self, departments: Optional[Dict[str, str]] = None):
+        self.departments = dict(departments or {})
+        self.views = {view: {} for view in VIEWS}
+        self.updated_at = None
+
+    def add(self, risk_level: str, risk_percentage: float, age_group: str = 'Unknown',
+            risk_factors: Iterable[str] = (), doctor_id: Optional[str] = None,
+            department: Optional[str] = None, predicted_at=None):
+        """Count one prediction in every view"""
+        if risk_level not in RISK_LEVELS:
+            return
+        risk_percentage = float(risk_percentage or 0.0)
+        level_index = RISK_LEVELS.index(risk_level)
+        bin_index = min(max(int(risk_percentage * HISTOGRAM_BINS / 100.0), 0), HISTOGRAM_BINS - 1)
+        risk_factors = list(risk_factors or ())
+        if department is None:
+            department = self.departments.get(str(doctor_id), UNASSIGNED) if doctor_id is not None else UNASSIGNED
+        values = {'day': _day(predicted_at), 'department': department, 'age_group': age_group or 'Unknown'}
+
+        for view, buckets in self.views.items():
+            key = tuple(values[dim] for dim in view)
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = RiskBucket()
+            bucket.add(level_index, risk_percentage, bin_index, risk_factors)
+        self.updated_at = time.time()
+
+    def add_prediction(self, prediction: Dict[str, Any], doctor_id: Optional[str] = None,
+                       department: Optional[str] = None, predicted_at=None):
+        """Count a prediction result as returned by the prediction services"""
+        mask = prediction.get('risk_factor_mask')
+        factors = factor_codes(mask) if mask is not None else prediction.get('risk_factors')
+        self.add(prediction.get('risk_level'), prediction.get('risk_percentage'), prediction.get('age_group'),
+                 factors, doctor_id, department, predicted_at)
+
+    def merge(self, other: 'CohortRollups'):
+        for view, buckets in other.views.items():
+            mine = self.views[view]
+            for key, bucket in buckets.items():
+                if key in mine:
+                    mine[key].merge(bucket)
+                else:
+                    mine[key] = RiskBucket.from_list(bucket.to_list())
+        self.updated_at = max(filter(None, [self.updated_at, other.updated_at]), default=None)
+
+    def query(self, top_factors: int = 5, **filters) -> Dict[str, Any]:
+        """Rollup for a slice, e.g. query(department='Cardiology', day='2026-10-19')"""
+        unknown = set(filters) - set(DIMENSIONS)
+        if unknown:
+            raise ValueError(f'Unknown dimensions: {sorted(unknown)}')
+        view = tuple(dim for dim in DIMENSIONS if dim in filters)
+        if view not in self.views:
+            raise ValueError(f'No rollup is kept for {view}')
+        bucket = self.views[view].get(tuple(filters[dim] for dim in view), RiskBucket())
+        return dict(filters, **bucket.summary(top_factors))
+
+    def keys(self, dimension: str) -> List[str]:
+        """Known values of one dimension (e.g. every department seen)"""
+        return sorted(key[0] for key in self.views[(dimension,)])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'format': FORMAT_VERSION,
+            'updated_at': self.updated_at,
+            'histogram_bins': HISTOGRAM_BINS,
+            'views': {'|'.join(view): {'|'.join(key): bucket.to_list() for key, bucket in buckets.items()}
+                      for view, buckets in self.views.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], departments: Optional[Dict[str, str]] = None) -> 'CohortRollups':
+        if data.get('format') != FORMAT_VERSION or data.get('histogram_bins') != HISTOGRAM_BINS:
+            raise ValueError('Rollup file was written with a different layout; rebuild it')
+        rollups = cls(departments)
+        rollups.updated_at = data.get('updated_at')
+        for name, buckets in data['views'].items():
+            view = tuple(name.split('|')) if name else ()
+            rollups.views[view] = {(tuple(key.split('|')) if view else ()): RiskBucket.from_list(value)
+                                   for key, value in buckets.items()}
+        return rollups
+
+    def save(self, path: str):
+        """Write gzipped JSON atomically, so readers never see a partial file"""
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, departments: Optional[Dict[str, str]] = None) -> 'CohortRollups':
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f), departments)
+
+
+def _parse_factors(value) -> List[str]:
+    """risk_factors as stored: JSON text (SQLite), a list (psycopg2) or a {..} array literal"""
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    text = str(value)
+    if text.startswith('['):
+        return json.loads(text)
+    if text.startswith('{'):
+        import csv
+        inner = text[1:-1]
+        return next(csv.reader([inner], escapechar='\\')) if inner else []
+    return [text]
+
+
+ROLLUP_COLUMNS = ['risk_level', 'risk_percentage', 'age_group', 'risk_factors', 'risk_factor_mask',
+                  'doctor_id', 'predicted_at']
+
+
+def iter_sqlite(path: str, batch_size: int = 10000) -> Iterable[Tuple]:
+    """Stream rollup columns from the SQLite stand-in of ml_predictions"""
+    import sqlite3
+    conn = sqlite3.connect(path)
+    try:
+        cursor = conn.execute(f"SELECT {', '.join(ROLLUP_COLUMNS)} FROM ml_predictions")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        conn.close()
+
+
+def iter_postgres(dsn: str, batch_size: int = 10000) -> Iterable[Tuple]:
+    """Stream rollup columns from PostgreSQL through a server-side cursor"""
+    from prediction_writer import POSTGRES_AVAILABLE
+    if not POSTGRES_AVAILABLE:
+        raise ImportError('psycopg2 is required to rebuild from PostgreSQL')
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor(name='cohort_rollups') as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(f"SELECT {', '.join(ROLLUP_COLUMNS)} FROM ml_predictions")
+            yield from cursor
+    finally:
+        conn.close()
+
+
+def rebuild(rows: Iterable[Tuple], departments: Optional[Dict[str, str]] = None) -> CohortRollups:
+    """Fresh rollups from one pass over rows in ROLLUP_COLUMNS order"""
+    rollups = CohortRollups(departments)
+    for risk_level, risk_percentage, age_group, risk_factors, mask, doctor_id, predicted_at in rows:
+        factors = factor_codes(mask) if mask is not None else _parse_factors(risk_factors)
+        rollups.add(risk_level, risk_percentage, age_group, factors, doctor_id=doctor_id, predicted_at=predicted_at)
+    return rollups
+
+
+def load_departments(path: Optional[str]) -> Dict[str, str]:
+    """doctor_id -> department from a JSON object or a users CSV with id and department columns"""
+    if not path:
+        return {}
+    if path.endswith('.json'):
+        with open(path) as f:
+            return {str(k): v for k, v in json.load(f).items()}
+    import csv
+    with open(path, newline='') as f:
+        return {row['id']: row.get('department') or UNASSIGNED for row in csv.DictReader(f)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query cohort risk rollups')
+    parser.add_argument('rollups', help='Rollup file (gzipped JSON)')
+    parser.add_argument('--sqlite', default=None, help='Rebuild from this SQLite ml_predictions database')
+    parser.add_argument('--dsn', default=None, help='Rebuild from PostgreSQL (requires psycopg2)')
+    parser.add_argument('--departments', default=None, help='doctor_id -> department JSON, or users CSV')
+    parser.add_argument('--query', action='append', default=[], metavar='DIMENSION=VALUE',
+                        help='Filter for the printed rollup (repeatable; none = overall)')
+    parser.add_argument('--top-factors', type=int, default=5)
+    args = parser.parse_args()
+
+    departments = load_departments(args.departments)
+    if args.sqlite or args.dsn:
+        start = time.perf_counter()
+        rows = iter_postgres(args.dsn) if args.dsn else iter_sqlite(args.sqlite)
+        rollups = rebuild(rows, departments)
+        rollups.save(args.rollups)
+        print(json.dumps({'rebuilt_predictions': rollups.query()['predictions'],
+                          'seconds': round(time.perf_counter() - start, 3),
+                          'file_bytes': os.path.getsize(args.rollups)}, indent=2))
+    else:
+        rollups = CohortRollups.load(args.rollups, departments)
+
+    filters = dict(q.split('=', 1) for q in args.query)
+    start = time.perf_counter()
+    result = rollups.query(args.top_factors, **filters)
+    result['query_us'] = round((time.perf_counter() - start) * 1e6, 1)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Importable alias for the enhanced readmission predictor
+ml-prediction.service.py cannot be imported by name because of the hyphen,
+so it is loaded by path here and registered under this module's name
+"""
+
+import importlib.util
+import os
+import sys
+
+_MODULE_NAME = 'ml_prediction_enhanced'
+_MODULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ml-prediction.service.py')
+
+
+def _load_enhanced_module():
+    """Load ml-prediction.service.py once and cache it in sys.modules"""
+    if _MODULE_NAME in sys.modules:
+        return sys.modules[_MODULE_NAME]
+
+    spec = importlib.util.spec_from_file_location(_MODULE_NAME, _MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    # Register before executing so pickled predictors resolve their classes
+    sys.modules[_MODULE_NAME] = module
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        del sys.modules[_MODULE_NAME]
+        raise
+    return module
+
+
+_enhanced = _load_enhanced_module()
+
+EnhancedAgeMerger = _enhanced.EnhancedAgeMerger
+EnhancedMedicalPredictor = _enhanced.EnhancedMedicalPredictor
+MLPredictionService = _enhanced.MLPredictionService
+ENHANCED_MODEL_PARAMS = _enhanced.ENHANCED_MODEL_PARAMS
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Feature Specification for RelayLoop
+Single definition of the enhanced model's feature vector. A FeatureSpec is
+persisted with the model and compiled into an extractor that turns patient
+dicts or columnar frames into the same float32 matrix for training and
+serving.
+"""
+
+import numpy as np
+import pandas as pd
+from operator import itemgetter
+from typing import Dict, Any, List, Optional
+
+from payload_validation import coerce_rows
+
+SPEC_VERSION = 1
+
+# Unified input fields and the values used when a source does not provide them
+BASE_DEFAULTS = {
+    'gender': 'Unknown',
+    'diabetes': 0, 'hypertension': 0, 'heart_disease': 0, 'kidney_disease': 0, 'respiratory_disease': 0,
+    'regular_ward_admission': 1, 'semi_intensive_unit_admission': 0, 'intensive_care_unit_admission': 0,
+    'hemoglobin': 13.0, 'hematocrit': 40.0, 'platelets': 250.0, 'red_blood_cells': 4.5,
+    'lymphocytes': 2.0, 'urea': 5.0, 'potassium': 4.0, 'sodium': 140.0,
+    'sars_cov2_exam_result': 0, 'length_of_stay': 5.0, 'num_medications': 5, 'previous_admissions': 0
+}
+
+NUMERIC_FEATURES = [
+    'diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 'respiratory_disease',
+    'regular_ward_admission', 'semi_intensive_unit_admission', 'intensive_care_unit_admission',
+    'hemoglobin', 'hematocrit', 'platelets', 'red_blood_cells', 'lymphocytes', 'urea', 'potassium', 'sodium',
+    'sars_cov2_exam_result', 'length_of_stay', 'num_medications', 'previous_admissions'
+]
+
+# Derived features computed from numeric columns (numpy arrays or pandas Series)
+DERIVED_FEATURES = {
+    'comorbidity_count': lambda c: (c['diabetes'] + c['hypertension'] + c['heart_disease'] +
+                                    c['kidney_disease'] + c['respiratory_disease']),
+    'low_hemoglobin': lambda c: c['hemoglobin'] < 12,
+    'abnormal_hematocrit': lambda c: (c['hematocrit'] < 35) | (c['hematocrit'] > 50),
+    'low_platelets': lambda c: c['platelets'] < 150,
+    'abnormal_rbc': lambda c: (c['red_blood_cells'] < 4.0) | (c['red_blood_cells'] > 6.0),
+    'low_lymphocytes': lambda c: c['lymphocytes'] < 1.0,
+    'high_urea': lambda c: c['urea'] > 7.5,
+    'electrolyte_imbalance': lambda c: ((c['potassium'] < 3.5) | (c['potassium'] > 5.0) |
+                                        (c['sodium'] < 136) | (c['sodium'] > 145)),
+    'critical_care': lambda c: c['intensive_care_unit_admission']
+}
+
+# Encoded feature -> categorical input field
+CATEGORICAL_FEATURES = {
+    'age_group_encoded': 'age_group',
+    'gender_encoded': 'gender',
+    'dataset_source_encoded': 'dataset_source'
+}
+
+CATEGORICAL_DEFAULTS = {'age_group': 'Unknown', 'gender': 'Unknown', 'dataset_source': 'dataset1'}
+
+# Column order used since the first trained models
+DEFAULT_COLUMNS = NUMERIC_FEATURES + list(DERIVED_FEATURES) + list(CATEGORICAL_FEATURES)
+
+
+class FeatureSpec:
+    """Ordered feature columns plus the category codes needed to build them
+
+    passthrough names extra numeric inputs (e.g. trend features) that are
+    copied as-is, falling back to their entry in defaults.
+    """
+
+    def __init__(self, columns: List[str], categories: Optional[Dict[str, Dict[str, int]]] = None,
+                 defaults: Optional[Dict[str, Any]] = None, passthrough: Optional[List[str]] = None):
+        self.passthrough = list(passthrough or [])
+        unknown = [c for c in columns if c not in NUMERIC_FEATURES and c not in DERIVED_FEATURES
+                   and c not in CATEGORICAL_FEATURES and c not in self.passthrough]
+        if unknown:
+            raise ValueError(f'Unknown feature columns: {unknown}')
+        self.columns = list(columns)
+        self.categories = {field: dict(codes) for field, codes in (categories or {}).items()}
+        self.defaults = dict(BASE_DEFAULTS, **CATEGORICAL_DEFAULTS)
+        self.defaults.update(defaults or {})
+        self._extractor = None
+
+    @classmethod
+    def from_label_encoders(cls, label_encoders: Dict[str, Any], columns: Optional[List[str]] = None,
+                            extra_defaults: Optional[Dict[str, float]] = None) -> 'FeatureSpec':
+        """Build a spec from fitted LabelEncoders (anything with classes_)
+
+        extra_defaults adds passthrough features after the standard columns.
+        """
+        categories = {
+            field: {str(label): code for code, label in enumerate(encoder.classes_)}
+            for field, encoder in label_encoders.items()
+        }
+        extra_defaults = extra_defaults or {}
+        if columns is None:
+            columns = [c for c in DEFAULT_COLUMNS
+                       if c not in CATEGORICAL_FEATURES or CATEGORICAL_FEATURES[c] in categories]
+            columns += list(extra_defaults)
+        return cls(columns, categories, extra_defaults, passthrough=list(extra_defaults))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'version': SPEC_VERSION, 'columns': self.columns, 'categories': self.categories,
+                'defaults': self.defaults, 'passthrough': self.passthrough}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'FeatureSpec':
+        if data.get('version', 0) > SPEC_VERSION:
+            raise ValueError(f"Unsupported feature spec version {data['version']}")
+        return cls(data['columns'], data.get('categories'), data.get('defaults'), data.get('passthrough'))
+
+    @property
+    def extractor(self) -> 'FeatureExtractor':
+        if self._extractor is None:
+            self._extractor = FeatureExtractor(self)
+        return self._extractor
+
+    def transform_records(self, records: List[Dict[str, Any]]) -> np.ndarray:
+        return self.extractor.transform_records(records)
+
+    def transform_frame(self, df: pd.DataFrame) -> np.ndarray:
+        return self.extractor.transform_frame(df)
+
+
+class FeatureExtractor:
+    """Compiled form of a FeatureSpec"""
+
+    def __init__(self, spec: FeatureSpec):
+        self.spec = spec
+        self.n_features = len(spec.columns)
+
+        # Every numeric field needed directly or by a derived feature
+        needed = [c for c in spec.columns if c in NUMERIC_FEATURES or c in spec.passthrough]
+        if any(c in DERIVED_FEATURES for c in spec.columns):
+            needed += [f for f in NUMERIC_FEATURES if f not in needed]
+        self.numeric_fields = needed
+        self._numeric_index = {field: i for i, field in enumerate(needed)}
+        self._numeric_defaults = {field: spec.defaults.get(field, 0.0) for field in needed}
+        self._get_numeric = itemgetter(*needed) if needed else None
+
+        self._plan = []
+        for j, col in enumerate(spec.columns):
+            if col in NUMERIC_FEATURES or col in spec.passthrough:
+                self._plan.append((j, 'numeric', self._numeric_index[col]))
+            elif col in DERIVED_FEATURES:
+                self._plan.append((j, 'derived', DERIVED_FEATURES[col]))
+            else:
+                field = CATEGORICAL_FEATURES[col]
+                self._plan.append((j, 'categorical', (field, spec.categories.get(field, {}),
+                                                      spec.defaults.get(field, 'Unknown'))))
+
+    def _numeric_rows(self, records: List[Dict[str, Any]]) -> np.ndarray:
+        defaults = self._numeric_defaults
+        getter = self._get_numeric
+        rows = [getter({**defaults, **record}) for record in records]
+        if len(self.numeric_fields) == 1:
+            rows = [(row,) for row in rows]
+        try:
+            return np.array(rows, dtype=np.float32).reshape(len(records), len(self.numeric_fields))
+        except (TypeError, ValueError):
+            # Slow path for payloads holding text: bad values take the default
+            values, missing, rejected = coerce_rows(rows, len(self.numeric_fields))
+            fallback = np.array([defaults[f] for f in self.numeric_fields], dtype=np.float64)
+            return np.where(missing | rejected, fallback, values).astype(np.float32)
+
+    def _assemble(self, numeric: np.ndarray, categorical_values) -> np.ndarray:
+        columns = {field: numeric[:, i] for field, i in self._numeric_index.items()}
+        out = np.empty((len(numeric), self.n_features), dtype=np.float32)
+        for j, kind, arg in self._plan:
+            if kind == 'numeric':
+                out[:, j] = numeric[:, arg]
+            elif kind == 'derived':
+                out[:, j] = arg(columns)
+            else:
+                out[:, j] = categorical_values(*arg)
+        return out
+
+    def transform_records(self, records: List[Dict[str, Any]]) -> np.ndarray:
+        """Patient dicts -> (n, n_features) float32 matrix"""
+        numeric = self._numeric_rows(records)
+
+        def categorical_values(field, codes, default):
+            return [codes.get(str(record.get(field, default)), 0) for record in records]
+
+        return self._assemble(numeric, categorical_values)
+
+    def transform_frame(self, df: pd.DataFrame) -> np.ndarray:
+        """Columnar batch -> (n, n_features) float32 matrix"""
+        numeric = np.empty((len(df), len(self.numeric_fields)), dtype=np.float32)
+        for i, field in enumerate(self.numeric_fields):
+            if field in df.columns:
+                numeric[:, i] = pd.to_numeric(df[field], errors='coerce').fillna(0).to_numpy(dtype=np.float32)
+            else:
+                numeric[:, i] = self._numeric_defaults[field]
+
+        def categorical_values(field, codes, default):
+            if field not in df.columns:
+                return codes.get(str(default), 0)
+            return df[field].astype(str).map(codes).fillna(0).to_numpy(dtype=np.float32)
+
+        return self._assemble(numeric, categorical_values)
@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Out-of-Core Histogram Boosting for RelayLoop
+Trains the gradient boosting member from extracts that do not fit in memory.
+
+CSV inputs are read in chunks, mapped through the same feature spec as
+EnhancedMedicalPredictor and quantized into at most 255 bins per feature.
+The bins are written as uint8 row-major files and memory-mapped, so the
+training matrix costs one byte per value on disk and only one chunk of it is
+resident at a time. Boosting then works on per-node gradient histograms
+(the smaller child is scanned, its sibling is the parent minus it): one
+streaming pass over the bins per tree level. Per-row state is the raw score,
+gradient, hessian and node index.
+
+Split thresholds are bin upper edges, so a fitted model converts to a
+'boosting' CompactTreeEnsemble that scores raw float features exactly like
+the binned model and exports with model_artifacts.
+
+Compare against the in-memory exact GradientBoostingClassifier:
+    python histogram_boosting.py ../../../dataset/hospital_readmissions.csv \\
+        ../../../dataset/cleaned_patient_dataset.csv --work-dir /tmp/bins --compare
+"""
+
+import argparse
+import json
+import os
+import resource
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, roc_auc_score
+from sklearn.preprocessing import LabelEncoder
+
+from feature_spec import FeatureSpec
+from model_artifacts import CompactTreeEnsemble, _float32_floor, _index_dtype
+from profiling import stage as profile_stage
+
+# uint8 bin codes: 0..254 are value bins, 255 holds missing values
+MAX_BINS = 255
+MISSING_BIN = 255
+HISTOGRAM_WIDTH = 256
+
+DEFAULT_CHUNK_ROWS = 50000
+DEFAULT_SAMPLE_ROWS = 200000
+
+# Label-encoded columns of the feature spec
+ENCODED_COLUMNS = ['age_group', 'gender', 'dataset_source']
+
+
+class FeatureBinner:
+    """Per-feature bin edges fitted on a row sample; value x falls in the first bin with x <= edge"""
+
+    def __init__(self, max_bins: int = MAX_BINS):
+        if not 2 <= max_bins <= MAX_BINS:
+            raise ValueError(f'max_bins must be between 2 and {MAX_BINS}')
+        self.max_bins = max_bins
+        self.edges = []  # per feature, ascending float64 upper edges ending with +inf
+
+    @property
+    def n_bins(self) -> np.ndarray:
+        return np.array([len(edges) for edges in self.edges], dtype=np.int32)
+
+    def fit(self, X: np.ndarray) -> 'FeatureBinner':
+        X = np.asarray(X, dtype=np.float32)
+        self.edges = []
+        for column in X.T:
+            values = np.unique(column[~np.isnan(column)]).astype(np.float64)
+            if len(values) <= self.max_bins:
+                # Few distinct values: one bin each, split half-way between neighbours
+                inner = (values[:-1] + values[1:]) / 2
+            else:
+                inner = np.unique(np.quantile(values, np.linspace(0, 1, self.max_bins + 1)[1:-1]))
+            self.edges.append(np.r_[inner, np.inf])
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        """(n, features) uint8 bin codes; values are binned as float32, as the compact trees see them"""
+        X = np.asarray(X, dtype=np.float32)
+        bins = np.empty(X.shape, dtype=np.uint8)
+        for j, edges in enumerate(self.edges):
+            column = X[:, j].astype(np.float64)
+            codes = np.searchsorted(edges, column, side='left')
+            codes[np.isnan(column)] = MISSING_BIN
+            bins[:, j] = codes
+        return bins
+
+    def threshold(self, feature: int, bin_code: int) -> float:
+        return float(self.edges[feature][bin_code])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'max_bins': self.max_bins, 'edges': [edges[:-1].tolist() for edges in self.edges]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'FeatureBinner':
+        binner = cls(data['max_bins'])
+        binner.edges = [np.r_[np.asarray(edges, dtype=np.float64), np.inf] for edges in data['edges']]
+        return binner
+
+
+def _unified_chunks(predictor, paths: List[str], chunk_size: int):
+    """Unified feature frames of every input CSV, chunk by chunk (rows without a label are dropped)"""
+    for i, path in enumerate(paths):
+        source = f'dataset{i + 1}'
+        readmit_col = age_col = None
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            if readmit_col is None:
+                readmit_col = predictor._find_readmission_column(chunk)
+                age_col = predictor._find_age_column(chunk)
+            chunk['age_group'] = (chunk[age_col].apply(predictor.age_merger.standardize_age_group)
+                                  if age_col else 'Unknown')
+            unified = predictor._create_enhanced_unified_features(chunk, source, readmit_col)
+            yield unified.dropna(subset=['readmitted_30_days'])
+
+
+class BinnedDataset:
+    """Train and holdout bins as uint8 memmaps, written by build_binned_dataset"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.binner = FeatureBinner.from_dict(self.meta['binner'])
+        self.feature_spec = FeatureSpec.from_dict(self.meta['feature_spec'])
+        self.label_encoders = {}
+        for col, classes in self.meta['label_encoders'].items():
+            encoder = LabelEncoder()
+            encoder.classes_ = np.array(classes, dtype=object)
+            self.label_encoders[col] = encoder
+
+    def _memmap(self, name: str, dtype, columns: Optional[int] = None):
+        rows = self.meta['rows'][name.split('.')[0]]
+        shape = (rows, columns) if columns else (rows,)
+        if not rows:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r', shape=shape)
+
+    def bins(self, split: str) -> np.ndarray:
+        return self._memmap(f'{split}.bins', np.uint8, len(self.feature_spec.columns))
+
+    def labels(self, split: str) -> np.ndarray:
+        return self._memmap(f'{split}.labels', np.uint8)
+
+    def raw(self, split: str) -> np.ndarray:
+        """Unbinned float32 features, present when the dataset was built with keep_raw"""
+        return self._memmap(f'{split}.raw', np.float32, len(self.feature_spec.columns))
+
+
+def build_binned_dataset(paths: List[str], work_dir: str, chunk_size: int = DEFAULT_CHUNK_ROWS,
+                         holdout: float = 0.15, max_bins: int = MAX_BINS, sample_rows: int = DEFAULT_SAMPLE_ROWS,
+                         keep_raw: bool = False, seed: int = 42) -> BinnedDataset:
+    """Two streaming passes: sample rows and categories to fit the bins, then write every row's bins"""
+    from enhanced_predictor import EnhancedMedicalPredictor
+
+    predictor = EnhancedMedicalPredictor()
+    os.makedirs(work_dir, exist_ok=True)
+
+    # Pass 1: category values of the encoded columns and a uniform bottom-k row sample
+    categories = {col: set() for col in ENCODED_COLUMNS}
+    rng = np.random.default_rng(seed)
+    sample, sample_keys = None, np.empty(0)
+    with profile_stage('binning:sample'):
+        for unified in _unified_chunks(predictor, paths, chunk_size):
+            for col in ENCODED_COLUMNS:
+                if col in unified.columns:
+                    categories[col].update(unified[col].astype(str).unique())
+            keys = np.r_[sample_keys, rng.random(len(unified))]
+            merged = unified if sample is None else pd.concat([sample, unified], ignore_index=True)
+            keep = np.argsort(keys, kind='stable')[:sample_rows]
+            sample, sample_keys = merged.iloc[keep].reset_index(drop=True), keys[keep]
+    if sample is None or sample.empty:
+        raise ValueError('No labelled rows found in the inputs')
+
+    label_encoders = {col: LabelEncoder().fit(sorted(values)) for col, values in categories.items() if values}
+    feature_spec = FeatureSpec.from_label_encoders(label_encoders)
+    binner = FeatureBinner(max_bins).fit(feature_spec.transform_frame(sample))
+    del sample
+
+    # Pass 2: bins (and optionally raw floats) appended row-major per split
+    rows = {'train': 0, 'holdout': 0}
+    files = {}
+    kinds = ['bins', 'labels'] + (['raw'] if keep_raw else [])
+    for split in rows:
+        for kind in kinds:
+            files[split, kind] = open(os.path.join(work_dir, f'{split}.{kind}'), 'wb')
+    split_rng = np.random.default_rng(seed + 1)
+    try:
+        with profile_stage('binning:write'):
+            for unified in _unified_chunks(predictor, paths, chunk_size):
+                X = feature_spec.transform_frame(unified)
+                y = unified['readmitted_30_days'].to_numpy().astype(np.uint8)
+                bins = binner.transform(X)
+                is_holdout = split_rng.random(len(X)) < holdout
+                for split, mask in (('train', ~is_holdout), ('holdout', is_holdout)):
+                    files[split, 'bins'].write(np.ascontiguousarray(bins[mask]).tobytes())
+                    files[split, 'labels'].write(y[mask].tobytes())
+                    if keep_raw:
+                        files[split, 'raw'].write(np.ascontiguousarray(X[mask]).tobytes())
+                    rows[split] += int(mask.sum())
+    finally:
+        for f in files.values():
+            f.close()
+
+    meta = {
+        'inputs': [os.path.abspath(p) for p in paths],
+        'rows': rows,
+        'has_raw': keep_raw,
+        'feature_spec': feature_spec.to_dict(),
+        'label_encoders': {col: [str(c) for c in enc.classes_] for col, enc in label_encoders.items()},
+        'binner': binner.to_dict()
+    }
+    with open(os.path.join(work_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return BinnedDataset(work_dir)
+
+
+def _sigmoid(raw: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-raw))
+
+
+class HistogramBoostingClassifier:
+    """Binary log-loss gradient boosting over uint8 bins, grown level by level from histograms"""
+
+    def __init__(self, n_estimators: int = 150, learning_rate: float = 0.1, max_depth: int = 8,
+                 min_samples_leaf: int = 20, l2_regularization: float = 1.0, chunk_rows: int = 65536):
+        if max_depth < 1:
+            raise ValueError('max_depth must be at least 1')
+        self.n_estimators = n_estimators
+        self.learning_rate = learning_rate
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.l2_regularization = l2_regularization
+        self.chunk_rows = chunk_rows
+        self.trees = []  # per tree: feature, bin, left, right, value node arrays; leaves loop to themselves
+        self.depth = 0
+        self.init_raw = 0.0
+
+    def fit(self, bins: np.ndarray, y: np.ndarray, n_bins: np.ndarray) -> 'HistogramBoostingClassifier':
+        """Fit on an (n, features) uint8 array or memmap, reading chunk_rows rows of it at a time"""
+        n = len(bins)
+        rate = float(np.clip(np.mean(y, dtype=np.float64), 1e-6, 1 - 1e-6))
+        self.init_raw = float(np.log(rate / (1 - rate)))
+        self.n_features = bins.shape[1]
+        # Constant features can never split, so they are not histogrammed
+        n_bins = np.asarray(n_bins)
+        self._active = np.flatnonzero(n_bins > 1)
+        self._split_limit = n_bins[self._active, None] - 1
+
+        raw = np.full(n, self.init_raw, dtype=np.float64)
+        gradient = np.empty(n, dtype=np.float32)
+        hessian = np.empty(n, dtype=np.float32)
+        self.trees, self.depth = [], 0
+        with profile_stage('fit:hist_gradient_boosting'):
+            for _ in range(self.n_estimators):
+                for start in range(0, n, self.chunk_rows):
+                    stop = min(start + self.chunk_rows, n)
+                    probability = _sigmoid(raw[start:stop])
+                    gradient[start:stop] = probability - y[start:stop]
+                    hessian[start:stop] = probability * (1 - probability)
+                tree, node = self._grow_tree(bins, gradient, hessian)
+                raw += tree[4][node]
+                self.trees.append(tree)
+        return self
+
+    def _grow_tree(self, bins, gradient, hessian) -> Tuple[Tuple[np.ndarray, ...], np.ndarray]:
+        node = np.zeros(len(bins), dtype=np.int32)
+        feature, bin_code, left, right = [0], [0], [0], [0]
+        totals = [(float(gradient.sum(dtype=np.float64)), float(hessian.sum(dtype=np.float64)), len(bins))]
+
+        histograms = self._scan(bins, node, gradient, hessian, None, [0])
+        levels = 0
+        for level in range(self.max_depth):
+            splits = {}
+            for parent, hist in histograms.items():
+                best = self._best_split(hist, totals[parent])
+                if best is None:
+                    continue
+                f, b, left_totals = best
+                G, H, count = totals[parent]
+                children = (len(feature), len(feature) + 1)
+                for child_totals in (left_totals, (G - left_totals[0], H - left_totals[1], count - left_totals[2])):
+                    feature.append(0)
+                    bin_code.append(0)
+                    left.append(len(left))
+                    right.append(len(right))
+                    totals.append(child_totals)
+                feature[parent], bin_code[parent] = f, b
+                left[parent], right[parent] = children
+                splits[parent] = children
+            if not splits:
+                break
+            levels += 1
+            tree = (np.array(feature, dtype=np.intp), np.array(bin_code, dtype=np.uint8),
+                    np.array(left, dtype=np.int32), np.array(right, dtype=np.int32))
+            if level == self.max_depth - 1:
+                # Children of the deepest level are leaves: route without collecting histograms
+                self._scan(bins, node, gradient, hessian, tree, [])
+                break
+
+            # Scan the smaller child of each split; the sibling is the parent minus it
+            smaller = {parent: min(children, key=lambda child: totals[child][2])
+                       for parent, children in splits.items()}
+            scanned = self._scan(bins, node, gradient, hessian, tree, list(smaller.values()))
+            parents, histograms = histograms, {}
+            for parent, children in splits.items():
+                child = smaller[parent]
+                sibling = children[1] if child == children[0] else children[0]
+                histograms[child] = scanned[child]
+                histograms[sibling] = parents[parent] - scanned[child]
+
+        G = np.array([t[0] for t in totals])
+        H = np.array([t[1] for t in totals])
+        is_leaf = np.array(left) == np.arange(len(left))
+        value = np.where(is_leaf, -G / (H + self.l2_regularization) * self.learning_rate, 0.0)
+        self.depth = max(self.depth, levels)
+        return (np.array(feature, dtype=np.int32), np.array(bin_code, dtype=np.uint8),
+                np.array(left, dtype=np.int32), np.array(right, dtype=np.int32), value), node
+
+    def _scan(self, bins, node, gradient, hessian, tree, collect: List[int]) -> Dict[int, np.ndarray]:
+        """One pass over the bins: move rows one level down `tree`, then histogram the `collect` nodes
+
+        Returns (3, active features, 256) gradient/hessian/count histograms per collected node.
+        """
+        n_features = len(self._active)
+        size = len(collect) * n_features * HISTOGRAM_WIDTH
+        sums = [np.zeros(size) for _ in range(3)]
+        slots = np.full(len(tree[0]) if tree is not None else 1, -1, dtype=np.int64)
+        slots[collect] = np.arange(len(collect))
+        columns = np.arange(n_features)
+
+        for start in range(0, len(bins), self.chunk_rows):
+            stop = min(start + self.chunk_rows, len(bins))
+            chunk = np.asarray(bins[start:stop])
+            rows = node[start:stop]
+            if tree is not None:
+                feature, bin_code, left, right = tree
+                go_left = chunk[np.arange(len(chunk)), feature[rows]] <= bin_code[rows]
+                rows = node[start:stop] = np.where(go_left, left[rows], right[rows])
+            if not collect or not n_features:
+                continue
+            slot = slots[rows]
+            selected = slot >= 0
+            if not selected.any():
+                continue
+            values = chunk[np.ix_(selected, self._active)]
+            index = ((slot[selected, None] * n_features + columns) * HISTOGRAM_WIDTH + values).ravel()
+            sums[0] += np.bincount(index, np.repeat(gradient[start:stop][selected], n_features), size)
+            sums[1] += np.bincount(index, np.repeat(hessian[start:stop][selected], n_features), size)
+            sums[2] += np.bincount(index, minlength=size)
+
+        stacked = np.stack(sums).reshape(3, len(collect), n_features, HISTOGRAM_WIDTH)
+        return {node_id: stacked[:, i] for i, node_id in enumerate(collect)}
+
+    def _best_split(self, hist: np.ndarray, totals: Tuple[float, float, int]) -> Optional[Tuple[int, int, Tuple]]:
+        """Highest-gain (feature, bin) split of a node; missing values (bin 255) always go right"""
+        G, H, count = totals
+        if count < 2 * self.min_samples_leaf or not len(self._active):
+            return None
+        cumulative = np.cumsum(hist[:, :, :MAX_BINS], axis=2)
+        GL, HL, CL = cumulative
+        GR, HR, CR = G - GL, H - HL, count - CL
+        lam = self.l2_regularization
+        gain = GL ** 2 / (HL + lam) + GR ** 2 / (HR + lam) - G ** 2 / (H + lam)
+        valid = ((CL >= self.min_samples_leaf) & (CR >= self.min_samples_leaf) &
+                 (np.arange(MAX_BINS) < self._split_limit))
+        gain = np.where(valid, gain, -np.inf)
+        best = int(np.argmax(gain))
+        f, b = divmod(best, MAX_BINS)
+        if not gain[f, b] > 1e-7:
+            return None
+        return int(self._active[f]), b, (float(GL[f, b]), float(HL[f, b]), int(CL[f, b]))
+
+    def decision_function_binned(self, bins: np.ndarray) -> np.ndarray:
+        """Raw log-odds for binned rows"""
+        raw = np.full(len(bins), self.init_raw, dtype=np.float64)
+        for start in range(0, len(bins), self.chunk_rows):
+            chunk = np.asarray(bins[start:start + self.chunk_rows])
+            positions = np.arange(len(chunk))
+            for feature, bin_code, left, right, value in self.trees:
+                node = np.zeros(len(chunk), dtype=np.int32)
+                for _ in range(self.depth):
+                    go_left = chunk[positions, feature[node]] <= bin_code[node]
+                    node = np.where(go_left, left[node], right[node])
+                raw[start:start + len(chunk)] += value[node]
+        return raw
+
+    def predict_proba_binned(self, bins: np.ndarray) -> np.ndarray:
+        positive = _sigmoid(self.decision_function_binned(bins))
+        return np.column_stack([1.0 - positive, positive])
+
+    def to_compact(self, binner: FeatureBinner) -> CompactTreeEnsemble:
+        """The fitted trees with bin thresholds replaced by their upper edges, scoring raw features"""
+        n_nodes = sum(len(tree[0]) for tree in self.trees)
+        feature = np.zeros(n_nodes, dtype=_index_dtype(self.n_features - 1))
+        threshold = np.zeros(n_nodes, dtype=np.float32)
+        left = np.zeros(n_nodes, dtype=np.int32)
+        right = np.zeros(n_nodes, dtype=np.int32)
+        value = np.zeros(n_nodes, dtype=np.float32)
+        roots = np.zeros(len(self.trees), dtype=np.int32)
+
+        divergence = 0.0
+        offset = 0
+        for i, (tree_feature, bin_code, tree_left, tree_right, tree_value) in enumerate(self.trees):
+            nodes = np.arange(offset, offset + len(tree_feature))
+            is_leaf = tree_left == np.arange(len(tree_left))
+            roots[i] = offset
+            feature[nodes] = np.where(is_leaf, 0, tree_feature)
+            edges = np.array([0.0 if leaf else binner.threshold(f, b)
+                              for f, b, leaf in zip(tree_feature, bin_code, is_leaf)])
+            # Values are binned as float32, so a float32-floored edge routes identically
+            threshold[nodes] = _float32_floor(edges)
+            left[nodes] = tree_left + offset
+            right[nodes] = tree_right + offset
+            value[nodes] = tree_value
+            divergence += float(np.max(np.abs(tree_value.astype(np.float32) - tree_value)))
+            offset += len(tree_feature)
+
+        return CompactTreeEnsemble('boosting', feature, threshold, left, right, value, roots,
+                                   self.depth, self.init_raw, divergence / 4.0)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _scores(y_true: np.ndarray, probability: np.ndarray) -> Dict[str, float]:
+    return {
+        'auc': round(float(roc_auc_score(y_true, probability)), 4) if len(np.unique(y_true)) > 1 else 0.5,
+        'accuracy': round(float(accuracy_score(y_true, probability >= 0.5)), 4)
+    }
+
+
+def train_histogram_boosting(dataset: BinnedDataset, params: Optional[Dict[str, Any]] = None):
+    """Fit on the train bins and score the holdout bins"""
+    model = HistogramBoostingClassifier(**(params or {}))
+    start = time.perf_counter()
+    model.fit(dataset.bins('train'), np.asarray(dataset.labels('train')), dataset.binner.n_bins)
+    seconds = time.perf_counter() - start
+    y_holdout = np.asarray(dataset.labels('holdout'))
+    report = {'fit_seconds': round(seconds, 2), 'trees': len(model.trees), 'depth': model.depth,
+              **_scores(y_holdout, model.predict_proba_binned(dataset.bins('holdout'))[:, 1]),
+              'peak_rss_mb': _peak_rss_mb()}
+    return model, report
+
+
+def train_exact_baseline(dataset: BinnedDataset, max_rows: Optional[int] = None, seed: int = 42) -> Dict[str, Any]:
+    """Current in-memory GradientBoostingClassifier on the same split (needs the raw float features)"""
+    from enhanced_predictor import ENHANCED_MODEL_PARAMS
+
+    if not dataset.meta.get('has_raw'):
+        raise ValueError('Exact baseline needs a dataset built with keep_raw')
+    X, y = dataset.raw('train'), dataset.labels('train')
+    if max_rows and len(X) > max_rows:
+        keep = np.sort(np.random.default_rng(seed).choice(len(X), max_rows, replace=False))
+        X, y = X[keep], y[keep]
+    X, y = np.asarray(X), np.asarray(y)
+
+    model_class, params = ENHANCED_MODEL_PARAMS['gradient_boosting']
+    model = model_class(**params)
+    start = time.perf_counter()
+    with profile_stage('fit:gradient_boosting'):
+        model.fit(X, y)
+    seconds = time.perf_counter() - start
+    probability = model.predict_proba(np.asarray(dataset.raw('holdout')))[:, 1]
+    return {'fit_seconds': round(seconds, 2), 'train_rows': len(X),
+            **_scores(np.asarray(dataset.labels('holdout')), probability), 'peak_rss_mb': _peak_rss_mb()}
+
+
+def build_predictor(dataset: BinnedDataset, model: HistogramBoostingClassifier):
+    """EnhancedMedicalPredictor serving the histogram model alone, ready for export_compact_artifact"""
+    from enhanced_predictor import EnhancedMedicalPredictor
+
+    predictor = EnhancedMedicalPredictor()
+    predictor.label_encoders = dataset.label_encoders
+    predictor.feature_spec = dataset.feature_spec
+    predictor.feature_columns = dataset.feature_spec.columns
+    predictor.models = {'hist_gradient_boosting': model.to_compact(dataset.binner)}
+    predictor.model_version = f"hist-{len(model.trees)}x{model.depth}-{dataset.meta['rows']['train']}"
+    predictor.is_trained = True
+    return predictor
+
+
+def _default_inputs(data_path: str) -> List[str]:
+    """hospital_readmissions.csv first, then the other CSVs, as EnhancedMedicalPredictor loads them"""
+    names = sorted(f for f in os.listdir(data_path) if f.endswith('.csv'))
+    names.sort(key=lambda name: name != 'hospital_readmissions.csv')
+    return [os.path.join(data_path, name) for name in names]
+
+
+def main():
+    from enhanced_predictor import ENHANCED_MODEL_PARAMS
+    baseline = ENHANCED_MODEL_PARAMS['gradient_boosting'][1]
+
+    parser = argparse.ArgumentParser(description='Train histogram gradient boosting out of core from uint8 bins')
+    parser.add_argument('inputs', nargs='*', help='Training CSVs (default: the CSVs in --data-path)')
+    parser.add_argument('--data-path', default=os.path.join(os.path.dirname(__file__), '..', '..', 'data'))
+    parser.add_argument('--work-dir', required=True, help='Directory for the binned dataset')
+    parser.add_argument('--reuse', action='store_true', help='Train from an existing binned dataset in --work-dir')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_ROWS, help='CSV rows read per chunk')
+    parser.add_argument('--max-bins', type=int, default=MAX_BINS)
+    parser.add_argument('--holdout', type=float, default=0.15, help='Fraction of rows held out for scoring')
+    parser.add_argument('--n-estimators', type=int, default=baseline['n_estimators'])
+    parser.add_argument('--learning-rate', type=float, default=baseline['learning_rate'])
+    parser.add_argument('--max-depth', type=int, default=baseline['max_depth'])
+    parser.add_argument('--min-samples-leaf', type=int, default=20)
+    parser.add_argument('--compare', action='store_true',
+                        help='Also train the exact in-memory GradientBoostingClassifier on the same split')
+    parser.add_argument('--baseline-max-rows', type=int, default=None,
+                        help='Subsample the exact baseline to this many training rows')
+    parser.add_argument('--artifact', default=None, help='Export the histogram model as a compact artifact')
+    args = parser.parse_args()
+
+    if args.reuse:
+        dataset = BinnedDataset(args.work_dir)
+        build_seconds = 0.0
+    else:
+        inputs = args.inputs or _default_inputs(args.data_path)
+        start = time.perf_counter()
+        dataset = build_binned_dataset(inputs, args.work_dir, args.chunk_size, args.holdout, args.max_bins,
+                                       keep_raw=args.compare)
+        build_seconds = time.perf_counter() - start
+
+    n_features = len(dataset.feature_spec.columns)
+    rows = dataset.meta['rows']
+    report = {
+        'dataset': {'train_rows': rows['train'], 'holdout_rows': rows['holdout'], 'features': n_features,
+                    'build_seconds': round(build_seconds, 2), 'bin_bytes': (rows['train'] + rows['holdout']) * n_features,
+                    'float64_bytes': (rows['train'] + rows['holdout']) * n_features * 8}
+    }
+    print(f"Binned {rows['train']} train / {rows['holdout']} holdout rows x {n_features} features")
+
+    params = {'n_estimators': args.n_estimators, 'learning_rate': args.learning_rate,
+              'max_depth': args.max_depth, 'min_samples_leaf': args.min_samples_leaf}
+    model, report['histogram'] = train_histogram_boosting(dataset, params)
+    print(f"Histogram boosting: AUC={report['histogram']['auc']:.3f} in {report['histogram']['fit_seconds']}s")
+
+    if args.compare:
+        report['exact_gradient_boosting'] = train_exact_baseline(dataset, args.baseline_max_rows)
+        exact = report['exact_gradient_boosting']
+        print(f"Exact gradient boosting: AUC={exact['auc']:.3f} in {exact['fit_seconds']}s")
+        report['speedup'] = round(exact['fit_seconds'] / max(report['histogram']['fit_seconds'], 1e-9), 2)
+        report['auc_delta'] = round(report['histogram']['auc'] - exact['auc'], 4)
+
+    if args.artifact:
+        from model_artifacts import export_compact_artifact
+        export_compact_artifact(build_predictor(dataset, model), args.artifact)
+        report['artifact'] = args.artifact
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
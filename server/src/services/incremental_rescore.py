@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental Rescoring for RelayLoop
+Nightly rescoring that only recomputes patients whose scoring inputs or model
+changed since their last score.
+
+Each chunk of the input CSV is mapped through the predictor's batch feature
+pipeline once. Every prepared row gets a 64-bit fingerprint, which is compared
+with the one stored for the patient, along with the key of the model that
+scored it. Rows that are new, changed or scored by another model are
+collected into vectorized batches and scored; the rest are skipped. The
+fingerprint state is replaced atomically after the run, so an interrupted
+run leaves it as it was and the next run rescores the same patients.
+
+The model key is the model version plus a hash of the artifact (when scoring
+from one) and of the clinical weights, age multipliers and risk thresholds,
+so retraining or reweighting rescores everyone.
+
+    python incremental_rescore.py patients.csv rescored.csv --state fingerprints.npz --artifact model.npz
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Optional
+
+from batch_score import OUTPUT_COLUMNS, _numbered_chunks, load_predictor
+
+# Prepared columns that do not feed the score
+UNSCORED_COLUMNS = ('patient_id', 'readmitted_30_days')
+
+REASONS = ('new', 'changed', 'model_updated', 'forced')
+
+
+def row_fingerprints(frame: pd.DataFrame) -> np.ndarray:
+    """uint64 hash of each prepared row's scoring inputs"""
+    columns = [col for col in frame.columns if col not in UNSCORED_COLUMNS]
+    return pd.util.hash_pandas_object(frame[columns], index=False).to_numpy(dtype=np.uint64)
+
+
+def model_key(predictor, artifact: Optional[str] = None) -> str:
+    """Identifies everything besides the row that determines a score"""
+    digest = hashlib.sha1()
+    if artifact:
+        with open(artifact, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    config = {
+        'clinical_weights': predictor.clinical_weights,
+        'age_multipliers': predictor.age_merger.age_risk_multipliers,
+        'risk_thresholds': predictor.risk_thresholds
+    }
+    digest.update(json.dumps(config, sort_keys=True, default=str).encode('utf-8'))
+    return f"{getattr(predictor, 'model_version', None) or 'trained'}:{digest.hexdigest()[:16]}"
+
+
+class FingerprintStore:
+    """Last scored fingerprint and model key per patient, kept in an .npz file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ids = pd.Index([], dtype=object)
+        self.fingerprints = np.zeros(0, dtype=np.uint64)
+        self.models = np.zeros(0, dtype=np.int32)
+        self.model_keys = []
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as npz:
+                self.ids = pd.Index(npz['ids'].astype(object))
+                self.fingerprints = npz['fingerprints']
+                self.models = npz['models']
+                self.model_keys = npz['model_keys'].tolist()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def compare(self, ids: np.ndarray, fingerprints: np.ndarray, key: str) -> np.ndarray:
+        """Reason index per row (into REASONS), or -1 when the stored score is still current"""
+        position = self.ids.get_indexer(ids)
+        known = position >= 0
+        reasons = np.full(len(ids), REASONS.index('new'), dtype=np.int8)
+        stored = position[known]
+        same_input = self.fingerprints[stored] == fingerprints[known]
+        current = key in self.model_keys
+        same_model = (self.models[stored] == self.model_keys.index(key)) if current else np.zeros(len(stored), bool)
+        reasons[known] = np.where(~same_input, REASONS.index('changed'),
+                                  np.where(~same_model, REASONS.index('model_updated'), -1))
+        return reasons
+
+    def update(self, ids: List[np.ndarray], fingerprints: List[np.ndarray], key: str):
+        """Record new scores; a patient scored more than once keeps the last"""
+        if not ids:
+            return
+        if key not in self.model_keys:
+            self.model_keys.append(key)
+        new_ids = np.concatenate(ids).astype(str).astype(object)
+        all_ids = np.concatenate([self.ids.to_numpy(dtype=object), new_ids])
+        all_fingerprints = np.concatenate([self.fingerprints] + fingerprints)
+        all_models = np.concatenate([self.models, np.full(len(new_ids), self.model_keys.index(key), np.int32)])
+        keep = ~pd.Index(all_ids).duplicated(keep='last')
+        self.ids = pd.Index(all_ids[keep])
+        self.fingerprints = all_fingerprints[keep]
+        self.models = all_models[keep]
+
+        # Drop keys no patient refers to any more
+        used = np.unique(self.models)
+        remap = np.zeros(len(self.model_keys), dtype=np.int32)
+        remap[used] = np.arange(len(used))
+        self.models = remap[self.models]
+        self.model_keys = [self.model_keys[i] for i in used]
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, ids=self.ids.to_numpy(dtype=str), fingerprints=self.fingerprints,
+                     models=self.models, model_keys=np.array(self.model_keys, dtype=str))
+        os.replace(tmp_path, self.path)
+
+
+def rescore_file(input_path: str, output_path: str, state_path: str, artifact: Optional[str] = None,
+                 data_path: Optional[str] = None, chunk_size: int = 50000, batch_size: int = 20000,
+                 id_column: str = 'patient_id', force: bool = False) -> Dict[str, Any]:
+    """Score the rows of input_path whose fingerprint or model changed; write one result row each"""
+    start = time.perf_counter()
+    predictor = load_predictor(artifact, data_path)
+    key = model_key(predictor, artifact)
+    store = FingerprintStore(state_path)
+
+    counts = {'rows': 0, 'rescored': 0, 'skipped': 0, **{reason: 0 for reason in REASONS}}
+    pending, scored_ids, scored_fingerprints = [], [], []
+    prepare_seconds = score_seconds = 0.0
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+    with open(output_path, 'w', newline='') as out:
+        out.write(','.join(OUTPUT_COLUMNS + ['reason']) + '\n')
+
+        def flush():
+            nonlocal score_seconds
+            if not pending:
+                return
+            batch = pd.concat(pending)
+            pending.clear()
+            tick = time.perf_counter()
+            results = predictor.predict_prepared(batch)
+            score_seconds += time.perf_counter() - tick
+            results.insert(0, 'row', batch.index)
+            results.insert(1, 'patient_id', batch['_rescore_id'].to_numpy())
+            results['reason'] = batch['_rescore_reason'].to_numpy()
+            results[OUTPUT_COLUMNS + ['reason']].to_csv(out, index=False, header=False)
+
+        for chunk in _numbered_chunks(pd.read_csv(input_path, chunksize=chunk_size), 0):
+            tick = time.perf_counter()
+            frame = predictor.prepare_batch_features(chunk)
+            ids = (chunk[id_column] if id_column in chunk.columns else chunk.index.to_series()).astype(str).to_numpy()
+            fingerprints = row_fingerprints(frame)
+            reasons = store.compare(ids, fingerprints, key)
+            if force:
+                reasons = np.where(reasons < 0, REASONS.index('forced'), reasons)
+            prepare_seconds += time.perf_counter() - tick
+
+            selected = reasons >= 0
+            counts['rows'] += len(chunk)
+            counts['rescored'] += int(selected.sum())
+            for i, reason in enumerate(REASONS):
+                counts[reason] += int((reasons == i).sum())
+            if not selected.any():
+                continue
+
+            batch = frame[selected].copy()
+            batch['_rescore_id'] = ids[selected]
+            batch['_rescore_reason'] = np.array(REASONS, dtype=object)[reasons[selected]]
+            pending.append(batch)
+            scored_ids.append(ids[selected])
+            scored_fingerprints.append(fingerprints[selected])
+            if sum(len(p) for p in pending) >= batch_size:
+                flush()
+        flush()
+
+    # Only a completed run moves the state forward
+    store.update(scored_ids, scored_fingerprints, key)
+    store.save()
+
+    counts['skipped'] = counts['rows'] - counts['rescored']
+    seconds = time.perf_counter() - start
+    return {
+        **counts,
+        'skipped_rate': round(counts['skipped'] / counts['rows'], 4) if counts['rows'] else 0.0,
+        'model_key': key,
+        'patients_tracked': len(store),
+        'prepare_seconds': round(prepare_seconds, 2),
+        'score_seconds': round(score_seconds, 2),
+        'seconds': round(seconds, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rescore only the patients whose inputs or model changed')
+    parser.add_argument('input', help='Input CSV file')
+    parser.add_argument('output', help='Output CSV of the rescored rows')
+    parser.add_argument('--state', required=True, help='Fingerprint state (.npz), created on the first run')
+    parser.add_argument('--artifact', default=None,
+                        help='Compact model artifact (.npz); trains from --data-path if omitted, '
+                             'which is a new model version and rescores everyone')
+    parser.add_argument('--data-path', default=None, help='Training data directory when no artifact is given')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='Rows read and fingerprinted at a time')
+    parser.add_argument('--batch-size', type=int, default=20000, help='Changed rows scored together')
+    parser.add_argument('--id-column', default='patient_id',
+                        help='Patient identifier column (default: patient_id; the row number when absent)')
+    parser.add_argument('--force', action='store_true', help='Rescore every row and refresh the state')
+    args = parser.parse_args()
+
+    summary = rescore_file(args.input, args.output, args.state, args.artifact, args.data_path,
+                           args.chunk_size, args.batch_size, args.id_column, args.force)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
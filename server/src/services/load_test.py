@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prediction Load Tester for RelayLoop
+Replays patient JSON payloads against ml_prediction_runner.py and reports
+latency percentiles, throughput and error rates.
+
+Modes:
+  argv   spawn the runner once per request (how Node.js calls it today)
+  serve  keep one resident runner (--serve) per client and stream requests
+
+Load shapes:
+  --clients N        closed loop: N clients send back to back
+  --qps R            open loop: requests are scheduled at a fixed rate and
+                     latency is measured from the scheduled send time, so
+                     queueing behind a slow service is counted
+"""
+
+import argparse
+import json
+import math
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+RUNNER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ml_prediction_runner.py')
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram with about 1% relative precision"""
+
+    GROWTH = 1.02
+    MIN_SECONDS = 1e-5
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _bucket(self, seconds: float) -> int:
+        return int(math.log(max(seconds, self.MIN_SECONDS) / self.MIN_SECONDS, self.GROWTH))
+
+    def _upper_bound(self, bucket: int) -> float:
+        return self.MIN_SECONDS * self.GROWTH ** (bucket + 1)
+
+    def record(self, seconds: float):
+        bucket = self._bucket(seconds)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: 'LatencyHistogram'):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, pct: float) -> float:
+        if not self.total:
+            return 0.0
+        rank = max(1, math.ceil(self.total * pct / 100.0))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self._upper_bound(bucket), self.max)
+        return self.max
+
+    def summary_ms(self) -> Dict[str, float]:
+        return {
+            'mean': round(self.sum / self.total * 1000, 3) if self.total else 0.0,
+            'p50': round(self.percentile(50) * 1000, 3),
+            'p90': round(self.percentile(90) * 1000, 3),
+            'p99': round(self.percentile(99) * 1000, 3),
+            'p999': round(self.percentile(99.9) * 1000, 3),
+            'max': round(self.max * 1000, 3)
+        }
+
+    def buckets_ms(self) -> List[List[float]]:
+        """Non-empty buckets as [upper bound ms, count] pairs"""
+        return [[round(self._upper_bound(b) * 1000, 4), self.counts[b]] for b in sorted(self.counts)]
+
+
+def load_payloads(path: Optional[str] = None, synthetic: int = 0, seed: int = 42) -> List[str]:
+    """Read one JSON payload per line, or generate synthetic patients"""
+    if path:
+        with open(path, 'r') as f:
+            return [line.strip() for line in f if line.strip()]
+
+    from synthetic_patients import generate_chunk
+    df = generate_chunk(0, synthetic, seed).drop(columns=['readmitted_30_days'])
+    # Round-trip through pandas' JSON writer to get plain Python scalars
+    return [json.dumps(record) for record in json.loads(df.to_json(orient='records'))]
+
+
+def _is_error(response: Dict[str, Any]) -> bool:
+    return 'error' in response or response.get('risk_level') == 'error'
+
+
+class ArgvTarget:
+    """Spawns the runner once per request"""
+
+    def __init__(self, runner: str, timeout: float):
+        self.runner = runner
+        self.timeout = timeout
+
+    def start(self):
+        pass
+
+    def call(self, payload: str) -> Dict[str, Any]:
+        completed = subprocess.run([sys.executable, self.runner, payload], capture_output=True,
+                                   text=True, timeout=self.timeout)
+        # Training progress may precede the result, which is always the last line
+        lines = completed.stdout.strip().splitlines()
+        if completed.returncode != 0 or not lines:
+            return {'error': completed.stderr.strip()[-200:] or f'exit code {completed.returncode}'}
+        return json.loads(lines[-1])
+
+    def close(self):
+        pass
+
+
+class ServeTarget:
+    """One resident runner process speaking JSON lines over stdin/stdout"""
+
+    def __init__(self, runner: str, timeout: float):
+        self.runner = runner
+        self.timeout = timeout
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, self.runner, '--serve'], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, text=True, bufsize=1)
+
+    def call(self, payload: str) -> Dict[str, Any]:
+        self.process.stdin.write(payload + '\n')
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError(f'runner exited with code {self.process.poll()}')
+        return json.loads(line)
+
+    def close(self):
+        if self.process and self.process.poll() is None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class LoadTester:
+    """Drives a set of targets with payloads and collects statistics"""
+
+    def __init__(self, mode: str, payloads: List[str], clients: int = 1, qps: Optional[float] = None,
+                 runner: str = RUNNER_PATH, timeout: float = 60.0):
+        if mode not in ('argv', 'serve'):
+            raise ValueError(f'Unknown mode: {mode}')
+        if not payloads:
+            raise ValueError('No payloads to replay')
+        self.mode = mode
+        self.payloads = payloads
+        self.clients = clients
+        self.qps = qps
+        target_cls = ArgvTarget if mode == 'argv' else ServeTarget
+        self.targets = [target_cls(runner, timeout) for _ in range(clients)]
+
+    def _warm_up(self):
+        """Start every target and wait for its first answer so model loading is not measured"""
+        for target in self.targets:
+            target.start()
+        if self.mode == 'serve':
+            for target in self.targets:
+                target.call(self.payloads[0])
+
+    def _worker(self, target, jobs: queue.Queue, histogram: LatencyHistogram, errors: List[int]):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            index, scheduled = job
+            if scheduled is None:
+                scheduled = time.perf_counter()
+            try:
+                failed = _is_error(target.call(self.payloads[index % len(self.payloads)]))
+            except Exception:
+                failed = True
+            histogram.record(time.perf_counter() - scheduled)
+            if failed:
+                errors[0] += 1
+
+    def run(self, requests: Optional[int] = None, duration: Optional[float] = None) -> Dict[str, Any]:
+        if requests is None and duration is None:
+            requests = len(self.payloads)
+
+        self._warm_up()
+        jobs = queue.Queue(maxsize=0 if self.qps else self.clients * 2)
+        histograms = [LatencyHistogram() for _ in self.targets]
+        errors = [[0] for _ in self.targets]
+        threads = [threading.Thread(target=self._worker, args=(t, jobs, h, e), daemon=True)
+                   for t, h, e in zip(self.targets, histograms, errors)]
+        for thread in threads:
+            thread.start()
+
+        start = time.perf_counter()
+        sent = 0
+        try:
+            while requests is None or sent < requests:
+                if self.qps:
+                    scheduled = start + sent / self.qps
+                    if duration is not None and scheduled - start >= duration:
+                        break
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    jobs.put((sent, scheduled))
+                else:
+                    if duration is not None and time.perf_counter() - start >= duration:
+                        break
+                    jobs.put((sent, None))
+                sent += 1
+        finally:
+            for _ in threads:
+                jobs.put(None)
+            for thread in threads:
+                thread.join()
+            for target in self.targets:
+                target.close()
+        elapsed = time.perf_counter() - start
+
+        histogram = LatencyHistogram()
+        for h in histograms:
+            histogram.merge(h)
+        error_count = sum(e[0] for e in errors)
+
+        return {
+            'mode': self.mode,
+            'clients': self.clients,
+            'target_qps': self.qps,
+            'requests': histogram.total,
+            'errors': error_count,
+            'error_rate': round(error_count / max(histogram.total, 1), 4),
+            'seconds': round(elapsed, 3),
+            'throughput_rps': round(histogram.total / max(elapsed, 1e-9), 2),
+            'latency_ms': histogram.summary_ms(),
+            'histogram_ms': histogram.buckets_ms()
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay prediction requests and measure capacity')
+    parser.add_argument('--mode', choices=['argv', 'serve'], default='serve')
+    parser.add_argument('--payloads', default=None, help='File with one patient JSON object per line')
+    parser.add_argument('--synthetic', type=int, default=1000, help='Synthetic payloads to generate when no file is given')
+    parser.add_argument('--clients', type=int, default=1, help='Concurrent clients / resident runners')
+    parser.add_argument('--qps', type=float, default=None, help='Open-loop target rate (default: closed loop)')
+    parser.add_argument('--requests', type=int, default=None, help='Number of requests to send')
+    parser.add_argument('--duration', type=float, default=None, help='Seconds to run')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Per-request timeout for argv mode')
+    parser.add_argument('--slo-p99-ms', type=float, default=None, help='Exit non-zero if p99 latency exceeds this')
+    parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.payloads, args.synthetic)
+    tester = LoadTester(args.mode, payloads, args.clients, args.qps, timeout=args.timeout)
+    report = tester.run(args.requests, args.duration)
+
+    if args.slo_p99_ms is not None:
+        report['slo_p99_ms'] = args.slo_p99_ms
+        report['slo_met'] = report['latency_ms']['p99'] <= args.slo_p99_ms
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if report.get('slo_met') is False:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,11 @@ Converted from Colab for RelayLoop integration
 import numpy as np
 import pandas as pd
 import os
+import sys
+import time
 import warnings
+from array import array
+from collections import deque
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, ExtraTreesClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import StandardScaler, LabelEncoder, RobustScaler
@@ -15,10 +19,122 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, roc_auc_score, f1_score
 import joblib
 from typing import Dict, Tuple, List, Optional
+import scipy.sparse as sp
+from feature_spec import FeatureSpec, BASE_DEFAULTS, DERIVED_FEATURES
+from sparse_panels import hstack_features, read_csv_sparse
+from categorical_encoding import HOSPITAL_CATEGORICALS
+from payload_validation import PayloadValidator, PAYLOAD_SCHEMA
+from profiling import stage as profile_stage, profiled
+from risk_factors import BIT, values_from_features
 
 warnings.filterwarnings('ignore')
 np.random.seed(42)
 
+# Ensemble members: model class and hyperparameters
+ENHANCED_MODEL_PARAMS = {
+    'random_forest': (RandomForestClassifier, {'n_estimators': 200, 'max_depth': 15, 'random_state': 42,
+                                               'class_weight': 'balanced', 'min_samples_split': 5}),
+    'extra_trees': (ExtraTreesClassifier, {'n_estimators': 200, 'max_depth': 15, 'random_state': 42,
+                                           'class_weight': 'balanced', 'min_samples_split': 5}),
+    'gradient_boosting': (GradientBoostingClassifier, {'n_estimators': 150, 'learning_rate': 0.1,
+                                                       'max_depth': 8, 'random_state': 42}),
+    'logistic_regression': (LogisticRegression, {'random_state': 42, 'class_weight': 'balanced',
+                                                 'max_iter': 2000, 'C': 0.1})
+}
+
+CONDITIONS = ['diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 'respiratory_disease']
+
+
+def _active_conditions(c):
+    return sum((c[condition] == 1).astype(int) for condition in CONDITIONS)
+
+
+# Clinical rules as (clinical weight key, predicate over mapped columns as numpy arrays or pandas
+# Series); batches and single patients (one row) are scored with the same table
+CLINICAL_RULES = [
+    ('age_elderly', lambda c: c['age_group'] == 'Elderly'),
+    ('age_senior', lambda c: c['age_group'] == 'Senior')
+] + [(condition, lambda c, condition=condition: c[condition] == 1) for condition in CONDITIONS] + [
+    ('multiple_comorbidities', lambda c: _active_conditions(c) >= 3),
+    ('icu_admission', lambda c: c['intensive_care_unit_admission'] == 1),
+    ('semi_intensive_admission', lambda c: (c['intensive_care_unit_admission'] != 1) &
+                                           (c['semi_intensive_unit_admission'] == 1)),
+    ('low_hemoglobin', lambda c: (c['hemoglobin'] < 12) & (c['hemoglobin'] > 0)),
+    ('low_platelets', lambda c: (c['platelets'] < 150) & (c['platelets'] > 0)),
+    ('low_lymphocytes', lambda c: (c['lymphocytes'] < 1.0) & (c['lymphocytes'] > 0)),
+    ('high_urea', lambda c: c['urea'] > 7.5),
+    ('covid_positive', lambda c: c['sars_cov2_exam_result'] == 1),
+    ('long_stay', lambda c: c['length_of_stay'] > 10),
+    ('frequent_admissions', lambda c: c['previous_admissions'] >= 2),
+    ('high_medications', lambda c: c['num_medications'] >= 10)
+]
+
+RULE_COLUMNS = CONDITIONS + ['intensive_care_unit_admission', 'semi_intensive_unit_admission', 'hemoglobin',
+                             'platelets', 'lymphocytes', 'urea', 'sars_cov2_exam_result', 'length_of_stay',
+                             'previous_admissions', 'num_medications']
+
+
+def _critical_conditions(c):
+    """ICU, severe anemia, thrombocytopenia or uremia, a very long stay, or four chronic conditions"""
+    return ((c['intensive_care_unit_admission'] == 1) | ((c['hemoglobin'] < 8) & (c['hemoglobin'] > 0)) |
+            ((c['platelets'] < 50) & (c['platelets'] > 0)) | (c['urea'] > 20) | (c['length_of_stay'] > 20) |
+            (_active_conditions(c) >= 4))
+
+
+# Final probability floors of the critical and ICU overrides
+CRITICAL_FLOOR = 0.70
+ICU_FLOOR = 0.65
+
+
+def _estimate_nbytes(obj, seen: Optional[set] = None) -> int:
+    """Approximate resident bytes of frames, arrays, fitted sklearn objects and plain containers"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if sp.issparse(obj):
+        return sum(_estimate_nbytes(getattr(obj, name, None), seen) for name in ('data', 'indices', 'indptr'))
+    if isinstance(obj, (str, bytes, int, float, array)):
+        return sys.getsizeof(obj)
+    if hasattr(obj, 'node_count') and hasattr(obj, '__getstate__'):
+        # sklearn Tree objects keep their nodes in C arrays
+        state = obj.__getstate__()
+        return int(state['nodes'].nbytes + state['values'].nbytes)
+    if isinstance(obj, dict):
+        return sum(_estimate_nbytes(v, seen) for v in obj.values())
+    if isinstance(obj, (list, tuple, set, deque)):
+        return sum(_estimate_nbytes(v, seen) for v in obj)
+    if hasattr(obj, '__dict__'):
+        return _estimate_nbytes(vars(obj), seen)
+    if hasattr(type(obj), '__slots__'):
+        return sum(_estimate_nbytes(getattr(obj, name, None), seen) for name in type(obj).__slots__)
+    return 0
+
+
+def _downcast_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Store a frame with categorical, float32 and narrow integer columns"""
+    compact = {}
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.SparseDtype):
+            compact[col] = series
+        elif pd.api.types.is_float_dtype(series):
+            compact[col] = series.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(series):
+            compact[col] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_bool_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype):
+            compact[col] = series
+        elif series.nunique(dropna=False) <= len(series) // 2:
+            compact[col] = series.astype('category')
+        else:
+            compact[col] = series
+    return pd.DataFrame(compact, index=df.index)
+
 class EnhancedAgeMerger:
     """Advanced age format merging with better risk stratification"""
 
@@ -67,8 +183,17 @@ class EnhancedMedicalPredictor:
         self.scalers = {}
         self.label_encoders = {}
         self.feature_columns = []
+        self.feature_spec = None
+        self.model_version = None
+        self.trend_store = None  # optional vital_trends.TrendStore with per-patient lab series
+        self.sparse_panel = None  # optional sparse_panels.SparsePanel trained on as a CSR block
+        self.categorical_encoder = None  # optional categorical_encoding.SparseCategoricalEncoder (CSR block)
+        # Smoothed seconds per model call, used to skip models that would miss a deadline
+        self.model_costs = {}
         self.is_trained = False
         self.historical_data = None
+        # Age may be a bracket such as '[70-80)', which the age merger reads itself
+        self.validator = PayloadValidator(fields=[f for f in PAYLOAD_SCHEMA if f != 'age'])
         self.data_path = data_path or os.path.join(os.path.dirname(__file__), '..', '..', 'data')
 
         # Enhanced risk thresholds for better sensitivity
@@ -113,6 +238,13 @@ class EnhancedMedicalPredictor:
             'multiple_comorbidities': 0.18
         }
 
+    def _read_csv(self, path: str) -> pd.DataFrame:
+        """Read a training CSV; with a sparse panel its columns arrive sparse, chunk by chunk"""
+        if self.sparse_panel is not None:
+            return read_csv_sparse(path, self.sparse_panel)
+        return pd.read_csv(path)
+
+    @profiled('csv_load')
     def load_datasets(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
         """Load datasets with enhanced medical conditions"""
         print("Loading enhanced medical datasets...")
@@ -131,14 +263,14 @@ class EnhancedMedicalPredictor:
                 # Load the hospital_readmissions.csv file
                 csv_path = os.path.join(self.data_path, 'hospital_readmissions.csv')
                 if os.path.exists(csv_path):
-                    dataset1_df = pd.read_csv(csv_path)
+                    dataset1_df = self._read_csv(csv_path)
                     print(f"Loaded hospital readmissions dataset: {dataset1_df.shape}")
                     datasets_loaded = True
                 
                 # If there's a second CSV, load it too
                 if len(csv_files) >= 2:
                     second_csv = [f for f in csv_files if f != 'hospital_readmissions.csv'][0]
-                    dataset2_df = pd.read_csv(os.path.join(self.data_path, second_csv))
+                    dataset2_df = self._read_csv(os.path.join(self.data_path, second_csv))
                     print(f"Loaded second dataset: {dataset2_df.shape}")
                 else:
                     # Create a synthetic second dataset based on the first
@@ -261,16 +393,17 @@ class EnhancedMedicalPredictor:
         """Enhanced preprocessing with comprehensive medical features"""
         print("Processing comprehensive medical datasets...")
 
+        # Find readmission columns (before age_group is appended, so the last-column fallback sees raw data)
+        readmit_col_1 = self._find_readmission_column(df1)
+        readmit_col_2 = self._find_readmission_column(df2)
+
         # Standardize age groups
         age_col_1 = self._find_age_column(df1)
         age_col_2 = self._find_age_column(df2)
 
-        df1['age_group'] = df1[age_col_1].apply(self.age_merger.standardize_age_group) if age_col_1 else 'Unknown'
-        df2['age_group'] = df2[age_col_2].apply(self.age_merger.standardize_age_group) if age_col_2 else 'Unknown'
-
-        # Find readmission columns
-        readmit_col_1 = self._find_readmission_column(df1)
-        readmit_col_2 = self._find_readmission_column(df2)
+        with profile_stage('age_standardization'):
+            df1['age_group'] = df1[age_col_1].apply(self.age_merger.standardize_age_group) if age_col_1 else 'Unknown'
+            df2['age_group'] = df2[age_col_2].apply(self.age_merger.standardize_age_group) if age_col_2 else 'Unknown'
 
         # Create enhanced unified features
         df1_processed = self._create_enhanced_unified_features(df1, 'dataset1', readmit_col_1)
@@ -307,13 +440,21 @@ class EnhancedMedicalPredictor:
                 return col
         return df.columns[-1]
 
+    def _readmission_target(self, series: pd.Series) -> pd.Series:
+        """Numeric 0/1 target; yes/no labels are mapped and anything else becomes NaN"""
+        if pd.api.types.is_numeric_dtype(series):
+            return series
+        labels = series.astype(str).str.strip().str.lower()
+        return pd.to_numeric(labels.replace({'yes': '1', 'no': '0', 'true': '1', 'false': '0'}), errors='coerce')
+
+    @profiled('feature_mapping')
     def _create_enhanced_unified_features(self, df: pd.DataFrame, source: str, readmit_col: str) -> pd.DataFrame:
         """Create comprehensive unified feature set"""
         unified_data = {
             'patient_id': df.iloc[:, 0] if len(df.columns) > 0 else range(len(df)),
             'age_group': df.get('age_group', 'Unknown'),
             'dataset_source': source,
-            'readmitted_30_days': df[readmit_col] if readmit_col in df.columns else 0
+            'readmitted_30_days': self._readmission_target(df[readmit_col]) if readmit_col in df.columns else 0
         }
 
         # Comprehensive feature mappings
@@ -347,10 +488,18 @@ class EnhancedMedicalPredictor:
             'previous_admissions': ['admission', 'previous']
         }
 
+        # Categorical columns are never keyword-matched into numeric features (e.g. diabetes_med into diabetes)
+        categorical = set(HOSPITAL_CATEGORICALS)
+        if self.categorical_encoder is not None:
+            categorical.update(self.categorical_encoder.columns)
+        numeric_columns = [col for col in df.columns if col not in categorical]
+
         for feature, keywords in feature_mappings.items():
-            for col in df.columns:
+            # An exact column name wins over keyword matches (e.g. 'potassium' vs 'kidney_disease')
+            candidates = [feature] if feature in numeric_columns else numeric_columns
+            for col in candidates:
                 col_lower = col.lower()
-                if any(keyword in col_lower for keyword in keywords):
+                if col == feature or any(keyword in col_lower for keyword in keywords):
                     if feature == 'gender':
                         unified_data[feature] = df[col]
                     else:
@@ -358,100 +507,93 @@ class EnhancedMedicalPredictor:
                     break
 
         # Fill missing features with defaults
-        defaults = {
-            'gender': 'Unknown',
-            'diabetes': 0, 'hypertension': 0, 'heart_disease': 0, 'kidney_disease': 0, 'respiratory_disease': 0,
-            'regular_ward_admission': 1, 'semi_intensive_unit_admission': 0, 'intensive_care_unit_admission': 0,
-            'hemoglobin': 13.0, 'hematocrit': 40.0, 'platelets': 250.0, 'red_blood_cells': 4.5,
-            'lymphocytes': 2.0, 'urea': 5.0, 'potassium': 4.0, 'sodium': 140.0,
-            'sars_cov2_exam_result': 0, 'length_of_stay': 5.0, 'num_medications': 5, 'previous_admissions': 0
-        }
-
-        for feature, default in defaults.items():
+        for feature, default in BASE_DEFAULTS.items():
             if feature not in unified_data:
                 unified_data[feature] = default
 
-        return pd.DataFrame(unified_data)
+        # Sparse panels stay SparseDtype (missing stays NaN) instead of being filled with zeros
+        if self.sparse_panel is not None:
+            unified_data.update(self.sparse_panel.sparse_columns(df))
 
-    def _create_risk_features(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Create additional risk features from lab values and conditions"""
-        # Comorbidity score
-        df['comorbidity_count'] = (
-            df['diabetes'] + df['hypertension'] + df['heart_disease'] +
-            df['kidney_disease'] + df['respiratory_disease']
-        )
+        # Raw categories are kept for the encoder; absent columns stay missing
+        if self.categorical_encoder is not None:
+            for col in self.categorical_encoder.columns:
+                unified_data[col] = df[col].to_numpy() if col in df.columns else None
 
-        # Lab abnormality flags
-        df['low_hemoglobin'] = (df['hemoglobin'] < 12).astype(int)
-        df['abnormal_hematocrit'] = ((df['hematocrit'] < 35) | (df['hematocrit'] > 50)).astype(int)
-        df['low_platelets'] = (df['platelets'] < 150).astype(int)
-        df['abnormal_rbc'] = ((df['red_blood_cells'] < 4.0) | (df['red_blood_cells'] > 6.0)).astype(int)
-        df['low_lymphocytes'] = (df['lymphocytes'] < 1.0).astype(int)
-        df['high_urea'] = (df['urea'] > 7.5).astype(int)
-        df['electrolyte_imbalance'] = ((df['potassium'] < 3.5) | (df['potassium'] > 5.0) |
-                                      (df['sodium'] < 136) | (df['sodium'] > 145)).astype(int)
-
-        # Critical care indicator
-        df['critical_care'] = df['intensive_care_unit_admission']
+        return pd.DataFrame(unified_data)
 
+    @profiled('risk_features')
+    def _create_risk_features(self, df: pd.DataFrame, now=None) -> pd.DataFrame:
+        """Create additional risk features from lab values and conditions
+
+        Trend windows are evaluated at `now`, a time or one time per row.
+        Without it (training, whose rows carry no timestamps) each series is
+        read at its last observation rather than at the wall clock.
+        """
+        for name, derive in DERIVED_FEATURES.items():
+            values = derive(df)
+            df[name] = values.astype(int) if values.dtype == bool else values
+
+        # Rolling trends come from the store's running aggregates, not from rescanning history
+        if self.trend_store is not None:
+            df = self.trend_store.join(df, now=now)
         return df
 
-    def train_enhanced_models(self, df: pd.DataFrame):
+    def train_enhanced_models(self, df: pd.DataFrame, model_params: Optional[Dict] = None):
         """Train enhanced models with better performance"""
         print("Training enhanced prediction models...")
 
         X, y = self._prepare_enhanced_features(df)
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.15, random_state=42, stratify=y)
-
-        # Enhanced scalers
-        self.scalers['robust'] = RobustScaler()
-        self.scalers['standard'] = StandardScaler()
-
-        X_train_standard = self.scalers['standard'].fit_transform(X_train)
-        X_test_standard = self.scalers['standard'].transform(X_test)
-
-        # Enhanced models with better parameters
-        models = {
-            'random_forest': RandomForestClassifier(n_estimators=200, max_depth=15, random_state=42,
-                                                  class_weight='balanced', min_samples_split=5),
-            'extra_trees': ExtraTreesClassifier(n_estimators=200, max_depth=15, random_state=42,
-                                              class_weight='balanced', min_samples_split=5),
-            'gradient_boosting': GradientBoostingClassifier(n_estimators=150, learning_rate=0.1,
-                                                          max_depth=8, random_state=42),
-            'logistic_regression': LogisticRegression(random_state=42, class_weight='balanced',
-                                                    max_iter=2000, C=0.1)
-        }
+        split = self._split_and_scale(X, y)
 
         best_accuracy = 0
-        for name, model in models.items():
+        for name, (model_class, params) in (model_params or ENHANCED_MODEL_PARAMS).items():
             try:
-                if name == 'logistic_regression':
-                    model.fit(X_train_standard, y_train)
-                    y_pred = model.predict(X_test_standard)
-                    y_prob = model.predict_proba(X_test_standard)[:, 1]
-                else:
-                    model.fit(X_train, y_train)
-                    y_pred = model.predict(X_test)
-                    y_prob = model.predict_proba(X_test)[:, 1]
-
+                model, metrics = self._fit_model(name, model_class(**params), split)
                 self.models[name] = model
-                accuracy = accuracy_score(y_test, y_pred)
-                auc = roc_auc_score(y_test, y_prob) if len(np.unique(y_test)) > 1 else 0.5
-                f1 = f1_score(y_test, y_pred)
-
-                if accuracy > best_accuracy:
-                    best_accuracy = accuracy
-
-                print(f"  {name.replace('_', ' ').title()}: Accuracy={accuracy:.3f}, AUC={auc:.3f}, F1={f1:.3f}")
-
+                best_accuracy = max(best_accuracy, metrics['accuracy'])
             except Exception as e:
                 print(f"  Error training {name}: {e}")
 
         self.is_trained = True
         print(f"Best model accuracy: {best_accuracy:.3f}")
 
+    def _split_and_scale(self, X, y) -> Dict:
+        """Hold out a stratified test set and fit the scalers on the training part"""
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.15, random_state=42, stratify=y)
+
+        # Enhanced scalers (sparse input cannot be centered without densifying it)
+        self.scalers['robust'] = RobustScaler()
+        self.scalers['standard'] = StandardScaler(with_mean=not sp.issparse(X))
+
+        return {
+            'X_train': X_train, 'X_test': X_test, 'y_train': y_train, 'y_test': y_test,
+            'X_train_standard': self.scalers['standard'].fit_transform(X_train),
+            'X_test_standard': self.scalers['standard'].transform(X_test)
+        }
+
+    def _fit_model(self, name: str, model, split: Dict) -> Tuple[object, Dict[str, float]]:
+        """Fit one ensemble member and score it on the held-out split"""
+        suffix = '_standard' if name == 'logistic_regression' else ''
+        X_train, X_test = split['X_train' + suffix], split['X_test' + suffix]
+        y_test = split['y_test']
+
+        with profile_stage(f'fit:{name}'):
+            model.fit(X_train, split['y_train'])
+        y_pred = model.predict(X_test)
+        y_prob = model.predict_proba(X_test)[:, 1]
+
+        metrics = {
+            'accuracy': accuracy_score(y_test, y_pred),
+            'auc': roc_auc_score(y_test, y_prob) if len(np.unique(y_test)) > 1 else 0.5,
+            'f1': f1_score(y_test, y_pred)
+        }
+        print(f"  {name.replace('_', ' ').title()}: Accuracy={metrics['accuracy']:.3f}, "
+              f"AUC={metrics['auc']:.3f}, F1={metrics['f1']:.3f}")
+        return model, metrics
+
     def _prepare_enhanced_features(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
-        """Prepare comprehensive feature set"""
+        """Prepare comprehensive feature set (a CSR matrix when a sparse panel is configured)"""
         categorical_cols = ['age_group', 'gender', 'dataset_source']
 
         for col in categorical_cols:
@@ -460,66 +602,131 @@ class EnhancedMedicalPredictor:
                     self.label_encoders[col] = LabelEncoder()
                     df[f'{col}_encoded'] = self.label_encoders[col].fit_transform(df[col].astype(str))
 
-        # Comprehensive feature list
-        feature_cols = [col for col in df.columns if col.endswith('_encoded') or col in [
-            'diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 'respiratory_disease',
-            'regular_ward_admission', 'semi_intensive_unit_admission', 'intensive_care_unit_admission',
-            'hemoglobin', 'hematocrit', 'platelets', 'red_blood_cells', 'lymphocytes', 'urea', 'potassium', 'sodium',
-            'sars_cov2_exam_result', 'length_of_stay', 'num_medications', 'previous_admissions',
-            'comorbidity_count', 'low_hemoglobin', 'abnormal_hematocrit', 'low_platelets', 'abnormal_rbc',
-            'low_lymphocytes', 'high_urea', 'electrolyte_imbalance', 'critical_care'
-        ]]
-
-        self.feature_columns = [col for col in feature_cols if col in df.columns]
-        X = df[self.feature_columns].fillna(0)
+        # The spec fixes column order and category codes for training and serving alike
+        trend_defaults = self.trend_store.defaults if self.trend_store is not None else None
+        self.feature_spec = FeatureSpec.from_label_encoders(self.label_encoders, extra_defaults=trend_defaults)
+        self.feature_columns = self.feature_spec.columns
         y = df['readmitted_30_days']
+        blocks = self._sparse_blocks(df, fit=True)
+        if blocks:
+            return hstack_features(self.feature_spec.transform_frame(df), sp.hstack(blocks, format='csr')), y
+        X = pd.DataFrame(self.feature_spec.transform_frame(df), columns=self.feature_columns, index=df.index)
         return X, y
 
-    def predict_patient_risk(self, patient_data: Dict) -> Dict:
-        """Enhanced prediction with comprehensive medical assessment"""
+    def _sparse_blocks(self, df: pd.DataFrame, fit: bool = False) -> List:
+        """CSR blocks (sparse panel, encoded categoricals) that follow the dense spec columns"""
+        blocks = []
+        if self.sparse_panel is not None:
+            blocks.append(self.sparse_panel.to_csr(df))
+            if fit:
+                self.feature_columns = self.feature_columns + self.sparse_panel.feature_names
+        if self.categorical_encoder is not None:
+            if fit and not self.categorical_encoder.fitted:
+                self.categorical_encoder.fit(df)
+            blocks.append(self.categorical_encoder.transform(df))
+            if fit:
+                self.feature_columns = self.feature_columns + self.categorical_encoder.feature_names
+        return blocks
+
+    def get_feature_spec(self) -> FeatureSpec:
+        """Feature spec for this model, rebuilt from the encoders for models saved without one"""
+        if self.feature_spec is None:
+            self.feature_spec = FeatureSpec.from_label_encoders(self.label_encoders, self.feature_columns or None)
+        return self.feature_spec
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Report approximate resident bytes per component"""
+        usage = {'historical_data': _estimate_nbytes(self.historical_data) if self.historical_data is not None else 0}
+        for name, model in self.models.items():
+            usage[f'model.{name}'] = _estimate_nbytes(model)
+        usage['scalers'] = _estimate_nbytes(self.scalers)
+        usage['label_encoders'] = _estimate_nbytes(self.label_encoders)
+        for name in ('trend_store', 'sparse_panel', 'categorical_encoder', 'feature_spec', 'validator'):
+            component = getattr(self, name)
+            usage[name] = _estimate_nbytes(component) if component is not None else 0
+        usage['total'] = sum(usage.values())
+        return usage
+
+    def enable_serving_mode(self, memory_budget: Optional[int] = None, keep_history: bool = False) -> Dict[str, int]:
+        """Drop training-only state and shrink what is left to fit the memory budget (bytes)"""
         if not self.is_trained:
-            raise ValueError("System must be trained before making predictions!")
+            raise ValueError("System must be trained before entering serving mode!")
 
-        try:
-            # Calculate enhanced clinical risk
-            clinical_score, risk_factors = self._calculate_enhanced_clinical_score(patient_data)
+        # The robust scaler is created during training but never fitted or used
+        self.scalers.pop('robust', None)
+
+        if self.historical_data is not None:
+            if keep_history:
+                self.historical_data = _downcast_frame(self.historical_data)
+            else:
+                self.historical_data = None
 
-            # Get ML predictions from all models
-            ml_predictions = []
-            patient_features = self._prepare_patient_features(patient_data)
+        usage = self.memory_usage()
+        if memory_budget is not None and usage['total'] > memory_budget and self.historical_data is not None:
+            self.historical_data = None
+            usage = self.memory_usage()
 
+        if memory_budget is not None and usage['total'] > memory_budget:
+            # Flat quantized trees are several times smaller than sklearn's node structs
+            from model_artifacts import compact_model
             for name, model in self.models.items():
-                try:
-                    if name == 'logistic_regression':
-                        X_scaled = self.scalers['standard'].transform([patient_features])
-                        prob = model.predict_proba(X_scaled)[:, 1][0]
-                    else:
-                        prob = model.predict_proba([patient_features])[:, 1][0]
-                    ml_predictions.append(prob)
-                except:
-                    ml_predictions.append(0.25)
+                if not hasattr(model, 'to_arrays'):
+                    self.models[name] = compact_model(model)
+            usage = self.memory_usage()
 
-            ml_probability = np.mean(ml_predictions) if ml_predictions else 0.25
+        if memory_budget is not None and usage['total'] > memory_budget:
+            raise MemoryError(f"Serving state needs {usage['total']} bytes, budget is {memory_budget}")
 
-            # Enhanced combination with age multiplier
-            age_group = self.age_merger.standardize_age_group(
-                patient_data.get('age', patient_data.get('patient_age_quantile', 50))
-            )
-            age_multiplier = self.age_merger.get_age_risk_multiplier(age_group)
+        print(f"Serving mode enabled: {usage['total'] / 1e6:.1f} MB resident model state")
+        return usage
 
-            # Weighted combination: 60% ML, 40% clinical, with age multiplier
-            base_probability = (0.60 * ml_probability) + (0.40 * clinical_score)
-            final_probability = min(base_probability * age_multiplier, 1.0)
+    @profiled('prediction')
+    def predict_patient_risk(self, patient_data: Dict, deadline: Optional[float] = None) -> Dict:
+        """Enhanced prediction with comprehensive medical assessment
 
-            # Critical condition overrides
-            if self._has_critical_conditions(patient_data):
-                final_probability = max(final_probability, 0.70)
-                risk_factors.append('Critical medical conditions detected')
+        deadline is an absolute time.monotonic() value. Ensemble members that
+        would finish after it are skipped; when none can run the result is
+        the clinical score alone and is flagged as degraded.
+        """
+        if not self.is_trained:
+            raise ValueError("System must be trained before making predictions!")
+        return self._patient_risk(patient_data, deadline)
 
-            # ICU admission override
-            if patient_data.get('intensive_care_unit_admission', 0) == 1:
-                final_probability = max(final_probability, 0.65)
-                risk_factors.append('ICU admission - high risk')
+    def clinical_only_risk(self, patient_data: Dict, reason: str) -> Dict:
+        """The clinical score alone, flagged as degraded for reason; needs no trained models"""
+        return self._patient_risk(patient_data, unavailable=reason)
+
+    def _patient_risk(self, patient_data: Dict, deadline: Optional[float] = None,
+                      unavailable: Optional[str] = None) -> Dict:
+        try:
+            # Rejected fields are scored as missing and reported with the result
+            validation = self.validator.validate([patient_data])
+            patient_data = validation.clean_record(0, patient_data)
+
+            # Get ML predictions from all models that fit in the time budget
+            ml_predictions, models_used, degraded_reason = [], [], unavailable
+            if unavailable is None:
+                patient_features = self._prepare_patient_features(patient_data)
+                ml_predictions, models_used = self._model_predictions(patient_features, deadline)
+                if not ml_predictions:
+                    degraded_reason = 'deadline' if deadline is not None else 'model_error'
+                elif len(models_used) < len(self.models):
+                    degraded_reason = 'partial_ensemble'
+            # Without any model output the clinical score stands alone (NaN in the assessment)
+            ml_probability = float(np.mean(ml_predictions)) if ml_predictions else np.nan
+
+            # The same clinical rules as batches, on a one-row set of columns
+            age_group = self.age_merger.standardize_age_group(
+                patient_data.get('age', patient_data.get('patient_age_quantile', 50))
+            )
+            columns = {col: np.array([patient_data.get(col, BASE_DEFAULTS[col])], dtype=np.float64)
+                       for col in RULE_COLUMNS}
+            columns['age_group'] = np.array([age_group], dtype=object)
+            assessment = self._clinical_assessment(columns, np.array([ml_probability]))
+            clinical_score = float(assessment['clinical_score'][0])
+            age_multiplier = float(assessment['age_multiplier'][0])
+            final_probability = float(assessment['final_probability'][0])
+            risk_factor_mask = int(assessment['risk_factor_mask'][0])
 
             risk_level = self._get_risk_level(final_probability)
 
@@ -527,200 +734,174 @@ class EnhancedMedicalPredictor:
                 'patient_id': patient_data.get('patient_id', 'unknown'),
                 'risk_level': risk_level,
                 'risk_percentage': round(final_probability * 100, 1),
-                'ml_probability': round(ml_probability * 100, 1),
+                'ml_probability': round(ml_probability * 100, 1) if ml_predictions else None,
                 'clinical_score': round(clinical_score * 100, 1),
                 'age_multiplier': round(age_multiplier, 2),
-                'risk_factors': risk_factors,
+                # Coded risk factors; text is rendered where the response leaves the service
+                'risk_factor_mask': risk_factor_mask,
+                'risk_factor_values': values_from_features(risk_factor_mask, patient_data),
                 'recommendation': self._get_recommendation(risk_level, final_probability),
                 'confidence': round(self._calculate_confidence(ml_predictions, clinical_score), 1),
-                'age_group': age_group
+                'age_group': age_group,
+                'model_version': self.model_version,
+                'degraded': degraded_reason is not None,
+                'degraded_reason': degraded_reason,
+                'models_used': models_used,
+                'validation_errors': validation.errors(0)
             }
 
         except Exception as e:
             return {
                 'patient_id': patient_data.get('patient_id', 'unknown'),
                 'error': f"Prediction error: {str(e)}",
-                'risk_level': 'error'
+                'risk_level': 'error',
+                'model_version': self.model_version
             }
 
-    def _prepare_patient_features(self, patient_data: Dict) -> List[float]:
-        """Prepare comprehensive patient features"""
+    def _model_predictions(self, features: np.ndarray, deadline: Optional[float] = None) -> Tuple[List[float], List[str]]:
+        """Probabilities of the ensemble members that fit before the deadline, and their names"""
+        predictions, models_used = [], []
+        for name, model in list(self.models.items()):
+            start = time.monotonic()
+            if deadline is not None and start + self.model_costs.get(name, 0.0) > deadline:
+                # Let the estimate decay so a one-off slow call does not exclude the model for good
+                if name in self.model_costs:
+                    self.model_costs[name] *= 0.9
+                continue
+            try:
+                X = self.scalers['standard'].transform(features) if name == 'logistic_regression' else features
+                prob = float(model.predict_proba(X)[:, 1][0])
+            except Exception as e:
+                # A failed model is left out of the ensemble rather than averaged in as a guess
+                print(f"ML prediction error ({name}): {e}", file=sys.stderr)
+                continue
+            predictions.append(prob)
+            models_used.append(name)
+            elapsed = time.monotonic() - start
+            self.model_costs[name] = 0.8 * self.model_costs.get(name, elapsed) + 0.2 * elapsed
+        return predictions, models_used
+
+    def _prepare_patient_features(self, patient_data: Dict) -> np.ndarray:
+        """Prepare comprehensive patient features as a single-row matrix"""
         age_group = self.age_merger.standardize_age_group(
             patient_data.get('age', patient_data.get('patient_age_quantile', 50))
         )
+        record = dict(patient_data, age_group=age_group, dataset_source='dataset1')
+        if self.trend_store is not None and 'patient_id' in patient_data:
+            now = patient_data.get('recorded_at') or time.time()
+            record.update(self.trend_store.features(patient_data['patient_id'], now))
+        features = self.get_feature_spec().transform_records([record])
+        if self.sparse_panel is not None:
+            features = hstack_features(features, self.sparse_panel.records_to_dense([patient_data]))
+        if self.categorical_encoder is not None:
+            features = hstack_features(features, self.categorical_encoder.transform_records([patient_data]))
+        return features
 
-        features = []
-
-        # Encoded features
-        if 'age_group' in self.label_encoders:
-            try:
-                age_encoded = self.label_encoders['age_group'].transform([age_group])[0]
-            except:
-                age_encoded = 0
-        else:
-            age_encoded = 0
-        features.append(age_encoded)
-
-        gender = patient_data.get('gender', 'Unknown')
-        if 'gender' in self.label_encoders:
-            try:
-                gender_encoded = self.label_encoders['gender'].transform([str(gender)])[0]
-            except:
-                gender_encoded = 0
-        else:
-            gender_encoded = 0
-        features.append(gender_encoded)
-
-        features.append(0)  # dataset_source
-
-        # All medical features
-        medical_features = [
-            'diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 'respiratory_disease',
-            'regular_ward_admission', 'semi_intensive_unit_admission', 'intensive_care_unit_admission',
-            'hemoglobin', 'hematocrit', 'platelets', 'red_blood_cells', 'lymphocytes', 'urea', 'potassium', 'sodium',
-            'sars_cov2_exam_result', 'length_of_stay', 'num_medications', 'previous_admissions'
-        ]
+    def prepare_batch_features(self, raw_df: pd.DataFrame, now=None) -> pd.DataFrame:
+        """Map raw rows through the same feature pipeline used for training
+
+        Trends are read at each row's recorded_at when present, else at `now`
+        (default: the current time), as for single predictions.
+        """
+        df = raw_df.copy()
+        age_col = self._find_age_column(df)
+        df['age_group'] = df[age_col].apply(self.age_merger.standardize_age_group) if age_col else 'Unknown'
+
+        frame = self._create_enhanced_unified_features(df, 'dataset1', None)
+        frame.index = raw_df.index
+        now = time.time() if now is None else now
+        if 'recorded_at' in raw_df.columns:
+            now = raw_df['recorded_at'].where(raw_df['recorded_at'].notna(), now).to_numpy(dtype=object)
+        return self._create_risk_features(frame, now)
+
+    @profiled('batch_prediction')
+    def predict_batch(self, raw_df: pd.DataFrame) -> pd.DataFrame:
+        """Vectorized prediction for a frame of patients"""
+        if not self.is_trained:
+            raise ValueError("System must be trained before making predictions!")
+        return self.predict_prepared(self.prepare_batch_features(raw_df))
 
-        for feature in medical_features:
-            value = patient_data.get(feature, 0)
-            try:
-                features.append(float(value))
-            except:
-                features.append(0.0)
-
-        # Calculated features
-        comorbidity_count = sum([
-            patient_data.get('diabetes', 0), patient_data.get('hypertension', 0),
-            patient_data.get('heart_disease', 0), patient_data.get('kidney_disease', 0),
-            patient_data.get('respiratory_disease', 0)
-        ])
-        features.append(comorbidity_count)
-
-        # Lab abnormality features
-        hb = patient_data.get('hemoglobin', 13.0)
-        hct = patient_data.get('hematocrit', 40.0)
-        plt = patient_data.get('platelets', 250.0)
-        rbc = patient_data.get('red_blood_cells', 4.5)
-        lymph = patient_data.get('lymphocytes', 2.0)
-        urea = patient_data.get('urea', 5.0)
-        k = patient_data.get('potassium', 4.0)
-        na = patient_data.get('sodium', 140.0)
-
-        features.extend([
-            1 if hb < 12 else 0,  # low_hemoglobin
-            1 if (hct < 35 or hct > 50) else 0,  # abnormal_hematocrit
-            1 if plt < 150 else 0,  # low_platelets
-            1 if (rbc < 4.0 or rbc > 6.0) else 0,  # abnormal_rbc
-            1 if lymph < 1.0 else 0,  # low_lymphocytes
-            1 if urea > 7.5 else 0,  # high_urea
-            1 if (k < 3.5 or k > 5.0 or na < 136 or na > 145) else 0,  # electrolyte_imbalance
-            patient_data.get('intensive_care_unit_admission', 0)  # critical_care
-        ])
+    def predict_prepared(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Vectorized prediction for rows already mapped by prepare_batch_features"""
+        if not self.is_trained:
+            raise ValueError("System must be trained before making predictions!")
 
-        return features
+        X = self.get_feature_spec().transform_frame(frame)
+        # Compact artifact trees evaluate dense rows; the blocks are bounded in width
+        blocks = self._sparse_blocks(frame)
+        if blocks:
+            X = hstack_features(X, sp.hstack(blocks, format='csr').toarray())
 
-    def _calculate_enhanced_clinical_score(self, patient_data: Dict) -> Tuple[float, List[str]]:
-        """Calculate comprehensive clinical risk score"""
-        risk_score = 0.0
-        risk_factors = []
+        ml_predictions = []
+        for name, model in self.models.items():
+            if name == 'logistic_regression':
+                ml_predictions.append(model.predict_proba(self.scalers['standard'].transform(X))[:, 1])
+            else:
+                ml_predictions.append(model.predict_proba(X)[:, 1])
+        ml_predictions = np.vstack(ml_predictions) if ml_predictions else np.full((1, len(frame)), 0.25)
+        ml_probability = ml_predictions.mean(axis=0)
 
-        # Age factors
-        age_group = self.age_merger.standardize_age_group(
-            patient_data.get('age', patient_data.get('patient_age_quantile', 50))
-        )
+        columns = {col: frame[col].to_numpy() for col in RULE_COLUMNS + ['age_group']}
+        assessment = self._clinical_assessment(columns, ml_probability)
+        clinical_score = assessment['clinical_score']
+        age_multiplier = assessment['age_multiplier']
+        final_probability = assessment['final_probability']
 
-        if age_group == 'Elderly':
-            risk_score += self.clinical_weights['age_elderly']
-            risk_factors.append('Advanced age (80+ years) - very high risk')
-        elif age_group == 'Senior':
-            risk_score += self.clinical_weights['age_senior']
-            risk_factors.append('Senior age (65-80 years) - increased risk')
-
-        # Chronic conditions
-        conditions = {
-            'diabetes': 'Diabetes mellitus',
-            'hypertension': 'Hypertension',
-            'heart_disease': 'Heart disease',
-            'kidney_disease': 'Kidney disease',
-            'respiratory_disease': 'Respiratory disease'
-        }
+        medium_cutoff, high_cutoff = self.risk_thresholds['medium'][0], self.risk_thresholds['high'][0]
+        risk_level = np.where(final_probability >= high_cutoff, 'high',
+                              np.where(final_probability >= medium_cutoff, 'medium', 'low'))
 
-        active_conditions = []
-        for condition, label in conditions.items():
-            if patient_data.get(condition, 0) == 1:
-                risk_score += self.clinical_weights.get(condition, 0.08)
-                active_conditions.append(label)
-
-        if len(active_conditions) >= 3:
-            risk_score += self.clinical_weights['multiple_comorbidities']
-            risk_factors.append(f'Multiple comorbidities: {", ".join(active_conditions)}')
-        elif active_conditions:
-            risk_factors.extend(active_conditions)
-
-        # Hospital admission severity
-        if patient_data.get('intensive_care_unit_admission', 0) == 1:
-            risk_score += self.clinical_weights['icu_admission']
-            risk_factors.append('ICU admission - critical condition')
-        elif patient_data.get('semi_intensive_unit_admission', 0) == 1:
-            risk_score += self.clinical_weights['semi_intensive_admission']
-            risk_factors.append('Semi-intensive unit admission')
-
-        # Lab abnormalities
-        lab_checks = [
-            ('hemoglobin', 12, 'low_hemoglobin', 'Low hemoglobin (anemia)'),
-            ('platelets', 150, 'low_platelets', 'Low platelets (thrombocytopenia)'),
-            ('lymphocytes', 1.0, 'low_lymphocytes', 'Low lymphocytes (immunocompromised)'),
-            ('urea', 7.5, 'high_urea', 'Elevated urea (kidney dysfunction)')
-        ]
-
-        for lab, threshold, weight_key, description in lab_checks:
-            value = patient_data.get(lab, 0)
-            if (lab == 'urea' and value > threshold) or (lab != 'urea' and value < threshold and value > 0):
-                risk_score += self.clinical_weights.get(weight_key, 0.06)
-                risk_factors.append(f'{description} ({value})')
-
-        # COVID-19
-        if patient_data.get('sars_cov2_exam_result', 0) == 1:
-            risk_score += self.clinical_weights['covid_positive']
-            risk_factors.append('COVID-19 positive')
-
-        # Length of stay
-        los = patient_data.get('length_of_stay', 5)
-        if los > 10:
-            risk_score += self.clinical_weights['long_stay']
-            risk_factors.append(f'Extended hospitalization ({los} days)')
-
-        # Frequent admissions
-        prev_admissions = patient_data.get('previous_admissions', 0)
-        if prev_admissions >= 2:
-            risk_score += self.clinical_weights['frequent_admissions']
-            risk_factors.append(f'Frequent admissions ({prev_admissions} in past year)')
-
-        # High medication count
-        medications = patient_data.get('num_medications', 5)
-        if medications >= 10:
-            risk_score += self.clinical_weights['high_medications']
-            risk_factors.append(f'Polypharmacy ({medications} medications)')
-
-        return min(risk_score, 1.0), risk_factors
-
-    def _has_critical_conditions(self, patient_data: Dict) -> bool:
-        """Check for critical medical conditions"""
-        critical_indicators = [
-            patient_data.get('intensive_care_unit_admission', 0) == 1,
-            patient_data.get('hemoglobin', 13) < 8,  # Severe anemia
-            patient_data.get('platelets', 250) < 50,  # Severe thrombocytopenia
-            patient_data.get('urea', 5) > 20,  # Severe kidney dysfunction
-            patient_data.get('length_of_stay', 5) > 20,  # Very long stay
-            sum([patient_data.get(c, 0) for c in ['diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 'respiratory_disease']]) >= 4
-        ]
-        return any(critical_indicators)
+        if len(ml_predictions) > 1:
+            agreement_bonus = np.maximum(0, 0.20 - ml_predictions.std(axis=0))
+        else:
+            agreement_bonus = np.full(len(frame), 0.10)
+        confidence = np.minimum(0.75 + agreement_bonus + np.minimum(clinical_score * 0.15, 0.15), 1.0) * 100
+
+        return pd.DataFrame({
+            'risk_level': risk_level,
+            'risk_percentage': np.round(final_probability * 100, 1),
+            'ml_probability': np.round(ml_probability * 100, 1),
+            'clinical_score': np.round(clinical_score * 100, 1),
+            'age_multiplier': np.round(age_multiplier, 2),
+            'confidence': np.round(confidence, 1),
+            'age_group': frame['age_group'].to_numpy(),
+            'risk_factor_mask': assessment['risk_factor_mask']
+        }, index=frame.index)
+
+    def _clinical_assessment(self, columns: Dict[str, np.ndarray], ml_probability: np.ndarray) -> Dict[str, np.ndarray]:
+        """Clinical score, risk factor mask, age multiplier and final probability per row
+
+        columns maps age_group and RULE_COLUMNS to equal-length arrays;
+        ml_probability is NaN for rows without any model output.
+        """
+        clinical_score = np.zeros(len(ml_probability))
+        mask = np.zeros(len(ml_probability), dtype=np.int64)
+        for key, rule in CLINICAL_RULES:
+            flag = np.asarray(rule(columns), dtype=bool)
+            clinical_score += self.clinical_weights[key] * flag
+            mask |= np.where(flag, BIT[key], 0)
+        clinical_score = np.minimum(clinical_score, 1.0)
+
+        multipliers = self.age_merger.age_risk_multipliers
+        age_multiplier = np.array([multipliers.get(group, 1.0) for group in columns['age_group']], dtype=np.float64)
+        # Weighted combination: 60% ML, 40% clinical, with age multiplier; NaN (no model output) is clinical only
+        base_probability = np.where(np.isnan(ml_probability), clinical_score, 0.60 * ml_probability + 0.40 * clinical_score)
+        final_probability = np.minimum(base_probability * age_multiplier, 1.0)
+
+        # Critical condition and ICU overrides
+        critical = np.asarray(_critical_conditions(columns), dtype=bool)
+        final_probability = np.where(critical, np.maximum(final_probability, CRITICAL_FLOOR), final_probability)
+        icu = (mask & BIT['icu_admission']) != 0
+        final_probability = np.where(icu, np.maximum(final_probability, ICU_FLOOR), final_probability)
+        mask |= np.where(critical, BIT['critical_conditions'], 0)
+        return {'clinical_score': clinical_score, 'risk_factor_mask': mask,
+                'age_multiplier': age_multiplier, 'final_probability': final_probability}
 
     def _get_risk_level(self, probability: float) -> str:
         """Get risk level from probability"""
-        if probability >= 0.55:
+        if probability >= self.risk_thresholds['high'][0]:
             return 'high'
-        elif probability >= 0.25:
+        elif probability >= self.risk_thresholds['medium'][0]:
             return 'medium'
         else:
             return 'low'
@@ -754,15 +935,24 @@ class MLPredictionService:
         self.predictor = None
         self.is_initialized = False
         
-    def initialize(self, data_path: str = None):
+    def initialize(self, data_path: str = None, memory_budget_mb: Optional[float] = None, sparse_panel=None,
+                   categorical_encoder=None):
         """Initialize the ML prediction service"""
         try:
             self.predictor = EnhancedMedicalPredictor(data_path)
+            self.predictor.sparse_panel = sparse_panel
+            self.predictor.categorical_encoder = categorical_encoder
             
             # Load and train the model
             dataset1_df, dataset2_df = self.predictor.load_datasets()
             combined_data = self.predictor.preprocess_datasets(dataset1_df, dataset2_df)
             self.predictor.train_enhanced_models(combined_data)
+            self.predictor.model_version = 'trained-' + time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+            del dataset1_df, dataset2_df, combined_data
+
+            # Serve lean when a memory budget is configured
+            if memory_budget_mb is not None:
+                self.predictor.enable_serving_mode(int(memory_budget_mb * 1024 * 1024))
             
             self.is_initialized = True
             print("ML Prediction Service initialized successfully!")
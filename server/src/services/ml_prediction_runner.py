@@ -8,31 +8,225 @@ This script is called from Node.js to run ML predictions
 import sys
 import json
 import os
+import threading
+import time
 import traceback
 
+# Request deadlines in argv mode count from process start, so imports and model loading are included
+PROCESS_START = time.monotonic()
+
+# Time kept back from a deadline for the clinical score and writing the response
+DEADLINE_RESERVE = 0.005
+
 # Add the services directory to the path
 sys.path.append(os.path.join(os.path.dirname(__file__)))
 
 try:
     # Import our ML service
     from ml_prediction_service import ml_service
+    from profiling import StageProfiler, pop_profile_arg
+    from risk_factors import render_prediction
+    from request_coalescing import SingleFlight, prediction_key
+
+    # Concurrent serve requests for the same features and model version share one computation;
+    # a result degraded by its own request's deadline (or by loading) is not handed to others
+    coalescer = SingleFlight(shareable=lambda result: not result.get('degraded'))
     
+    _init_lock = threading.Lock()
+    _init_thread = None
+
+    def ensure_initialized(deadline=None):
+        """Initialize ML service if not already done; with a deadline, wait at most until then"""
+        global _init_thread
+        if ml_service.is_initialized:
+            return True
+        with _init_lock:
+            if _init_thread is None:
+                data_path = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
+                _init_thread = threading.Thread(target=ml_service.initialize, args=(data_path,), daemon=True)
+                _init_thread.start()
+        _init_thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return ml_service.is_initialized
+
+    def request_deadline(patient_data, received):
+        """Absolute model deadline from an optional deadline_ms budget in the request"""
+        budget_ms = patient_data.pop('deadline_ms', None)
+        if budget_ms is None:
+            return None
+        return received + float(budget_ms) / 1000.0 - DEADLINE_RESERVE
+
+    def predict(patient_data, received, deadline=None):
+        if deadline is None:
+            deadline = request_deadline(patient_data, received)
+        ensure_initialized(deadline)
+        return ml_service.predict_readmission(patient_data, deadline)
+
+    def score(patient_data, received, registry=None, pool=None):
+        """One prediction, shared with concurrent requests for the same features and model version
+
+        A model_variant field selects a variant from the model pool instead of
+        the default model.
+        """
+        deadline = request_deadline(patient_data, received)
+        variant = patient_data.pop('model_variant', None)
+        if variant is not None and pool is None:
+            raise ValueError('model_variant requires serving with --pool')
+        start = time.perf_counter()
+        source = pool if variant is not None else registry
+        handle = resolved = None
+        try:
+            if variant is not None:
+                # Variants can share version names, so pool keys (variant@version) name the variant too
+                resolved = pool.resolve(variant)
+                handle = pool.acquire(resolved, None if deadline is None else max(deadline - time.monotonic(), 0))
+                if handle is None:
+                    # Still loading in the background; degraded results are not shared with other requests
+                    prediction_result = pool.loading_result(patient_data)
+                    prediction_result['model_version'] = resolved
+                    return prediction_result
+            elif registry:
+                handle = registry.acquire()
+            if handle is not None:
+                version = handle.version if variant is None else resolved
+                compute = lambda: handle.predict(patient_data, deadline)
+            else:
+                version, compute = ml_service.model_version, lambda: predict(patient_data, received, deadline)
+            key = prediction_key(patient_data, version)
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            prediction_result, _ = coalescer.do(key, compute, timeout)
+            return prediction_result
+        finally:
+            if source:
+                source.release(handle)
+            if resolved is not None:
+                pool.record(resolved, time.perf_counter() - start)
+
+    def serve(registry_dir=None, shadow=None, factor_text=True, workers=1, pool=None):
+        """Resident mode: one patient JSON per stdin line, one result JSON per stdout line
+
+        With workers > 1 requests are scored concurrently and answered as they
+        finish, so responses can arrive out of order; request_id is echoed back.
+        """
+        # Load in the background so requests with a deadline can be answered meanwhile
+        ensure_initialized(deadline=0)
+
+        # With a registry, versioned artifacts are hot-swapped in the background
+        registry = None
+        if registry_dir:
+            from model_registry import ModelRegistry
+            registry = ModelRegistry(registry_dir).start()
+
+        write_lock = threading.Lock()
+
+        def respond(line, received):
+            request_id = None
+            try:
+                patient_data = json.loads(line)
+                request_id = patient_data.pop('request_id', None)
+                prediction_result = score(patient_data, received, registry, pool)
+            except Exception as e:
+                patient_data = None
+                prediction_result = {'error': str(e), 'risk_level': 'error', 'model_version': None}
+            if request_id is not None:
+                prediction_result['request_id'] = request_id
+            # Risk factors stay coded inside the service; text is rendered here, at the edge
+            if factor_text:
+                render_prediction(prediction_result)
+            with write_lock:
+                sys.stdout.write(json.dumps(prediction_result) + '\n')
+                sys.stdout.flush()
+
+            # The shadow only sees a request after its response has been sent
+            if shadow is not None and patient_data is not None:
+                shadow.submit(patient_data, prediction_result)
+
+        executor = None
+        if workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='serve')
+
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            received = time.monotonic()
+            if executor is not None:
+                executor.submit(respond, line, received)
+            else:
+                respond(line, received)
+
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if registry:
+            registry.stop()
+
+    def parse_serve_args(argv):
+        import argparse
+        parser = argparse.ArgumentParser(prog='ml_prediction_runner.py --serve',
+                                         description='Resident JSON-lines prediction service')
+        parser.add_argument('--registry', default=os.environ.get('RELAYLOOP_MODEL_REGISTRY'),
+                            help='Model registry directory to serve and hot-swap from')
+        parser.add_argument('--shadow', default=None, help='Candidate compact artifact to shadow-score')
+        parser.add_argument('--shadow-rate', type=float, default=0.1, help='Fraction of requests shadow-scored')
+        parser.add_argument('--shadow-report', default=None, help='Write the shadow report here (default: stderr)')
+        parser.add_argument('--factor-codes', action='store_true',
+                            help='Return risk factors only as risk_factor_mask/risk_factor_values, without text')
+        parser.add_argument('--pool', default=os.environ.get('RELAYLOOP_MODEL_POOL'),
+                            help='Artifact store of model variants, selected per request by model_variant')
+        parser.add_argument('--pool-memory-mb', type=float,
+                            default=float(os.environ.get('RELAYLOOP_POOL_MEMORY_MB', 512)),
+                            help='Resident size of pool variants above which the least recently used are evicted')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Requests scored concurrently; above 1 responses may be out of order '
+                                 '(match them by request_id)')
+        return parser.parse_args(argv)
+
     def main():
+        # --profile PATH writes a stage report (and PATH.folded stacks) without touching stdout
+        profile_path = pop_profile_arg(sys.argv)
+        if profile_path:
+            profiler = StageProfiler().start()
+            try:
+                run()
+            finally:
+                profiler.write(profile_path)
+        else:
+            run()
+
+    def run():
+        if len(sys.argv) >= 2 and sys.argv[1] == '--serve':
+            args = parse_serve_args(sys.argv[2:])
+            shadow = None
+            if args.shadow:
+                from shadow_scoring import load_shadow, write_report
+                shadow = load_shadow(args.shadow, args.shadow_rate)
+            pool = None
+            if args.pool:
+                from model_pool import ModelPool
+                pool = ModelPool(args.pool, max_bytes=int(args.pool_memory_mb * (1 << 20)))
+            try:
+                serve(args.registry, shadow, factor_text=not args.factor_codes, workers=args.workers, pool=pool)
+            finally:
+                if shadow is not None:
+                    write_report(shadow.close(), args.shadow_report)
+                if pool is not None:
+                    print(f'[model-pool] {json.dumps(pool.stats())}', file=sys.stderr, flush=True)
+                # stdout carries responses in serve mode
+                print(f'[coalescing] {json.dumps(coalescer.stats())}', file=sys.stderr, flush=True)
+            return
+
         if len(sys.argv) != 2:
-            print("Usage: python ml_prediction_runner.py '<patient_data_json>'", file=sys.stderr)
+            print("Usage: python ml_prediction_runner.py '<patient_data_json>' | --serve [options] "
+                  "[--profile PATH]",
+                  file=sys.stderr)
             sys.exit(1)
         
         try:
             # Parse input data
             patient_data = json.loads(sys.argv[1])
             
-            # Initialize ML service if not already done
-            if not ml_service.is_initialized:
-                data_path = os.path.join(os.path.dirname(__file__), '..', '..', 'data')
-                ml_service.initialize(data_path)
-            
             # Make prediction
-            prediction_result = ml_service.predict_readmission(patient_data)
+            prediction_result = render_prediction(predict(patient_data, PROCESS_START))
             
             # Output result as JSON
             print(json.dumps(prediction_result))
@@ -41,7 +235,8 @@ try:
             error_result = {
                 'error': str(e),
                 'traceback': traceback.format_exc(),
-                'risk_level': 'error'
+                'risk_level': 'error',
+                'model_version': None
             }
             print(json.dumps(error_result))
             sys.exit(1)
@@ -61,6 +256,7 @@ except ImportError as e:
         'risk_factors': ['ML service unavailable - using fallback prediction'],
         'recommendation': 'MODERATE RISK: Enhanced discharge planning, medication reconciliation, patient education, 3-7 day follow-up',
         'confidence': 60.0,
-        'age_group': 'Unknown'
+        'age_group': 'Unknown',
+        'model_version': 'fallback'
     }
     print(json.dumps(error_result))
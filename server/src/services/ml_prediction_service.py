@@ -8,9 +8,16 @@ This service provides readmission predictions using the enhanced ML model
 import sys
 import os
 import json
+import time
 import numpy as np
 import pandas as pd
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
+
+from profiling import stage as profile_stage, profiled
+from risk_factors import BIT, primary_concerns
+from payload_validation import PayloadValidator
+from clinical_score_table import (AGE_GROUPS, AGE_BITS, CRITICAL_FLOOR, RECOMMENDATIONS, ClinicalScoreTable,
+                                  ClinicalWeights, quoted_values, recommendation_id, risk_level)
 
 # Try to import ML libraries, fall back to basic prediction if not available
 try:
@@ -25,17 +32,30 @@ try:
 except ImportError:
     ML_AVAILABLE = False
 
+# Model input columns, in training order
+ML_FEATURES = ['age', 'diabetes', 'hypertension', 'heart_disease', 'kidney_disease',
+               'respiratory_disease', 'intensive_care_unit_admission', 'hemoglobin',
+               'platelets', 'urea', 'length_of_stay', 'sars_cov2_exam_result',
+               'previous_admissions', 'num_medications']
+
 class SimplifiedMLService:
     """Simplified ML service for readmission prediction"""
     
     def __init__(self):
         self.is_initialized = False
+        self.model_version = 'fallback'
         self.models = {}
         self.scalers = {}
         self.label_encoders = {}
+
+        # Smoothed seconds per model call, used to skip models that would miss a deadline
+        self.model_costs = {}
+
+        self.validator = PayloadValidator()
         
-        # Clinical risk weights
-        self.clinical_weights = {
+        # Clinical risk weights; the clinical score table is rebuilt when these or the age multipliers change
+        self._clinical_table = None
+        self.clinical_weights = ClinicalWeights({
             'age_elderly': 0.12,
             'age_senior': 0.08,
             'diabetes': 0.10,
@@ -54,16 +74,16 @@ class SimplifiedMLService:
             'frequent_admissions': 0.12,
             'high_medications': 0.08,
             'multiple_comorbidities': 0.18
-        }
+        })
         
         # Age multipliers
-        self.age_multipliers = {
+        self.age_multipliers = ClinicalWeights({
             'Young_Adult': 1.0,
             'Middle_Adult': 1.2,
             'Mature_Adult': 1.4,
             'Senior': 1.7,
             'Elderly': 2.1
-        }
+        })
     
     def initialize(self, data_path: str = None):
         """Initialize the ML service"""
@@ -74,10 +94,15 @@ class SimplifiedMLService:
                     csv_files = [f for f in os.listdir(data_path) if f.endswith('.csv')]
                     if csv_files:
                         self._load_and_train_from_csv(data_path, csv_files[0])
+                        source = os.path.splitext(csv_files[0])[0]
                     else:
                         self._create_synthetic_training_data()
+                        source = 'synthetic'
                 else:
                     self._create_synthetic_training_data()
+                    source = 'synthetic'
+                if self.models:
+                    self.model_version = f'simplified-{source}'
             
             self.is_initialized = True
             # Don't print initialization message to avoid JSON parsing issues
@@ -140,7 +165,8 @@ class SimplifiedMLService:
             
         try:
             csv_path = os.path.join(data_path, csv_file)
-            df = pd.read_csv(csv_path)
+            with profile_stage('csv_load'):
+                df = pd.read_csv(csv_path)
             
             # Basic preprocessing - map common column names
             column_mappings = {
@@ -149,7 +175,8 @@ class SimplifiedMLService:
                 'sars_cov2_exam_result': 'covid_result'
             }
             
-            df = df.rename(columns=column_mappings)
+            with profile_stage('feature_mapping'):
+                df = df.rename(columns=column_mappings)
             
             # Ensure we have a target column
             if 'readmitted' not in df.columns:
@@ -174,10 +201,7 @@ class SimplifiedMLService:
         try:
             # Select features
             feature_cols = []
-            for col in ['age', 'diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 
-                       'respiratory_disease', 'intensive_care_unit_admission', 'hemoglobin', 
-                       'platelets', 'urea', 'length_of_stay', 'sars_cov2_exam_result', 
-                       'previous_admissions', 'num_medications']:
+            for col in ML_FEATURES:
                 if col in df.columns:
                     feature_cols.append(col)
             
@@ -205,10 +229,11 @@ class SimplifiedMLService:
             
             for name, model in models.items():
                 try:
-                    if name == 'logistic_regression':
-                        model.fit(X_train_scaled, y_train)
-                    else:
-                        model.fit(X_train, y_train)
+                    with profile_stage(f'fit:{name}'):
+                        if name == 'logistic_regression':
+                            model.fit(X_train_scaled, y_train)
+                        else:
+                            model.fit(X_train, y_train)
                     self.models[name] = model
                 except Exception:
                     pass
@@ -219,43 +244,77 @@ class SimplifiedMLService:
             # Don't print errors to avoid JSON parsing issues
             pass
     
-    def predict_readmission(self, patient_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Predict readmission risk for a patient"""
+    @profiled('prediction')
+    def predict_readmission(self, patient_data: Dict[str, Any], deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Predict readmission risk for a patient
+
+        deadline is an absolute time.monotonic() value. Ensemble members that
+        would finish after it are skipped; when none can run the result is
+        the rule-based clinical score alone and is flagged as degraded.
+
+        Fields that fail validation are scored as missing and reported in
+        validation_errors.
+        """
         try:
-            # Calculate clinical score
-            clinical_score, risk_factors = self._calculate_clinical_score(patient_data)
+            validation = self.validator.validate([patient_data])
+            patient_data = validation.clean_record(0, patient_data)
+
+            # Clinical score: one lookup in the precomputed table
+            index, clinical_score, risk_factor_mask, critical = self._calculate_clinical_score(patient_data)
+            risk_factor_values = quoted_values(risk_factor_mask, patient_data)
             
             # Get ML prediction if available
             ml_probability = 0.25  # Default
-            if ML_AVAILABLE and self.models:
-                ml_probability = self._get_ml_prediction(patient_data)
+            models_used = []
+            degraded_reason = None
+            if ML_AVAILABLE and self.models and (self.is_initialized or deadline is None):
+                ml_probability, models_used = self._get_ml_prediction(patient_data, deadline, validation)
+                if ml_probability is None:
+                    degraded_reason = 'deadline' if deadline is not None else 'model_error'
+                elif len(models_used) < len(self.models):
+                    degraded_reason = 'partial_ensemble'
+            elif deadline is not None and not self.is_initialized:
+                degraded_reason = 'models_loading'
             
-            # Age-based adjustment
-            age = patient_data.get('age', 50)
-            age_group = self._get_age_group(age)
+            # Age-based adjustment (the age group is the low bits of the condition index)
+            age_group = AGE_GROUPS[index & ((1 << AGE_BITS) - 1)]
             age_multiplier = self.age_multipliers.get(age_group, 1.0)
             
-            # Combine predictions
-            base_probability = (0.6 * ml_probability) + (0.4 * clinical_score)
-            final_probability = min(base_probability * age_multiplier, 1.0)
-            
-            # Critical condition overrides
-            if self._has_critical_conditions(patient_data):
-                final_probability = max(final_probability, 0.70)
-                risk_factors.append('Critical medical conditions detected')
+            # Combine predictions; without any model output the clinical score stands alone
+            table = self._clinical_table
+            if ml_probability is None or degraded_reason == 'models_loading':
+                ml_probability = None
+                final_probability = float(table.clinical_probability[index])
+                recommendation = RECOMMENDATIONS[table.recommendation[index]]
+            else:
+                base_probability = (0.6 * ml_probability) + (0.4 * clinical_score)
+                final_probability = min(base_probability * age_multiplier, 1.0)
+                # Critical condition overrides
+                if critical:
+                    final_probability = max(final_probability, CRITICAL_FLOOR)
+                recommendation = self._get_recommendation(final_probability)
+            if critical:
+                risk_factor_mask |= BIT['critical_conditions']
             
             risk_level = self._get_risk_level(final_probability)
+            confidence_ml = 0.5 if ml_probability is None else ml_probability
             
             return {
                 'patient_id': patient_data.get('patient_id', 'unknown'),
                 'risk_level': risk_level,
                 'risk_percentage': round(min(final_probability * 100, 100.0), 1),
-                'confidence': round(self._calculate_confidence(ml_probability, clinical_score), 1),
-                'risk_factors': risk_factors,
-                'recommendation': self._get_recommendation(risk_level, final_probability),
+                'confidence': round(self._calculate_confidence(confidence_ml, clinical_score), 1),
+                'risk_factor_mask': risk_factor_mask,
+                'risk_factor_values': risk_factor_values,
+                'recommendation': recommendation,
                 'age_group': age_group,
+                'model_version': self.model_version,
+                'degraded': degraded_reason is not None,
+                'degraded_reason': degraded_reason,
+                'models_used': models_used,
+                'validation_errors': validation.errors(0),
                 'detailed_analysis': {
-                    'primary_concerns': self._get_primary_concerns(risk_factors),
+                    'primary_concerns': self._get_primary_concerns(risk_factor_mask),
                     'preventive_measures': self._get_preventive_measures(risk_level),
                     'monitoring_requirements': self._get_monitoring_requirements(risk_level)
                 }
@@ -265,175 +324,75 @@ class SimplifiedMLService:
             return {
                 'patient_id': patient_data.get('patient_id', 'unknown'),
                 'error': f"Prediction error: {str(e)}",
-                'risk_level': 'error'
+                'risk_level': 'error',
+                'model_version': self.model_version
             }
     
-    def _get_ml_prediction(self, patient_data: Dict[str, Any]) -> float:
-        """Get ML model prediction"""
+    def _get_ml_prediction(self, patient_data: Dict[str, Any], deadline: Optional[float] = None,
+                           validation=None) -> Tuple[Optional[float], List[str]]:
+        """Get ML model prediction and the names of the models that produced it"""
         if not self.models:
-            return 0.25
+            return 0.25, []
         
         try:
-            # Prepare features
-            features = []
-            feature_names = ['age', 'diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 
-                           'respiratory_disease', 'intensive_care_unit_admission', 'hemoglobin', 
-                           'platelets', 'urea', 'length_of_stay', 'sars_cov2_exam_result', 
-                           'previous_admissions', 'num_medications']
-            
-            for feature in feature_names:
-                value = patient_data.get(feature, 0)
-                try:
-                    features.append(float(value))
-                except:
-                    features.append(0.0)
-            
-            features_array = np.array(features).reshape(1, -1)
+            # Prepare features (missing and rejected fields are 0, as in training)
+            with profile_stage('feature_mapping'):
+                if validation is None:
+                    validation = self.validator.validate([patient_data])
+                features_array = validation.matrix(ML_FEATURES, 0.0, np.float64)
             
-            # Get predictions from all models
+            # Get predictions from all models that fit in the time budget
             predictions = []
-            for name, model in self.models.items():
+            models_used = []
+            for name, model in list(self.models.items()):
+                start = time.monotonic()
+                if deadline is not None and start + self.model_costs.get(name, 0.0) > deadline:
+                    # Let the estimate decay so a one-off slow call does not exclude the model for good
+                    if name in self.model_costs:
+                        self.model_costs[name] *= 0.9
+                    continue
                 try:
                     if name == 'logistic_regression' and 'standard' in self.scalers:
                         features_scaled = self.scalers['standard'].transform(features_array)
                         prob = model.predict_proba(features_scaled)[0, 1]
                     else:
                         prob = model.predict_proba(features_array)[0, 1]
-                    predictions.append(prob)
-                except:
-                    predictions.append(0.25)
+                except Exception as e:
+                    # A failed model is left out of the ensemble rather than averaged in as a guess
+                    print(f"ML prediction error ({name}): {e}", file=sys.stderr)
+                    continue
+                predictions.append(prob)
+                models_used.append(name)
+                elapsed = time.monotonic() - start
+                self.model_costs[name] = 0.8 * self.model_costs.get(name, elapsed) + 0.2 * elapsed
             
-            return np.mean(predictions) if predictions else 0.25
+            if not predictions:
+                return None, []
+            return np.mean(predictions), models_used
             
         except Exception as e:
-            print(f"ML prediction error: {e}")
-            return 0.25
-    
-    def _calculate_clinical_score(self, patient_data: Dict[str, Any]) -> tuple:
-        """Calculate clinical risk score"""
-        risk_score = 0.0
-        risk_factors = []
-        
-        # Age factors
-        age = patient_data.get('age', 50)
-        if age >= 80:
-            risk_score += self.clinical_weights['age_elderly']
-            risk_factors.append('Advanced age (80+ years) - very high risk')
-        elif age >= 65:
-            risk_score += self.clinical_weights['age_senior']
-            risk_factors.append('Senior age (65-80 years) - increased risk')
-        
-        # Chronic conditions
-        conditions = {
-            'diabetes': 'Diabetes mellitus',
-            'hypertension': 'Hypertension',
-            'heart_disease': 'Heart disease',
-            'kidney_disease': 'Kidney disease',
-            'respiratory_disease': 'Respiratory disease'
-        }
-        
-        active_conditions = []
-        for condition, label in conditions.items():
-            if patient_data.get(condition, 0) == 1:
-                risk_score += self.clinical_weights.get(condition, 0.08)
-                active_conditions.append(label)
-        
-        if len(active_conditions) >= 3:
-            risk_score += self.clinical_weights['multiple_comorbidities']
-            risk_factors.append(f'Multiple comorbidities: {", ".join(active_conditions)}')
-        elif active_conditions:
-            risk_factors.extend(active_conditions)
-        
-        # ICU admission
-        if patient_data.get('intensive_care_unit_admission', 0) == 1:
-            risk_score += self.clinical_weights['icu_admission']
-            risk_factors.append('ICU admission - critical condition')
-        
-        # Lab values
-        hb = patient_data.get('hemoglobin', 13.0)
-        if hb < 12 and hb > 0:
-            risk_score += self.clinical_weights['low_hemoglobin']
-            risk_factors.append(f'Low hemoglobin (anemia): {hb}')
-        
-        platelets = patient_data.get('platelets', 250.0)
-        if platelets < 150 and platelets > 0:
-            risk_score += self.clinical_weights['low_platelets']
-            risk_factors.append(f'Low platelets (thrombocytopenia): {platelets}')
-        
-        urea = patient_data.get('urea', 5.0)
-        if urea > 7.5:
-            risk_score += self.clinical_weights['high_urea']
-            risk_factors.append(f'Elevated urea (kidney dysfunction): {urea}')
-        
-        # COVID-19
-        if patient_data.get('sars_cov2_exam_result', 0) == 1:
-            risk_score += self.clinical_weights['covid_positive']
-            risk_factors.append('COVID-19 positive')
-        
-        # Length of stay
-        los = patient_data.get('length_of_stay', 5)
-        if los > 10:
-            risk_score += self.clinical_weights['long_stay']
-            risk_factors.append(f'Extended hospitalization ({los} days)')
-        
-        # Previous admissions
-        prev_admissions = patient_data.get('previous_admissions', 0)
-        if prev_admissions >= 2:
-            risk_score += self.clinical_weights['frequent_admissions']
-            risk_factors.append(f'Frequent admissions ({prev_admissions} in past year)')
-        
-        # High medication count
-        medications = patient_data.get('num_medications', 5)
-        if medications >= 10:
-            risk_score += self.clinical_weights['high_medications']
-            risk_factors.append(f'Polypharmacy ({medications} medications)')
-        
-        return min(risk_score, 1.0), risk_factors
-    
-    def _get_age_group(self, age: float) -> str:
-        """Get age group from age"""
-        if age < 35:
-            return 'Young_Adult'
-        elif age < 50:
-            return 'Middle_Adult'
-        elif age < 65:
-            return 'Mature_Adult'
-        elif age < 80:
-            return 'Senior'
-        else:
-            return 'Elderly'
+            # stdout carries responses in serve mode; without a model output the clinical score stands alone
+            print(f"ML prediction error: {e}", file=sys.stderr)
+            return None, []
     
-    def _has_critical_conditions(self, patient_data: Dict[str, Any]) -> bool:
-        """Check for critical conditions"""
-        critical_indicators = [
-            patient_data.get('intensive_care_unit_admission', 0) == 1,
-            patient_data.get('hemoglobin', 13) < 8,
-            patient_data.get('platelets', 250) < 50,
-            patient_data.get('urea', 5) > 20,
-            patient_data.get('length_of_stay', 5) > 20
-        ]
-        return any(critical_indicators)
+    def clinical_table(self) -> ClinicalScoreTable:
+        """Clinical score table for the current weights, rebuilt after they change"""
+        table = self._clinical_table
+        if table is None or not table.matches(self.clinical_weights, self.age_multipliers):
+            table = self._clinical_table = ClinicalScoreTable(self.clinical_weights, self.age_multipliers)
+        return table
+
+    def _calculate_clinical_score(self, patient_data: Dict[str, Any]) -> Tuple[int, float, int, bool]:
+        """Condition index, clinical risk score, risk factor bitmask and critical-override flag"""
+        return self.clinical_table().lookup(patient_data)
     
     def _get_risk_level(self, probability: float) -> str:
         """Get risk level from probability"""
-        if probability >= 0.55:
-            return 'high'
-        elif probability >= 0.25:
-            return 'medium'
-        else:
-            return 'low'
+        return risk_level(probability)
     
-    def _get_recommendation(self, risk_level: str, probability: float) -> str:
+    def _get_recommendation(self, probability: float) -> str:
         """Get clinical recommendations"""
-        if risk_level == 'high':
-            if probability >= 0.75:
-                return "URGENT: Comprehensive discharge planning, intensive case management, transitional care team, 24h post-discharge contact, consider delaying discharge"
-            else:
-                return "HIGH RISK: Comprehensive discharge planning, case management, transitional care, 24-48h post-discharge contact"
-        elif risk_level == 'medium':
-            return "MODERATE RISK: Enhanced discharge planning, medication reconciliation, patient education, 3-7 day follow-up"
-        else:
-            return "LOW RISK: Standard discharge planning, routine follow-up in 1-2 weeks, patient education materials"
+        return RECOMMENDATIONS[recommendation_id(probability)]
     
     def _calculate_confidence(self, ml_probability: float, clinical_score: float) -> float:
         """Calculate prediction confidence"""
@@ -442,18 +401,9 @@ class SimplifiedMLService:
         clinical_bonus = min(clinical_score * 0.15, 0.15)
         return min(base_conf + ml_bonus + clinical_bonus, 1.0) * 100
 
-    def _get_primary_concerns(self, risk_factors: list) -> list:
-        """Get primary medical concerns from risk factors"""
-        primary_concerns = []
-        if any('age' in factor.lower() for factor in risk_factors):
-            primary_concerns.append('Age-related increased vulnerability')
-        if any('icu' in factor.lower() or 'critical' in factor.lower() for factor in risk_factors):
-            primary_concerns.append('Critical care requirements')
-        if any('comorbid' in factor.lower() or 'multiple' in factor.lower() for factor in risk_factors):
-            primary_concerns.append('Complex medical conditions')
-        if any('covid' in factor.lower() for factor in risk_factors):
-            primary_concerns.append('COVID-19 complications')
-        return primary_concerns or ['General medical monitoring required']
+    def _get_primary_concerns(self, risk_factor_mask: int) -> list:
+        """Get primary medical concerns from the risk factor bits"""
+        return primary_concerns(risk_factor_mask)
 
     def _get_preventive_measures(self, risk_level: str) -> list:
         """Get preventive measures based on risk level"""
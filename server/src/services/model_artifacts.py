@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact Model Artifacts for RelayLoop
+Stores the fitted models of EnhancedMedicalPredictor as flat, quantized node
+arrays that load quickly and evaluate with numpy alone
+"""
+
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+import numpy as np
+from typing import Dict, Any, List
+
+ARTIFACT_FORMAT = 'relayloop-compact'
+ARTIFACT_VERSION = 1
+
+# Forest leaf probabilities are stored as uint16 fractions of this scale
+PROBABILITY_SCALE = 65535
+
+# Rows evaluated per block so the (rows x trees) node matrix stays small
+_PREDICT_BLOCK_ROWS = 4096
+
+
+def _float32_floor(values: np.ndarray) -> np.ndarray:
+    """Round thresholds down to the nearest float32.
+
+    sklearn casts inputs to float32 before walking a tree, and for any float32
+    x the test ``x <= t`` equals ``x <= floor32(t)``, so routing stays exact.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    rounded = values.astype(np.float32)
+    too_high = rounded.astype(np.float64) > values
+    rounded[too_high] = np.nextafter(rounded[too_high], np.float32(-np.inf))
+    return rounded
+
+
+def _index_dtype(count: int):
+    """Smallest unsigned integer dtype able to index ``count`` items"""
+    if count <= np.iinfo(np.uint8).max:
+        return np.uint8
+    if count <= np.iinfo(np.uint16).max:
+        return np.uint16
+    return np.uint32
+
+
+class CompactTreeEnsemble:
+    """Tree ensemble flattened into node arrays with self-looping leaves"""
+
+    def __init__(self, kind: str, feature: np.ndarray, threshold: np.ndarray,
+                 left: np.ndarray, right: np.ndarray, value: np.ndarray,
+                 roots: np.ndarray, depth: int, init_raw: float = 0.0,
+                 divergence_bound: float = 0.0):
+        self.kind = kind  # 'forest' averages probabilities, 'boosting' sums log-odds
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.depth = int(depth)
+        self.init_raw = float(init_raw)
+        self.divergence_bound = float(divergence_bound)
+        self.classes_ = np.array([0, 1])
+        # Interleaved (right, left) children so one gather picks the next node
+        self._children = np.stack([right, left], axis=1).ravel().astype(np.intp)
+        self._feature = feature.astype(np.intp)
+
+    @classmethod
+    def from_sklearn(cls, model) -> 'CompactTreeEnsemble':
+        """Flatten a fitted RandomForest, ExtraTrees or GradientBoosting classifier"""
+        estimators = model.estimators_
+        is_boosting = isinstance(estimators, np.ndarray)
+        trees = [est.tree_ for est in (estimators[:, 0] if is_boosting else estimators)]
+
+        n_nodes = sum(tree.node_count for tree in trees)
+        feature = np.zeros(n_nodes, dtype=_index_dtype(model.n_features_in_ - 1))
+        threshold = np.zeros(n_nodes, dtype=np.float32)
+        left = np.zeros(n_nodes, dtype=np.int32)
+        right = np.zeros(n_nodes, dtype=np.int32)
+        value = np.zeros(n_nodes, dtype=np.float32 if is_boosting else np.uint16)
+        roots = np.zeros(len(trees), dtype=np.int32)
+
+        divergence = 0.0
+        offset = 0
+        for i, tree in enumerate(trees):
+            count = tree.node_count
+            nodes = np.arange(offset, offset + count, dtype=np.int32)
+            is_leaf = tree.children_left == -1
+
+            roots[i] = offset
+            feature[nodes[~is_leaf]] = tree.feature[~is_leaf]
+            threshold[nodes] = _float32_floor(np.where(is_leaf, 0.0, tree.threshold))
+            left[nodes] = np.where(is_leaf, nodes, tree.children_left + offset)
+            right[nodes] = np.where(is_leaf, nodes, tree.children_right + offset)
+
+            if is_boosting:
+                exact = tree.value[:, 0, 0] * model.learning_rate
+                stored = exact.astype(np.float32)
+                # Raw scores add up across trees, so do the rounding errors
+                divergence += float(np.max(np.abs(stored[is_leaf] - exact[is_leaf])))
+            else:
+                counts = tree.value[:, 0, :]
+                exact = counts[:, 1] / np.maximum(counts.sum(axis=1), np.finfo(np.float64).tiny)
+                stored = np.rint(exact * PROBABILITY_SCALE).astype(np.uint16)
+                error = np.abs(stored[is_leaf] / PROBABILITY_SCALE - exact[is_leaf])
+                divergence = max(divergence, float(np.max(error)))
+            value[nodes] = np.where(is_leaf, stored, 0)
+            offset += count
+
+        init_raw = 0.0
+        if is_boosting:
+            init_raw = float(model._raw_predict_init(np.zeros((1, model.n_features_in_)))[0, 0])
+            # The logistic link has a maximum slope of 1/4
+            divergence /= 4.0
+
+        return cls('boosting' if is_boosting else 'forest', feature, threshold, left, right,
+                   value, roots, max(tree.max_depth for tree in trees), init_raw, divergence)
+
+    def _leaf_values(self, X: np.ndarray) -> np.ndarray:
+        """Walk every tree for every row and return the (rows x trees) leaf values"""
+        X_flat = np.ascontiguousarray(X).ravel()
+        row_offset = (np.arange(len(X), dtype=np.intp) * X.shape[1])[:, None]
+        node = np.repeat(self.roots.astype(np.intp)[None, :], len(X), axis=0)
+        for _ in range(self.depth):
+            go_left = np.take(X_flat, row_offset + np.take(self._feature, node)) <= np.take(self.threshold, node)
+            node = np.take(self._children, node * 2 + go_left)
+        return np.take(self.value, node)
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        positive = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), _PREDICT_BLOCK_ROWS):
+            leaves = self._leaf_values(X[start:start + _PREDICT_BLOCK_ROWS]).astype(np.float64)
+            if self.kind == 'forest':
+                block = leaves.mean(axis=1) / PROBABILITY_SCALE
+            else:
+                block = 1.0 / (1.0 + np.exp(-(self.init_raw + leaves.sum(axis=1))))
+            positive[start:start + len(block)] = block
+
+        return np.column_stack([1.0 - positive, positive])
+
+    def predict(self, X) -> np.ndarray:
+        return (self.predict_proba(X)[:, 1] >= 0.5).astype(int)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(arr.nbytes for arr in (self.feature, self.threshold, self.left,
+                                          self.right, self.value, self.roots))
+
+    def to_arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        return {
+            f'{prefix}.feature': self.feature, f'{prefix}.threshold': self.threshold,
+            f'{prefix}.left': self.left, f'{prefix}.right': self.right,
+            f'{prefix}.value': self.value, f'{prefix}.roots': self.roots
+        }
+
+    def metadata(self) -> Dict[str, Any]:
+        return {'type': self.kind, 'depth': self.depth, 'init_raw': self.init_raw,
+                'n_trees': int(len(self.roots)), 'divergence_bound': self.divergence_bound}
+
+    @classmethod
+    def from_arrays(cls, prefix: str, arrays, meta: Dict[str, Any]) -> 'CompactTreeEnsemble':
+        return cls(meta['type'], arrays[f'{prefix}.feature'], arrays[f'{prefix}.threshold'],
+                   arrays[f'{prefix}.left'], arrays[f'{prefix}.right'], arrays[f'{prefix}.value'],
+                   arrays[f'{prefix}.roots'], meta['depth'], meta['init_raw'], meta['divergence_bound'])
+
+
+class CompactLogisticRegression:
+    """Binary logistic regression kept at full precision (it is only a few weights)"""
+
+    def __init__(self, coef: np.ndarray, intercept: float):
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+        self.divergence_bound = 0.0
+        self.classes_ = np.array([0, 1])
+
+    @classmethod
+    def from_sklearn(cls, model) -> 'CompactLogisticRegression':
+        return cls(model.coef_[0], model.intercept_[0])
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        positive = 1.0 / (1.0 + np.exp(-(X @ self.coef + self.intercept)))
+        return np.column_stack([1.0 - positive, positive])
+
+    def predict(self, X) -> np.ndarray:
+        return (self.predict_proba(X)[:, 1] >= 0.5).astype(int)
+
+    @property
+    def nbytes(self) -> int:
+        return self.coef.nbytes
+
+    def to_arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        return {f'{prefix}.coef': self.coef}
+
+    def metadata(self) -> Dict[str, Any]:
+        return {'type': 'logistic', 'intercept': self.intercept, 'divergence_bound': 0.0}
+
+    @classmethod
+    def from_arrays(cls, prefix: str, arrays, meta: Dict[str, Any]) -> 'CompactLogisticRegression':
+        return cls(arrays[f'{prefix}.coef'], meta['intercept'])
+
+
+class CompactScaler:
+    """StandardScaler replacement exposing only transform()"""
+
+    def __init__(self, mean: np.ndarray, scale: np.ndarray):
+        self.mean_ = np.asarray(mean, dtype=np.float64)
+        self.scale_ = np.asarray(scale, dtype=np.float64)
+
+    def transform(self, X) -> np.ndarray:
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+
+class CompactLabelEncoder:
+    """LabelEncoder replacement backed by a dict lookup"""
+
+    def __init__(self, classes: List[str]):
+        self.classes_ = np.array(classes, dtype=object)
+        self._codes = {label: code for code, label in enumerate(classes)}
+
+    def transform(self, values) -> np.ndarray:
+        try:
+            return np.array([self._codes[value] for value in values], dtype=np.int64)
+        except KeyError as e:
+            raise ValueError(f'y contains previously unseen labels: {e}')
+
+    def inverse_transform(self, codes) -> np.ndarray:
+        return self.classes_[np.asarray(codes, dtype=np.int64)]
+
+
+_MODEL_TYPES = {
+    'forest': CompactTreeEnsemble,
+    'boosting': CompactTreeEnsemble,
+    'logistic': CompactLogisticRegression
+}
+
+
+def compact_model(model):
+    """Convert one fitted sklearn model to its compact equivalent"""
+    if hasattr(model, 'estimators_'):
+        return CompactTreeEnsemble.from_sklearn(model)
+    if hasattr(model, 'coef_'):
+        return CompactLogisticRegression.from_sklearn(model)
+    raise ValueError(f'Unsupported model type: {type(model).__name__}')
+
+
+def export_compact_artifact(predictor, path: str, compressed: bool = False) -> Dict[str, Any]:
+    """Write the trained models, scaler and encoders of a predictor to a .npz artifact"""
+    if not predictor.is_trained:
+        raise ValueError("System must be trained before exporting models!")
+
+    arrays = {}
+    models_meta = {}
+    for name, model in predictor.models.items():
+        compact = model if hasattr(model, 'to_arrays') else compact_model(model)
+        arrays.update(compact.to_arrays(f'model.{name}'))
+        models_meta[name] = compact.metadata()
+
+    scaler = predictor.scalers.get('standard')
+    if scaler is not None:
+        # Scalers fitted on sparse input are not centered
+        mean = scaler.mean_ if getattr(scaler, 'with_mean', True) else np.zeros_like(scaler.scale_)
+        arrays['scaler.mean'] = np.asarray(mean, dtype=np.float64)
+        arrays['scaler.scale'] = np.asarray(scaler.scale_, dtype=np.float64)
+
+    metadata = {
+        'format': ARTIFACT_FORMAT,
+        'version': ARTIFACT_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'model_version': getattr(predictor, 'model_version', None),
+        'feature_columns': list(predictor.feature_columns),
+        'label_encoders': {col: [str(c) for c in enc.classes_] for col, enc in predictor.label_encoders.items()},
+        'feature_spec': predictor.get_feature_spec().to_dict(),
+        'sparse_panel': predictor.sparse_panel.to_dict() if getattr(predictor, 'sparse_panel', None) else None,
+        'categorical_encoder': (predictor.categorical_encoder.to_dict()
+                                if getattr(predictor, 'categorical_encoder', None) else None),
+        'models': models_meta
+    }
+    arrays['__metadata__'] = np.frombuffer(json.dumps(metadata).encode('utf-8'), dtype=np.uint8)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'wb') as f:
+        (np.savez_compressed if compressed else np.savez)(f, **arrays)
+    return metadata
+
+
+def load_compact_artifact(path: str) -> Dict[str, Any]:
+    """Load a compact artifact without unpickling anything"""
+    with np.load(path, allow_pickle=False) as npz:
+        arrays = {key: npz[key] for key in npz.files}
+
+    metadata = json.loads(arrays.pop('__metadata__').tobytes().decode('utf-8'))
+    if metadata.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f'{path} is not a {ARTIFACT_FORMAT} artifact')
+    if metadata.get('version', 0) > ARTIFACT_VERSION:
+        raise ValueError(f"Unsupported artifact version {metadata['version']}")
+
+    models = {}
+    for name, meta in metadata['models'].items():
+        models[name] = _MODEL_TYPES[meta['type']].from_arrays(f'model.{name}', arrays, meta)
+
+    scalers = {}
+    if 'scaler.mean' in arrays:
+        scalers['standard'] = CompactScaler(arrays['scaler.mean'], arrays['scaler.scale'])
+
+    # Artifacts written before the feature spec existed rebuild it from the encoders
+    from feature_spec import FeatureSpec
+    label_encoders = {col: CompactLabelEncoder(classes) for col, classes in metadata['label_encoders'].items()}
+    if 'feature_spec' in metadata:
+        feature_spec = FeatureSpec.from_dict(metadata['feature_spec'])
+    else:
+        feature_spec = FeatureSpec.from_label_encoders(label_encoders, metadata['feature_columns'])
+
+    return {
+        'metadata': metadata,
+        'models': models,
+        'scalers': scalers,
+        'label_encoders': label_encoders,
+        'feature_columns': metadata['feature_columns'],
+        'feature_spec': feature_spec
+    }
+
+
+def load_compact_predictor(path: str):
+    """Build a ready-to-serve EnhancedMedicalPredictor from a compact artifact"""
+    from enhanced_predictor import EnhancedMedicalPredictor
+
+    artifact = load_compact_artifact(path)
+    predictor = EnhancedMedicalPredictor()
+    predictor.models = artifact['models']
+    predictor.scalers = artifact['scalers']
+    predictor.label_encoders = artifact['label_encoders']
+    predictor.feature_columns = artifact['feature_columns']
+    predictor.feature_spec = artifact['feature_spec']
+    if artifact['metadata'].get('sparse_panel'):
+        from sparse_panels import SparsePanel
+        predictor.sparse_panel = SparsePanel.from_dict(artifact['metadata']['sparse_panel'])
+    if artifact['metadata'].get('categorical_encoder'):
+        from categorical_encoding import SparseCategoricalEncoder
+        predictor.categorical_encoder = SparseCategoricalEncoder.from_dict(artifact['metadata']['categorical_encoder'])
+    predictor.model_version = (artifact['metadata'].get('model_version') or
+                               os.path.splitext(os.path.basename(path))[0])
+    predictor.is_trained = True
+    return predictor
+
+
+def compare_with_original(predictor, artifact: Dict[str, Any], X) -> Dict[str, Any]:
+    """Measure how far compact predictions drift from the original models on X"""
+    X = np.asarray(X, dtype=np.float64)
+    X_scaled = predictor.scalers['standard'].transform(X)
+    compact_scaled = artifact['scalers']['standard'].transform(X)
+
+    report = {'rows': int(len(X)), 'models': {}}
+    original_mean = np.zeros(len(X))
+    compact_mean = np.zeros(len(X))
+    for name, model in predictor.models.items():
+        compact = artifact['models'][name]
+        if name == 'logistic_regression':
+            original = model.predict_proba(X_scaled)[:, 1]
+            approx = compact.predict_proba(compact_scaled)[:, 1]
+        else:
+            original = model.predict_proba(X)[:, 1]
+            approx = compact.predict_proba(X)[:, 1]
+        original_mean += original / len(predictor.models)
+        compact_mean += approx / len(predictor.models)
+
+        max_diff = float(np.max(np.abs(original - approx))) if len(X) else 0.0
+        report['models'][name] = {
+            'max_abs_diff': max_diff,
+            'bound': compact.divergence_bound,
+            'within_bound': max_diff <= compact.divergence_bound + 1e-9
+        }
+
+    # The ensemble averages the models, so its bound is the mean of theirs
+    bound = float(np.mean([m['bound'] for m in report['models'].values()]))
+    max_diff = float(np.max(np.abs(original_mean - compact_mean))) if len(X) else 0.0
+    report['ensemble'] = {'max_abs_diff': max_diff, 'bound': bound,
+                          'within_bound': max_diff <= bound + 1e-9}
+    return report
+
+
+def artifact_size_report(predictor, path: str) -> Dict[str, Any]:
+    """Compare the pickled size and load time of the original models with the artifact"""
+    payload = {'models': predictor.models, 'scalers': predictor.scalers,
+               'label_encoders': predictor.label_encoders}
+    pickled = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+
+    start = time.perf_counter()
+    pickle.loads(pickled)
+    pickle_load_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    load_compact_artifact(path)
+    compact_load_ms = (time.perf_counter() - start) * 1000
+
+    compact_bytes = os.path.getsize(path)
+    return {
+        'pickle_bytes': len(pickled),
+        'compact_bytes': compact_bytes,
+        'size_reduction': round(len(pickled) / max(compact_bytes, 1), 2),
+        'pickle_load_ms': round(pickle_load_ms, 2),
+        'compact_load_ms': round(compact_load_ms, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the enhanced models and export a compact artifact')
+    parser.add_argument('--output', required=True, help='Path of the .npz artifact to write')
+    parser.add_argument('--data-path', default=None, help='Directory containing the training CSV files')
+    parser.add_argument('--compressed', action='store_true', help='Deflate the arrays (smaller, slower to load)')
+    parser.add_argument('--sparse-panel', action='store_true',
+                        help='Also train on the COVID viral panel, kept sparse with measured flags')
+    parser.add_argument('--categoricals', choices=['onehot', 'hash'], default=None,
+                        help='Also train on diagnosis/specialty categoricals, one-hot or hashed into a sparse block')
+    args = parser.parse_args()
+
+    from enhanced_predictor import MLPredictionService
+
+    panel = None
+    if args.sparse_panel:
+        from sparse_panels import SparsePanel, COVID_VIRAL_PANEL
+        panel = SparsePanel(COVID_VIRAL_PANEL, 'covid_viral')
+
+    encoder = None
+    if args.categoricals:
+        from categorical_encoding import SparseCategoricalEncoder
+        encoder = SparseCategoricalEncoder(mode=args.categoricals)
+
+    service = MLPredictionService()
+    service.initialize(args.data_path, sparse_panel=panel, categorical_encoder=encoder)
+    predictor = service.predictor
+
+    export_compact_artifact(predictor, args.output, compressed=args.compressed)
+    X, _ = predictor._prepare_enhanced_features(predictor.historical_data)
+    if hasattr(X, 'toarray'):
+        X = X.toarray()
+
+    report = artifact_size_report(predictor, args.output)
+    report['divergence'] = compare_with_original(predictor, load_compact_artifact(args.output), X)
+    print(json.dumps(report, indent=2))
+
+    if not report['divergence']['ensemble']['within_bound']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Model Pool for RelayLoop
+Hosts many model variants (per department or hospital) in one resident
+process. Variants live in an artifact store laid out as
+
+    STORE/<variant>/<version>.npz
+
+and are selected by key: "cardiology" is the newest version of that variant
+when it is first loaded, "cardiology@2024-06" pins a version. Keys resolve to
+"variant@version" before lookup, so both spellings share one loaded copy and
+one set of counters. A variant is loaded and warmed in the background on
+first use; a request with a deadline that it would miss gets the degraded
+clinical score meanwhile. Loaded variants are kept in LRU order and the least
+recently used are evicted once their resident size (the predictor's
+memory_usage) exceeds the memory ceiling. Requests pin a ModelHandle as they
+do with the registry, so an evicted variant finishes its in-flight requests
+before it is freed.
+
+Publish a variant version and list the store:
+    python model_pool.py STORE --publish artifact.npz --variant cardiology [--version V]
+    python model_pool.py STORE
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from model_registry import ModelHandle, ModelRegistry, WARM_UP_PATIENT, _load_artifact, publish
+
+DEFAULT_MEMORY_MB = 512
+
+VARIANT_NAME = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]*$')
+
+
+def _log(message: str):
+    # stdout carries responses in serve mode; one write so concurrent loads do not interleave
+    sys.stderr.write(f'[model-pool] {message}\n')
+    sys.stderr.flush()
+
+
+def parse_key(key: str) -> Tuple[str, Optional[str]]:
+    """(variant, version or None) of a "variant" or "variant@version" key"""
+    variant, _, version = str(key).partition('@')
+    if not VARIANT_NAME.match(variant) or (version and not VARIANT_NAME.match(version)):
+        raise ValueError(f'Invalid model variant key: {key!r}')
+    return variant, version or None
+
+
+class _VariantStats:
+    """Counters of one variant key, kept across evictions"""
+
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.evictions = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'hits': self.hits,
+            'hit_rate': round(self.hits / self.requests, 4) if self.requests else 0.0,
+            'loads': self.loads,
+            'load_seconds': round(self.load_seconds, 4),
+            'evictions': self.evictions,
+            'errors': self.errors,
+            'mean_ms': round(self.total_ms / self.requests, 3) if self.requests else 0.0,
+            'max_ms': round(self.max_ms, 3)
+        }
+
+
+class ModelPool:
+    """Lazily loaded model variants with LRU eviction under a memory ceiling"""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MEMORY_MB << 20, loader=None,
+                 warm_up: Optional[Dict[str, Any]] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.loader = loader or _load_artifact
+        self.warm_up = WARM_UP_PATIENT if warm_up is None else warm_up
+        self.resident_bytes = 0
+        self._resident = OrderedDict()
+        self._sizes = {}
+        self._loading = {}
+        self._aliases = {}
+        self._clinical = None  # untrained predictor for clinical-only results while a variant loads
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _registry(self, variant: str) -> ModelRegistry:
+        return ModelRegistry(os.path.join(self.directory, variant), loader=self.loader, warm_up={})
+
+    def variants(self) -> Dict[str, List[str]]:
+        """Versions available per variant, oldest first"""
+        if not os.path.isdir(self.directory):
+            return {}
+        return {entry.name: [v['version'] for v in self._registry(entry.name).versions()]
+                for entry in sorted(os.scandir(self.directory), key=lambda e: e.name)
+                if entry.is_dir() and VARIANT_NAME.match(entry.name)}
+
+    def _entry(self, variant: str, version: Optional[str]) -> Dict[str, Any]:
+        registry = self._registry(variant)
+        if version is None:
+            entry = registry.latest()
+        else:
+            entry = next((e for e in registry.versions() if e['version'] == version), None)
+        if entry is None:
+            raise ValueError(f"Unknown model variant: {variant}{'@' + version if version else ''}")
+        return entry
+
+    def resolve(self, key: str) -> str:
+        """Canonical "variant@version" of a key; an unpinned variant keeps the version it was loaded at"""
+        variant, version = parse_key(key)
+        if version is not None:
+            return f'{variant}@{version}'
+        with self._lock:
+            resolved = self._aliases.get(variant)
+        if resolved is None:
+            resolved = f"{variant}@{self._entry(variant, None)['version']}"
+            with self._lock:
+                resolved = self._aliases.setdefault(variant, resolved)
+        return resolved
+
+    def acquire(self, key: str, timeout: Optional[float] = None) -> Optional[ModelHandle]:
+        """Pin a variant for one request; pair with release()
+
+        A variant that is not resident is loaded in the background. The
+        request waits for it up to timeout seconds (None: until loaded) and
+        gets None if it is still loading then.
+        """
+        key = self.resolve(key)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        while True:
+            with self._lock:
+                handle = self._resident.get(key)
+                if handle is not None:
+                    self._resident.move_to_end(key)
+                    handle.in_flight += 1
+                    if not waited:
+                        self._stats[key].hits += 1
+                    return handle
+                loading = self._loading.get(key)
+            if loading is None:
+                # Unknown versions fail here, in the request, rather than in the background load
+                entry = self._entry(*parse_key(key))
+                with self._lock:
+                    loading = self._loading.get(key)
+                    if loading is None and key not in self._resident:
+                        loading = self._loading[key] = threading.Event()
+                        loading.error = None
+                        threading.Thread(target=self._load, args=(key, entry, loading), daemon=True,
+                                         name=f'model-pool-load-{key}').start()
+                if loading is None:
+                    continue
+            waited = True
+            if not loading.wait(None if deadline is None else max(deadline - time.monotonic(), 0)):
+                return None
+            if loading.error is not None:
+                raise loading.error
+
+    def _load(self, key: str, entry: Dict[str, Any], loading: threading.Event):
+        """Load and warm one variant version in the background, then make it resident"""
+        try:
+            self._load_entry(key, entry)
+        except Exception as e:
+            loading.error = e
+            _log(f'failed to load {key}: {e}')
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            loading.set()
+
+    def _load_entry(self, key: str, entry: Dict[str, Any]):
+        start = time.perf_counter()
+        # Counters start once the key names a real version, so bad keys leave no entries
+        with self._lock:
+            stats = self._stats.setdefault(key, _VariantStats())
+        try:
+            handle = ModelHandle(entry['version'], self.loader(entry['path']), entry['path'])
+            if self.warm_up:
+                warm = handle.predict(dict(self.warm_up))
+                if 'error' in warm:
+                    raise ValueError(warm['error'])
+            size = handle.predictor.memory_usage()['total']
+        except Exception:
+            with self._lock:
+                stats.errors += 1
+            raise
+        seconds = time.perf_counter() - start
+
+        with self._lock:
+            stats.loads += 1
+            stats.load_seconds += seconds
+            self._resident[key] = handle
+            self._sizes[key] = size
+            self.resident_bytes += size
+            self._evict(keep=key)
+        _log(f"loaded {key} ({size / 1e6:.1f} MB) in {seconds:.2f}s")
+
+    def _evict(self, keep: str):
+        """Drop least recently used variants until under the ceiling (caller holds the lock)"""
+        for key in list(self._resident):
+            if self.resident_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            handle = self._resident.pop(key)
+            self.resident_bytes -= self._sizes.pop(key)
+            self._stats[key].evictions += 1
+            # An unpinned variant picks up the newest version again on its next load
+            for variant in [v for v, resolved in self._aliases.items() if resolved == key]:
+                del self._aliases[variant]
+            # Requests still holding the handle keep the predictor alive until they release it
+            handle.retired = True
+            _log(f'evicted {key} ({handle.version}, {handle.in_flight} in flight)')
+
+    def release(self, handle: Optional[ModelHandle]):
+        if handle is None:
+            return
+        with self._lock:
+            handle.in_flight -= 1
+
+    def loading_result(self, patient_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Clinical score alone, flagged as degraded, for a request whose variant is still loading"""
+        with self._lock:
+            if self._clinical is None:
+                from enhanced_predictor import EnhancedMedicalPredictor
+                self._clinical = EnhancedMedicalPredictor()
+        return self._clinical.clinical_only_risk(patient_data, 'models_loading')
+
+    def predict(self, key: str, patient_data: Dict[str, Any], deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Score with a variant, recording its request count and latency
+
+        deadline is an absolute time.monotonic() value; a variant still loading
+        then gets the degraded clinical result.
+        """
+        start = time.perf_counter()
+        key = self.resolve(key)
+        handle = self.acquire(key, None if deadline is None else max(deadline - time.monotonic(), 0))
+        try:
+            if handle is None:
+                return self.loading_result(patient_data)
+            return handle.predict(patient_data, deadline)
+        finally:
+            self.release(handle)
+            self.record(key, time.perf_counter() - start)
+
+    def record(self, key: str, seconds: float):
+        """Count one request of a variant and its latency, including any load
+
+        key is the resolved key the request was acquired under, so the
+        request is counted even if an unpinned alias has been evicted since.
+        """
+        ms = seconds * 1000.0
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                # Unknown version, rejected before it was counted
+                return
+            stats.requests += 1
+            stats.total_ms += ms
+            stats.max_ms = max(stats.max_ms, ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'resident': [{'key': key, 'version': handle.version, 'bytes': self._sizes[key],
+                              'in_flight': handle.in_flight} for key, handle in self._resident.items()],
+                'resident_bytes': self.resident_bytes,
+                'max_bytes': self.max_bytes,
+                'variants': {key: stats.to_dict() for key, stats in sorted(self._stats.items())}
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the model variant store served by the model pool')
+    parser.add_argument('store', help='Artifact store directory (one subdirectory per variant)')
+    parser.add_argument('--publish', default=None, help='Compact artifact (.npz) to add as a new version')
+    parser.add_argument('--variant', default=None, help='Variant name for --publish')
+    parser.add_argument('--version', default=None, help='Version name for --publish (default: UTC timestamp)')
+    args = parser.parse_args()
+
+    if args.publish:
+        if args.variant is None:
+            parser.error('--publish requires --variant')
+        variant, _ = parse_key(args.variant)
+        print(publish(args.publish, os.path.join(args.store, variant), args.version))
+    else:
+        print(json.dumps(ModelPool(args.store).variants(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Model Registry for RelayLoop
+Watches a directory of versioned compact artifacts (<version>.npz, written by
+model_artifacts.py) and hot-swaps the model served by a long-lived process.
+
+New artifacts are loaded and warmed on a background thread, then swapped in
+with a single reference assignment. Requests hold a ModelHandle for their
+whole duration, so in-flight requests finish on the version they started
+with; a retired version is released once its last request completes.
+
+Publish a new version (copied in atomically, so the watcher never sees a
+partial file):
+    python model_registry.py REGISTRY_DIR --publish artifact.npz [--version V]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+ARTIFACT_SUFFIX = '.npz'
+
+# Scored once before a new version goes live
+WARM_UP_PATIENT = {
+    'patient_id': 'warm-up', 'age': 67, 'gender': 'F', 'diabetes': 1, 'hypertension': 1,
+    'hemoglobin': 11.2, 'platelets': 180, 'urea': 8.1, 'length_of_stay': 6, 'num_medications': 9
+}
+
+
+def _log(message: str):
+    # stdout carries responses in serve mode
+    print(f'[model-registry] {message}', file=sys.stderr, flush=True)
+
+
+class ModelHandle:
+    """One loaded model version plus the number of requests using it"""
+
+    def __init__(self, version: str, predictor, path: Optional[str] = None):
+        self.version = version
+        self.predictor = predictor
+        predictor.model_version = version
+        self.path = path
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.retired = False
+
+    def predict(self, patient_data: Dict[str, Any], deadline: Optional[float] = None) -> Dict[str, Any]:
+        """Score with this version; deadline is an absolute time.monotonic() value"""
+        return self.predictor.predict_patient_risk(patient_data, deadline)
+
+
+class ModelRegistry:
+    """Directory-backed set of model versions with atomic hot swap"""
+
+    def __init__(self, directory: str, loader=None, poll_interval: float = 5.0,
+                 warm_up: Optional[Dict[str, Any]] = None):
+        self.directory = directory
+        self.loader = loader or _load_artifact
+        self.poll_interval = poll_interval
+        self.warm_up = WARM_UP_PATIENT if warm_up is None else warm_up
+        self.current = None
+        self.failed = {}
+        self._retired = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def versions(self) -> List[Dict[str, Any]]:
+        """Artifacts in the registry, oldest first by modification time"""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(ARTIFACT_SUFFIX):
+                stat = entry.stat()
+                entries.append({'version': entry.name[:-len(ARTIFACT_SUFFIX)], 'path': entry.path,
+                                'mtime': stat.st_mtime, 'size': stat.st_size})
+        return sorted(entries, key=lambda e: (e['mtime'], e['version']))
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """Newest artifact that has not already failed to load"""
+        for entry in reversed(self.versions()):
+            if self.failed.get(entry['version']) != entry['mtime']:
+                return entry
+        return None
+
+    def acquire(self) -> Optional[ModelHandle]:
+        """Pin the current version for one request; pair with release()"""
+        with self._lock:
+            handle = self.current
+            if handle is not None:
+                handle.in_flight += 1
+            return handle
+
+    def release(self, handle: Optional[ModelHandle]):
+        if handle is None:
+            return
+        with self._lock:
+            handle.in_flight -= 1
+            self._collect()
+
+    def predict(self, patient_data: Dict[str, Any], deadline: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Score with the current version, or return None when nothing is loaded"""
+        handle = self.acquire()
+        if handle is None:
+            return None
+        try:
+            return handle.predict(patient_data, deadline)
+        finally:
+            self.release(handle)
+
+    def load(self, entry: Dict[str, Any]) -> bool:
+        """Load and warm one version, then swap it in; the old version keeps serving on failure"""
+        try:
+            start = time.perf_counter()
+            handle = ModelHandle(entry['version'], self.loader(entry['path']), entry['path'])
+            if self.warm_up:
+                warm = handle.predict(dict(self.warm_up))
+                if 'error' in warm:
+                    raise ValueError(warm['error'])
+        except Exception as e:
+            self.failed[entry['version']] = entry['mtime']
+            _log(f"failed to load {entry['version']}: {e}")
+            return False
+
+        self.swap(handle)
+        _log(f"serving {handle.version} (loaded in {time.perf_counter() - start:.2f}s)")
+        return True
+
+    def swap(self, handle: ModelHandle):
+        with self._lock:
+            previous, self.current = self.current, handle
+            if previous is not None:
+                previous.retired = True
+                self._retired.append(previous)
+            self._collect()
+
+    def _collect(self):
+        """Drop retired versions with no requests left (caller holds the lock)"""
+        for handle in [h for h in self._retired if h.in_flight == 0]:
+            self._retired.remove(handle)
+            handle.predictor = None
+            _log(f'released {handle.version}')
+
+    def refresh(self) -> bool:
+        """Swap to the newest artifact if it differs from the one being served"""
+        entry = self.latest()
+        current = self.current
+        if entry is None or (current is not None and current.path == entry['path']
+                             and current.loaded_at >= entry['mtime']):
+            return False
+        return self.load(entry)
+
+    def start(self, block: bool = True):
+        """Load the newest version (synchronously unless block=False) and start watching"""
+        if block:
+            self.refresh()
+        self._thread = threading.Thread(target=self._watch, name='model-registry', daemon=True)
+        self._thread.start()
+        return self
+
+    def _watch(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                _log(f'watch error: {e}')
+            self._stop.wait(self.poll_interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'current': self.current.version if self.current else None,
+                'retired_in_flight': {h.version: h.in_flight for h in self._retired},
+                'available': [e['version'] for e in self.versions()]
+            }
+
+
+def _load_artifact(path: str):
+    from model_artifacts import load_compact_predictor
+    return load_compact_predictor(path)
+
+
+def publish(artifact: str, directory: str, version: Optional[str] = None) -> str:
+    """Copy an artifact into the registry under a version name, atomically"""
+    if version is None:
+        version = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, version + ARTIFACT_SUFFIX)
+    if os.path.exists(target):
+        raise ValueError(f'Version {version} already exists in {directory}')
+    tmp_path = target + '.tmp'
+    shutil.copyfile(artifact, tmp_path)
+    os.replace(tmp_path, target)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the model registry watched by the resident runner')
+    parser.add_argument('registry', help='Registry directory')
+    parser.add_argument('--publish', default=None, help='Compact artifact (.npz) to add as a new version')
+    parser.add_argument('--version', default=None, help='Version name for --publish (default: UTC timestamp)')
+    args = parser.parse_args()
+
+    if args.publish:
+        print(publish(args.publish, args.registry, args.version))
+    else:
+        print(json.dumps(ModelRegistry(args.registry).versions(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Payload Validation for RelayLoop
+Coerces and range-checks patient payloads a whole batch at a time instead of
+wrapping every field in try/float/except.
+
+A batch of records becomes one (rows x fields) float64 matrix in a single
+numpy conversion; only batches holding unparseable values take the
+column-wise pandas path. Per field the schema gives a kind and physiological
+limits (in the units the API uses):
+
+  missing       absent, None, NaN or empty: the consumer's default applies
+  not_numeric   unparseable text or a non-scalar: treated as missing, reported
+  not_finite    +/-inf: treated as missing, reported
+  not_binary    a flag other than 0/1 (yes/no/true/false are accepted): treated as missing, reported
+  out_of_range  outside the limits (a zero or a value in the wrong units): treated as missing, reported
+
+Errors are returned per row as structured dicts, so callers can surface them
+with the prediction instead of scoring silently corrected values. Rejected
+values are never replaced by a made-up measurement; the consumer's default
+applies, as for a missing field.
+
+    python payload_validation.py '{"hemoglobin": "abc", "platelets": 9000}'
+"""
+
+import json
+import re
+import sys
+from itertools import chain
+from typing import Dict, Any, List, Optional, Union
+
+import numpy as np
+
+# Field -> (kind, lower limit, upper limit)
+PAYLOAD_SCHEMA = {
+    'age': ('numeric', 0.0, 120.0),
+    'diabetes': ('binary', 0.0, 1.0),
+    'hypertension': ('binary', 0.0, 1.0),
+    'heart_disease': ('binary', 0.0, 1.0),
+    'kidney_disease': ('binary', 0.0, 1.0),
+    'respiratory_disease': ('binary', 0.0, 1.0),
+    'regular_ward_admission': ('binary', 0.0, 1.0),
+    'semi_intensive_unit_admission': ('binary', 0.0, 1.0),
+    'intensive_care_unit_admission': ('binary', 0.0, 1.0),
+    'sars_cov2_exam_result': ('binary', 0.0, 1.0),
+    'hemoglobin': ('numeric', 2.0, 25.0),         # g/dL
+    'hematocrit': ('numeric', 5.0, 75.0),         # %
+    'platelets': ('numeric', 1.0, 2000.0),        # 10^3/uL
+    'red_blood_cells': ('numeric', 0.5, 10.0),    # 10^6/uL
+    'lymphocytes': ('numeric', 0.0, 100.0),       # 10^3/uL
+    'urea': ('numeric', 0.5, 150.0),              # mmol/L
+    'potassium': ('numeric', 1.0, 12.0),          # mmol/L
+    'sodium': ('numeric', 90.0, 200.0),           # mmol/L
+    'length_of_stay': ('numeric', 0.0, 365.0),    # days
+    'num_medications': ('numeric', 0.0, 100.0),
+    'previous_admissions': ('numeric', 0.0, 100.0)
+}
+
+BINARY_WORDS = {'yes': 1.0, 'no': 0.0, 'true': 1.0, 'false': 0.0, 'positive': 1.0, 'negative': 0.0}
+
+# Error codes in the order of the code matrix
+ERROR_CODES = ['', 'not_numeric', 'not_finite', 'not_binary', 'out_of_range']
+NOT_NUMERIC, NOT_FINITE, NOT_BINARY, OUT_OF_RANGE = 1, 2, 3, 4
+
+
+def _json_safe(value):
+    """Raw payload value as it can be echoed in a JSON error"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return str(value)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+
+# Plain decimal or scientific notation; anything else in a string is rejected
+_NUMBER = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+
+# Value types float() converts without parsing text
+_NUMERIC_TYPES = {int, float, bool, np.float64, np.float32, np.int64, np.int32, np.int16, np.int8,
+                  np.uint8, np.bool_}
+
+# Parsed text values kept before the memo is reset
+TEXT_MEMO_LIMIT = 10000
+
+OK, MISSING, REJECTED = 0, 1, 2
+
+
+def _parse_text(text: str, binary: bool):
+    """(value, status) of a text field value, without raising"""
+    text = text.strip()
+    if not text:
+        return np.nan, MISSING
+    if binary:
+        word = BINARY_WORDS.get(text.lower())
+        if word is not None:
+            return word, OK
+    if _NUMBER.fullmatch(text):
+        return float(text), OK
+    word = text.lower().lstrip('+-')
+    if word in ('inf', 'infinity'):
+        # Reported as not_finite by the range check, as numeric infinities are
+        return float(text), OK
+    if word == 'nan':
+        return np.nan, MISSING
+    return np.nan, REJECTED
+
+
+_text_memo = {}
+
+
+def _parse_value(value, binary: bool):
+    """(value, status) of one payload value, without raising"""
+    kind = type(value)
+    if value is None:
+        return np.nan, MISSING
+    if kind in _NUMERIC_TYPES:
+        return (np.nan, MISSING) if value != value else (float(value), OK)
+    if kind is str:
+        key = (value, binary)
+        parsed = _text_memo.get(key)
+        if parsed is None:
+            if len(_text_memo) >= TEXT_MEMO_LIMIT:
+                _text_memo.clear()
+            parsed = _text_memo[key] = _parse_text(value, binary)
+        return parsed
+    # Lists, dicts and other non-scalars
+    return np.nan, REJECTED
+
+
+def coerce_rows(rows: List[tuple], n_columns: int, binary: Optional[np.ndarray] = None):
+    """(n, n_columns) float64 values plus missing and rejected masks of tuple rows (both NaN in values)
+
+    Rows holding only numbers convert in one numpy call; only rows with text,
+    None or non-scalar values are parsed value by value.
+    """
+    n = len(rows)
+    numeric = _NUMERIC_TYPES
+    is_clean = [set(map(type, row)) <= numeric for row in rows]
+    values = np.empty((n, n_columns), dtype=np.float64)
+    rejected = np.zeros((n, n_columns), dtype=bool)
+    clean = [i for i, ok in enumerate(is_clean) if ok]
+    if clean:
+        values[clean] = np.fromiter(chain.from_iterable(rows[i] for i in clean), np.float64,
+                                    len(clean) * n_columns).reshape(len(clean), n_columns)
+    flags = [bool(b) for b in binary] if binary is not None else [False] * n_columns
+    dirty = [i for i, ok in enumerate(is_clean) if not ok]
+    parsed_rows = []
+    for i in dirty:
+        row = list(rows[i])
+        for j, value in enumerate(row):
+            if type(value) not in numeric:
+                row[j], status = _parse_value(value, flags[j])
+                if status == REJECTED:
+                    rejected[i, j] = True
+        parsed_rows.append(row)
+    if dirty:
+        values[dirty] = np.fromiter(chain.from_iterable(parsed_rows), np.float64,
+                                    len(dirty) * n_columns).reshape(len(dirty), n_columns)
+    return values, np.isnan(values) & ~rejected, rejected
+
+
+class ValidationResult:
+    """Coerced values, missing indicators and error codes of a validated batch"""
+
+    def __init__(self, fields: List[str], values: np.ndarray, missing: np.ndarray, codes: np.ndarray,
+                 rows: List[tuple], limits: np.ndarray):
+        self.fields = fields
+        self.values = values    # (n, fields) float64; NaN where missing or rejected
+        self.missing = missing  # (n, fields) bool; the payload gave no value
+        self.codes = codes      # (n, fields) int8 index into ERROR_CODES
+        self._rows = rows
+        self._limits = limits
+        self._index = {field: j for j, field in enumerate(fields)}
+        self._has_errors = None
+
+    @property
+    def valid(self) -> np.ndarray:
+        """Rows without any error"""
+        return ~self.codes.any(axis=1)
+
+    def _row_has_errors(self, row: int) -> bool:
+        if self._has_errors is None:
+            self._has_errors = self.codes.any(axis=1)
+        return bool(self._has_errors[row])
+
+    def errors(self, row: int) -> List[Dict[str, Any]]:
+        """Structured errors of one row"""
+        if not self._row_has_errors(row):
+            return []
+        errors = []
+        for j in np.flatnonzero(self.codes[row]):
+            code = int(self.codes[row, j])
+            error = {'field': self.fields[j], 'code': ERROR_CODES[code], 'value': _json_safe(self._rows[row][j])}
+            if code == OUT_OF_RANGE:
+                error.update(min=float(self._limits[0, j]), max=float(self._limits[1, j]))
+            errors.append(error)
+        return errors
+
+    def all_errors(self) -> List[List[Dict[str, Any]]]:
+        return [self.errors(i) for i in range(len(self.codes))]
+
+    def missing_fields(self, row: int) -> List[str]:
+        return [self.fields[j] for j in np.flatnonzero(self.missing[row])]
+
+    def matrix(self, fields: List[str], defaults: Union[float, Dict[str, float]] = 0.0,
+               dtype=np.float32) -> np.ndarray:
+        """(n, len(fields)) model input; missing and rejected values take their default"""
+        selected = self.values[:, [self._index[field] for field in fields]]
+        if isinstance(defaults, dict):
+            defaults = np.array([defaults.get(field, 0.0) for field in fields], dtype=np.float64)
+        return np.where(np.isnan(selected), defaults, selected).astype(dtype, copy=False)
+
+    def clean_record(self, row: int, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy of a payload with schema fields coerced; missing and rejected fields are left out"""
+        clean = dict(record)
+        has_errors = self._row_has_errors(row)
+        codes = self.codes[row].tolist() if has_errors else None
+        for field, value, raw, j in zip(self.fields, self.values[row].tolist(), self._rows[row], range(len(self.fields))):
+            if value != value:
+                clean.pop(field, None)
+            elif type(raw) in (int, float) and not (has_errors and codes[j]):
+                continue
+            else:
+                clean[field] = int(value) if value.is_integer() and type(raw) is not float else value
+        return clean
+
+
+class PayloadValidator:
+    """Schema-driven batch coercion of patient payloads"""
+
+    def __init__(self, schema: Optional[Dict[str, tuple]] = None, fields: Optional[List[str]] = None):
+        schema = schema or PAYLOAD_SCHEMA
+        self.fields = list(fields or schema)
+        self.schema = {field: schema[field] for field in self.fields}
+        self._binary = np.array([self.schema[f][0] == 'binary' for f in self.fields])
+        self._limits = np.array([[self.schema[f][1] for f in self.fields],
+                                 [self.schema[f][2] for f in self.fields]], dtype=np.float64)
+        self._absent = [np.nan] * len(self.fields)
+
+    def validate(self, records: List[Dict[str, Any]]) -> ValidationResult:
+        fields = self.fields
+        rows = [tuple(map(record.get, fields, self._absent)) for record in records]
+        shape = (len(rows), len(fields))
+        try:
+            # Absent fields are NaN; numbers, numeric strings and bools convert in one flat pass
+            values = np.fromiter(chain.from_iterable(rows), np.float64, shape[0] * shape[1]).reshape(shape)
+            rejected = None
+        except (TypeError, ValueError):
+            # One exception per batch, then only the rows holding text are parsed value by value
+            values, missing, rejected = coerce_rows(rows, len(fields), self._binary)
+        if rejected is None:
+            missing = np.isnan(values)
+
+        lower, upper = self._limits
+        with np.errstate(invalid='ignore'):
+            flagged = (values < lower) | (values > upper) | (self._binary & (values != 0) & (values != 1) & (values == values))
+        codes = np.zeros(shape, dtype=np.int8)
+        if rejected is not None and rejected.any():
+            codes[rejected] = NOT_NUMERIC
+        if flagged.any():
+            with np.errstate(invalid='ignore'):
+                codes[flagged & np.isinf(values)] = NOT_FINITE
+                codes[flagged & (codes == 0) & self._binary] = NOT_BINARY
+            codes[flagged & (codes == 0)] = OUT_OF_RANGE
+            values = np.where(flagged, np.nan, values)
+        return ValidationResult(fields, values, missing, codes, rows, self._limits)
+
+
+def main():
+    records = json.loads(sys.argv[1]) if len(sys.argv) > 1 else json.load(sys.stdin)
+    records = records if isinstance(records, list) else [records]
+    result = PayloadValidator().validate(records)
+    print(json.dumps([{'errors': result.errors(i), 'missing': result.missing_fields(i),
+                       'clean': result.clean_record(i, record)} for i, record in enumerate(records)], indent=2))
+
+
+if __name__ == "__main__":
+    main()
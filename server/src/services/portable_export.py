@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Portable Model Export for RelayLoop
+Writes the fitted models, scaler, encoders and feature spec of an
+EnhancedMedicalPredictor to one self-describing JSON document that any
+language can evaluate, so the NestJS server can score the trained ensemble
+in-process instead of spawning Python.
+
+Document layout (format 'relayloop-portable', version 1):
+  input      payload schema: per field a kind and limits; bad and out-of-range
+             values fall back to the feature default
+  age_group  label and range tables that turn the raw age into the age group
+  numeric_inputs
+             every numeric input field the columns read, with its default
+  columns    one descriptor per model input column, in order: numeric,
+             derived (a small declarative op) or categorical (code table)
+  scaler     mean and scale for the models that take scaled input, and whether
+             the scaling rounds to float32 (as sklearn does for float32 input)
+  models     flat node arrays per tree model (feature, threshold, left, right,
+             value and roots; leaves have feature -1) or logistic weights
+  ensemble   how model probabilities combine, and the golden-set tolerance
+
+Feature values and tree thresholds are float32: evaluators round each input
+to float32 before comparing, and go left when value <= threshold.
+
+A golden set (inputs plus the predictor's own outputs) is written alongside
+and checked with the pure-Python reference evaluator below; the TypeScript
+evaluator (server/src/modules/patient/portable-model.ts) checks the same file
+when it loads the model.
+
+    python portable_export.py --output model.json [--artifact model.npz] [--golden 200]
+    python portable_export.py --verify model.json
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import struct
+import sys
+import time
+from typing import Dict, Any, List
+
+import numpy as np
+
+from feature_spec import NUMERIC_FEATURES, DERIVED_FEATURES, CATEGORICAL_FEATURES
+from payload_validation import BINARY_WORDS
+
+PORTABLE_FORMAT = 'relayloop-portable'
+GOLDEN_FORMAT = 'relayloop-portable-golden'
+PORTABLE_VERSION = 1
+
+# DERIVED_FEATURES as data; checked against the Python definitions on export
+PORTABLE_DERIVED = {
+    'comorbidity_count': {'op': 'sum', 'fields': ['diabetes', 'hypertension', 'heart_disease',
+                                                  'kidney_disease', 'respiratory_disease']},
+    'low_hemoglobin': {'op': 'below', 'field': 'hemoglobin', 'value': 12},
+    'abnormal_hematocrit': {'op': 'outside', 'field': 'hematocrit', 'low': 35, 'high': 50},
+    'low_platelets': {'op': 'below', 'field': 'platelets', 'value': 150},
+    'abnormal_rbc': {'op': 'outside', 'field': 'red_blood_cells', 'low': 4.0, 'high': 6.0},
+    'low_lymphocytes': {'op': 'below', 'field': 'lymphocytes', 'value': 1.0},
+    'high_urea': {'op': 'above', 'field': 'urea', 'value': 7.5},
+    'electrolyte_imbalance': {'op': 'any', 'terms': [
+        {'op': 'outside', 'field': 'potassium', 'low': 3.5, 'high': 5.0},
+        {'op': 'outside', 'field': 'sodium', 'low': 136, 'high': 145}
+    ]},
+    'critical_care': {'op': 'copy', 'field': 'intensive_care_unit_admission'}
+}
+
+# Golden tolerance of a logistic model that scores in float32: evaluators sum in float64, and the
+# float32 dot product and probability differ from that by a few float32 ulps
+FLOAT32_LOGISTIC_BOUND = 1e-6
+
+# Inputs fixed by the serving path (_prepare_patient_features)
+SERVING_CONTEXT = {'dataset_source': 'dataset1'}
+
+# Payloads beyond the synthetic ones: missing fields, text, out-of-range and bad values
+EDGE_CASES = [
+    {},
+    {'age': 82, 'gender': 'M', 'diabetes': 1, 'hypertension': 1, 'heart_disease': 1, 'kidney_disease': 1},
+    {'age': '[70-80)', 'hemoglobin': '7.9', 'platelets': 'abc', 'urea': 31, 'diabetes': 'yes'},
+    {'age': 'Q5_81+', 'intensive_care_unit_admission': 1, 'length_of_stay': 25, 'potassium': 6.1},
+    {'age': 35.5, 'gender': 'Unknown', 'hemoglobin': 40, 'sodium': 60, 'lymphocytes': -3},
+    {'age': None, 'hypertension': 2, 'red_blood_cells': 'Infinity', 'num_medications': '12'},
+    {'age': 90, 'gender': 'F', 'hemoglobin': None, 'platelets': '', 'sars_cov2_exam_result': 'positive'},
+    {'patient_age_quantile': 'Q2_36-50', 'previous_admissions': 3, 'hematocrit': 52.5, 'urea': '7.5'},
+    {'age': 18, 'regular_ward_admission': 0, 'semi_intensive_unit_admission': 1, 'hematocrit': 'NaN'},
+    {'age': 67, 'diabetes': True, 'hypertension': False, 'platelets': 149.99, 'red_blood_cells': 6.0}
+]
+
+
+def _float32_values(values) -> List[float]:
+    """float32 values as their shortest decimal text (exact once rounded back to float32)"""
+    return [float(text) for text in np.asarray(values, dtype=np.float32).astype(str)]
+
+
+def _check_derived(columns: List[str]):
+    """Fail unless every derived column has a portable form that agrees with the Python one"""
+    rng = np.random.default_rng(0)
+    sample = {field: rng.choice(np.array([0, 1, 0.5, 1.0, 3.5, 4.0, 5.0, 6.0, 7.5, 12, 35, 50, 136, 145, 150,
+                                          -1, 200], dtype=np.float32), 4096)
+              for field in NUMERIC_FEATURES}
+    for column in columns:
+        if column not in DERIVED_FEATURES:
+            continue
+        if column not in PORTABLE_DERIVED:
+            raise ValueError(f'Derived feature {column} has no portable definition')
+        expected = np.asarray(DERIVED_FEATURES[column](sample), dtype=np.float32)
+        actual = np.array([_derive(PORTABLE_DERIVED[column], {f: float(v[i]) for f, v in sample.items()})
+                           for i in range(4096)], dtype=np.float32)
+        if not np.array_equal(expected, actual):
+            raise ValueError(f'Portable definition of {column} disagrees with DERIVED_FEATURES')
+
+
+def _portable_columns(spec) -> List[Dict[str, Any]]:
+    columns = []
+    for column in spec.columns:
+        if column in NUMERIC_FEATURES or column in spec.passthrough:
+            columns.append({'name': column, 'kind': 'numeric', 'field': column})
+        elif column in DERIVED_FEATURES:
+            columns.append(dict(PORTABLE_DERIVED[column], name=column, kind='derived'))
+        else:
+            field = CATEGORICAL_FEATURES[column]
+            columns.append({'name': column, 'kind': 'categorical', 'field': field,
+                            'codes': spec.categories.get(field, {}),
+                            'default': str(spec.defaults.get(field, 'Unknown'))})
+    return columns
+
+
+def _portable_model(model) -> Dict[str, Any]:
+    from model_artifacts import compact_model, PROBABILITY_SCALE
+
+    compact = model if hasattr(model, 'to_arrays') else compact_model(model)
+    meta = compact.metadata()
+    if meta['type'] == 'logistic':
+        # A model fitted on float32 input scores in float32 (the dot product and the probability)
+        float32 = getattr(getattr(model, 'coef_', None), 'dtype', None) == np.float32
+        return {'type': 'logistic', 'input': 'scaled', 'coef': compact.coef.tolist(),
+                'intercept': compact.intercept, 'divergence_bound': FLOAT32_LOGISTIC_BOUND if float32 else 0.0}
+
+    nodes = np.arange(len(compact.left))
+    leaf = compact.left == nodes
+    portable = {
+        'type': meta['type'],
+        'input': 'features',
+        'roots': compact.roots.tolist(),
+        'feature': np.where(leaf, -1, compact.feature.astype(np.int64)).tolist(),
+        'threshold': _float32_values(np.where(leaf, 0.0, compact.threshold)),
+        'left': np.where(leaf, -1, compact.left).tolist(),
+        'right': np.where(leaf, -1, compact.right).tolist(),
+        'divergence_bound': compact.divergence_bound
+    }
+    if meta['type'] == 'forest':
+        # Leaf probability is value / value_scale; the ensemble probability is the mean over trees
+        portable.update(value=np.where(leaf, compact.value, 0).astype(np.int64).tolist(),
+                        value_scale=PROBABILITY_SCALE)
+    else:
+        # Probability is sigmoid(init_raw + sum of float32 leaf values)
+        portable.update(value=_float32_values(np.where(leaf, compact.value, 0.0)), init_raw=compact.init_raw)
+    return portable
+
+
+def build_portable(predictor) -> Dict[str, Any]:
+    """Language-neutral document of a trained EnhancedMedicalPredictor"""
+    if not predictor.is_trained:
+        raise ValueError("System must be trained before exporting models!")
+    if getattr(predictor, 'sparse_panel', None) is not None or getattr(predictor, 'categorical_encoder', None) is not None:
+        raise ValueError('Sparse panel and categorical blocks are not supported by the portable format')
+
+    spec = predictor.get_feature_spec()
+    _check_derived(spec.columns)
+    merger = predictor.age_merger
+
+    document = {
+        'format': PORTABLE_FORMAT,
+        'version': PORTABLE_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'model_version': getattr(predictor, 'model_version', None),
+        'input': {
+            'schema': {field: list(limits) for field, limits in predictor.validator.schema.items()},
+            'binary_words': BINARY_WORDS
+        },
+        'age_group': {
+            'field': 'age', 'fallback_field': 'patient_age_quantile', 'default_age': 50,
+            'labels': merger.age_mapping, 'ranges': {group: list(r) for group, r in merger.age_ranges.items()},
+            'unknown': 'Unknown'
+        },
+        'context': SERVING_CONTEXT,
+        # Every numeric input a column reads (derived ones included) and its default
+        'numeric_inputs': {field: float(default) for field, default in spec.extractor._numeric_defaults.items()},
+        'columns': _portable_columns(spec),
+        'models': {name: _portable_model(model) for name, model in predictor.models.items()}
+    }
+
+    scaler = predictor.scalers.get('standard')
+    if scaler is not None:
+        mean = scaler.mean_ if getattr(scaler, 'with_mean', True) else np.zeros_like(scaler.scale_)
+        # sklearn's StandardScaler keeps float32 features in float32 (mean and scale rounded to float32,
+        # each operation rounded); the compact scaler works in float64
+        probe = np.asarray(scaler.transform(np.zeros((1, len(scaler.scale_)), dtype=np.float32)))
+        precision = 'float32' if probe.dtype == np.float32 else 'float64'
+        document['scaler'] = {'mean': np.asarray(mean, dtype=np.float64).tolist(),
+                              'scale': np.asarray(scaler.scale_, dtype=np.float64).tolist(),
+                              'precision': precision}
+
+    bounds = [model['divergence_bound'] for model in document['models'].values()]
+    document['ensemble'] = {'combine': 'mean', 'default_probability': 0.25,
+                            'tolerance': (float(np.mean(bounds)) if bounds else 0.0) + 1e-9}
+    return document
+
+
+def _predictor_outputs(predictor, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Model probabilities exactly as predict_patient_risk computes them"""
+    validation = predictor.validator.validate([record])
+    clean = validation.clean_record(0, record)
+    features = predictor._prepare_patient_features(clean)
+    outputs = {}
+    for name, model in predictor.models.items():
+        X = predictor.scalers['standard'].transform(features) if name == 'logistic_regression' else features
+        outputs[name] = float(model.predict_proba(X)[:, 1][0])
+    probability = float(np.mean(list(outputs.values()))) if outputs else 0.25
+    return {'ml_probability': probability, 'models': outputs}
+
+
+def build_golden_set(predictor, document: Dict[str, Any], n_synthetic: int = 200, seed: int = 7) -> Dict[str, Any]:
+    """Inputs and the predictor's outputs for them, for checking any evaluator of the document"""
+    from synthetic_patients import generate_chunk
+
+    records = []
+    if n_synthetic:
+        frame = generate_chunk(0, n_synthetic, seed).drop(columns=['readmitted_30_days'])
+        records = json.loads(frame.to_json(orient='records'))
+    records += [dict(case) for case in EDGE_CASES]
+
+    # Trend features come from the serving process's own history, not the payload
+    trend_store, predictor.trend_store = predictor.trend_store, None
+    try:
+        cases = [dict(input=record, **_predictor_outputs(predictor, record)) for record in records]
+    finally:
+        predictor.trend_store = trend_store
+
+    return {
+        'format': GOLDEN_FORMAT,
+        'version': PORTABLE_VERSION,
+        'model_version': document.get('model_version'),
+        'tolerance': document['ensemble']['tolerance'],
+        'model_tolerance': {name: model['divergence_bound'] + 1e-9 for name, model in document['models'].items()},
+        'cases': cases
+    }
+
+
+def golden_path(path: str) -> str:
+    """Golden set written next to a portable model: model.json -> model.golden.json"""
+    root, ext = os.path.splitext(path)
+    return f'{root}.golden{ext or ".json"}'
+
+
+def export_portable(predictor, path: str, n_golden: int = 200) -> Dict[str, Any]:
+    """Write the portable document and its golden set; returns the golden check report"""
+    document = build_portable(predictor)
+    golden = build_golden_set(predictor, document, n_golden)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(document, f, separators=(',', ':'))
+    with open(golden_path(path), 'w') as f:
+        json.dump(golden, f, indent=1)
+    return verify_golden(PortableModel(document), golden)
+
+
+# Reference evaluator: plain Python, no numpy, mirrors the TypeScript evaluator line by line
+
+_NUMBER = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+
+
+def _f32(value: float) -> float:
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+
+def _sigmoid(x: float) -> float:
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+def _derive(column: Dict[str, Any], values: Dict[str, float]) -> float:
+    op = column['op']
+    if op == 'sum':
+        total = 0.0
+        for field in column['fields']:
+            total = _f32(total + values[field])
+        return total
+    if op == 'copy':
+        return values[column['field']]
+    if op == 'below':
+        return float(values[column['field']] < column['value'])
+    if op == 'above':
+        return float(values[column['field']] > column['value'])
+    if op == 'outside':
+        value = values[column['field']]
+        return float(value < column['low'] or value > column['high'])
+    if op == 'any':
+        return float(any(_derive(term, values) for term in column['terms']))
+    raise ValueError(f'Unknown derived op: {op}')
+
+
+class PortableModel:
+    """Evaluates a portable document"""
+
+    def __init__(self, document: Dict[str, Any]):
+        if document.get('format') != PORTABLE_FORMAT:
+            raise ValueError(f'Not a {PORTABLE_FORMAT} document')
+        if document.get('version', 0) > PORTABLE_VERSION:
+            raise ValueError(f"Unsupported portable version {document['version']}")
+        self.document = document
+        self.schema = document['input']['schema']
+        self.binary_words = document['input']['binary_words']
+        self.columns = document['columns']
+        self.models = document['models']
+        self.scaler = document.get('scaler')
+        self.model_version = document.get('model_version')
+
+    @classmethod
+    def load(cls, path: str) -> 'PortableModel':
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def _input_value(self, field: str, raw):
+        """Validated number for a field, or None when the feature default applies"""
+        limits = self.schema.get(field)
+        binary = limits is not None and limits[0] == 'binary'
+        if raw is None:
+            return None
+        if isinstance(raw, bool):
+            value = float(raw)
+        elif isinstance(raw, (int, float)):
+            value = float(raw)
+        elif isinstance(raw, str):
+            text = raw.strip()
+            if binary and text.lower() in self.binary_words:
+                value = float(self.binary_words[text.lower()])
+            elif _NUMBER.fullmatch(text):
+                value = float(text)
+            else:
+                return None
+        else:
+            return None
+        if value != value or math.isinf(value):
+            return None
+        if limits is None:
+            return value
+        if binary:
+            return value if value in (0.0, 1.0) else None
+        return value if limits[1] <= value <= limits[2] else None
+
+    def _age_group(self, record: Dict[str, Any]) -> str:
+        spec = self.document['age_group']
+        age = record.get(spec['field'], record.get(spec['fallback_field'], spec['default_age']))
+        if isinstance(age, str):
+            return spec['labels'].get(age.strip(), spec['unknown'])
+        if isinstance(age, (int, float)) and age == age:
+            for group, (low, high) in spec['ranges'].items():
+                if low <= age <= high:
+                    return group
+        return spec['unknown']
+
+    @staticmethod
+    def _category_text(value) -> str:
+        # Category codes are keyed by Python's str() of the value
+        return str(value)
+
+    def features(self, record: Dict[str, Any]) -> List[float]:
+        """Model input row (float32 values) of one payload"""
+        context = dict(self.document.get('context', {}), age_group=self._age_group(record))
+        numeric = {}
+        for field, default in self.document['numeric_inputs'].items():
+            value = self._input_value(field, record.get(field))
+            numeric[field] = _f32(default if value is None else value)
+
+        row = []
+        for column in self.columns:
+            kind = column['kind']
+            if kind == 'numeric':
+                row.append(numeric[column['field']])
+            elif kind == 'derived':
+                row.append(_f32(_derive(column, numeric)))
+            else:
+                field = column['field']
+                value = context[field] if field in context else record.get(field, column['default'])
+                row.append(float(column['codes'].get(self._category_text(value), 0)))
+        return row
+
+    def _tree_output(self, model: Dict[str, Any], row: List[float]) -> float:
+        feature, threshold, left, right, value = (model['feature'], model['threshold'], model['left'],
+                                                  model['right'], model['value'])
+        boosting = model['type'] == 'boosting'
+        total = 0.0
+        for root in model['roots']:
+            node = root
+            while feature[node] >= 0:
+                node = left[node] if row[feature[node]] <= _f32(threshold[node]) else right[node]
+            # Boosting leaf values are float32; forest values are integer counts of value_scale
+            total += _f32(value[node]) if boosting else value[node]
+        if model['type'] == 'forest':
+            return total / len(model['roots']) / model['value_scale']
+        return _sigmoid(model['init_raw'] + total)
+
+    def predict(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        row = self.features(record)
+        outputs = {}
+        for name, model in self.models.items():
+            if model['type'] == 'logistic':
+                mean, scale = self.scaler['mean'], self.scaler['scale']
+                rounded = self.scaler.get('precision') == 'float32'
+                z = model['intercept']
+                for x, m, s, c in zip(row, mean, scale, model['coef']):
+                    z += (_f32(_f32(x - _f32(m)) / _f32(s)) if rounded else (x - m) / s) * c
+                outputs[name] = _sigmoid(z)
+            else:
+                outputs[name] = self._tree_output(model, row)
+        values = list(outputs.values())
+        probability = sum(values) / len(values) if values else self.document['ensemble']['default_probability']
+        return {'ml_probability': probability, 'models': outputs}
+
+
+def verify_golden(model: PortableModel, golden: Dict[str, Any]) -> Dict[str, Any]:
+    """Compare an evaluator against a golden set"""
+    max_diff, failures = 0.0, []
+    for i, case in enumerate(golden['cases']):
+        actual = model.predict(case['input'])
+        diff = abs(actual['ml_probability'] - case['ml_probability'])
+        max_diff = max(max_diff, diff)
+        model_diffs = {name: abs(actual['models'].get(name, float('nan')) - expected)
+                       for name, expected in case['models'].items()}
+        bad = [name for name, d in model_diffs.items() if not d <= golden['model_tolerance'][name]]
+        if not diff <= golden['tolerance'] or bad:
+            failures.append({'case': i, 'diff': diff, 'models': bad})
+    return {'cases': len(golden['cases']), 'max_abs_diff': max_diff, 'tolerance': golden['tolerance'],
+            'passed': not failures, 'failures': failures[:10]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the enhanced models to the portable JSON format')
+    parser.add_argument('--output', help='Portable model JSON to write (golden set goes next to it)')
+    parser.add_argument('--artifact', default=None, help='Export this compact .npz artifact instead of training')
+    parser.add_argument('--data-path', default=None, help='Directory containing the training CSV files')
+    parser.add_argument('--golden', type=int, default=200, help='Synthetic golden cases (edge cases are always added)')
+    parser.add_argument('--verify', default=None, help='Check a portable model against its golden set')
+    args = parser.parse_args()
+
+    if args.verify:
+        with open(golden_path(args.verify)) as f:
+            report = verify_golden(PortableModel.load(args.verify), json.load(f))
+    elif args.output:
+        if args.artifact:
+            from model_artifacts import load_compact_predictor
+            predictor = load_compact_predictor(args.artifact)
+        else:
+            from enhanced_predictor import MLPredictionService
+            service = MLPredictionService()
+            service.initialize(args.data_path)
+            predictor = service.predictor
+        start = time.perf_counter()
+        report = export_portable(predictor, args.output, args.golden)
+        report['export_seconds'] = round(time.perf_counter() - start, 2)
+        report['bytes'] = os.path.getsize(args.output)
+    else:
+        parser.error('one of --output or --verify is required')
+    print(json.dumps(report, indent=2))
+    if not report['passed']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
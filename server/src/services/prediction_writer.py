@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bulk Prediction Writer for RelayLoop
+Buffers prediction results and persists them to the ml_predictions table
+(server/database/ml_predictions.sql) in large transactions.
+
+Sinks:
+  PostgresCopySink  COPY ... FROM STDIN through psycopg2 (optional dependency)
+  CopyFileSink      COPY text format files for psql \\copy
+  SQLiteSink        local stand-in with the same columns, indexes and trigger
+"""
+
+import argparse
+import io
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Dict, Any, List, Optional, Iterable
+
+from payload_validation import PayloadValidator
+from risk_factors import render_risk_factors, values_from_features
+
+try:
+    import psycopg2
+    POSTGRES_AVAILABLE = True
+except ImportError:
+    POSTGRES_AVAILABLE = False
+
+FEATURE_COLUMNS = [
+    'diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 'respiratory_disease',
+    'regular_ward_admission', 'semi_intensive_unit_admission', 'intensive_care_unit_admission',
+    'hemoglobin', 'hematocrit', 'platelets', 'red_blood_cells', 'lymphocytes', 'urea', 'potassium', 'sodium',
+    'sars_cov2_exam_result', 'length_of_stay', 'num_medications', 'previous_admissions'
+]
+
+# Column defaults from ml_predictions.sql, used when an input feature is missing
+FEATURE_DEFAULTS = {
+    'regular_ward_admission': 0, 'hemoglobin': 13.5, 'hematocrit': 40.0, 'platelets': 250,
+    'red_blood_cells': 4.8, 'lymphocytes': 2.2, 'urea': 5.2, 'potassium': 4.1, 'sodium': 140,
+    'length_of_stay': 5, 'num_medications': 5
+}
+
+# The table stores these as INTEGER
+INTEGER_FEATURES = {
+    'diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 'respiratory_disease',
+    'regular_ward_admission', 'semi_intensive_unit_admission', 'intensive_care_unit_admission',
+    'platelets', 'sodium', 'sars_cov2_exam_result', 'length_of_stay', 'num_medications', 'previous_admissions'
+}
+
+OUTPUT_COLUMNS = [
+    'ml_probability', 'clinical_score', 'risk_percentage', 'risk_level', 'confidence',
+    'age_group', 'age_multiplier', 'recommendation', 'risk_factors', 'risk_factor_mask'
+]
+
+COLUMNS = ['patient_id', 'doctor_id'] + FEATURE_COLUMNS + OUTPUT_COLUMNS
+
+VALID_RISK_LEVELS = ('low', 'medium', 'high')
+
+# Stored feature values go through the same checks as scored ones, so a rejected value is never persisted
+FEATURE_VALIDATOR = PayloadValidator(fields=FEATURE_COLUMNS)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ml_predictions (
+    id TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(16)))),
+    patient_id TEXT NOT NULL,
+    doctor_id TEXT NOT NULL,
+    {features},
+    ml_probability REAL NOT NULL,
+    clinical_score REAL NOT NULL,
+    risk_percentage REAL NOT NULL,
+    risk_level TEXT NOT NULL CHECK (risk_level IN ('low', 'medium', 'high')),
+    confidence REAL NOT NULL,
+    age_group TEXT NOT NULL,
+    age_multiplier REAL NOT NULL,
+    recommendation TEXT NOT NULL,
+    risk_factors TEXT, -- JSON array, TEXT[] in PostgreSQL
+    risk_factor_mask INTEGER, -- risk_factors.RISK_FACTOR_CODES bits
+    predicted_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_ml_predictions_patient_id ON ml_predictions(patient_id);
+CREATE INDEX IF NOT EXISTS idx_ml_predictions_predicted_at ON ml_predictions(predicted_at DESC);
+CREATE INDEX IF NOT EXISTS idx_ml_predictions_risk_level ON ml_predictions(risk_level);
+CREATE INDEX IF NOT EXISTS idx_ml_predictions_doctor_id ON ml_predictions(doctor_id);
+
+CREATE TRIGGER IF NOT EXISTS update_ml_predictions_updated_at
+    AFTER UPDATE ON ml_predictions
+    FOR EACH ROW WHEN NEW.updated_at = OLD.updated_at
+    BEGIN
+        UPDATE ml_predictions SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+    END;
+""".format(features=',\n    '.join(
+    f"{col} {'INTEGER' if col in INTEGER_FEATURES else 'REAL'} NOT NULL DEFAULT {FEATURE_DEFAULTS.get(col, 0)}"
+    for col in FEATURE_COLUMNS
+))
+
+
+def build_row(prediction: Dict[str, Any], patient_data: Dict[str, Any],
+              patient_id: Optional[str] = None, doctor_id: str = 'system') -> Optional[List[Any]]:
+    """Flatten one prediction into ml_predictions column order (None for error results)"""
+    if prediction.get('risk_level') not in VALID_RISK_LEVELS:
+        return None
+
+    row = [patient_id or prediction.get('patient_id') or patient_data.get('patient_id'), doctor_id]
+    # Missing and rejected fields are left out of the clean record and take the column default
+    patient_data = FEATURE_VALIDATOR.validate([patient_data]).clean_record(0, patient_data)
+    for col in FEATURE_COLUMNS:
+        value = patient_data.get(col)
+        if value is None:
+            value = FEATURE_DEFAULTS.get(col, 0)
+        # Lab columns are DECIMAL(x,1), outputs DECIMAL(5,2)
+        row.append(int(round(float(value))) if col in INTEGER_FEATURES else round(float(value), 1))
+    for col in OUTPUT_COLUMNS:
+        value = prediction.get(col)
+        if col == 'risk_factors':
+            mask = prediction.get('risk_factor_mask')
+            if value is None and mask is not None:
+                # Readers only use the text, so coded predictions are rendered next to their mask
+                values = prediction.get('risk_factor_values') or values_from_features(mask, patient_data)
+                value = render_risk_factors(mask, values)
+            value = list(value or [])
+        elif col == 'risk_factor_mask':
+            value = int(value) if value is not None else None
+        elif col not in ('risk_level', 'age_group', 'recommendation'):
+            value = round(float(value if value is not None else 0.0), 2)
+        row.append(value)
+    return row
+
+
+def _copy_escape(text: str) -> str:
+    """Escape a value for PostgreSQL COPY text format"""
+    return (text.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _array_literal(values: List[str]) -> str:
+    """Render a TEXT[] literal such as {"a","b"}"""
+    quoted = ('"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for v in values)
+    return '{' + ','.join(quoted) + '}'
+
+
+def format_copy_rows(rows: Iterable[List[Any]]) -> str:
+    """Render rows in COPY text format (tab separated, \\N for NULL)"""
+    lines = []
+    for row in rows:
+        fields = []
+        for value in row:
+            if value is None:
+                fields.append('\\N')
+            elif isinstance(value, list):
+                fields.append(_copy_escape(_array_literal(value)))
+            else:
+                fields.append(_copy_escape(str(value)))
+        lines.append('\t'.join(fields))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+class PostgresCopySink:
+    """Streams each batch through COPY FROM STDIN in its own transaction"""
+
+    def __init__(self, dsn: str):
+        if not POSTGRES_AVAILABLE:
+            raise ImportError('psycopg2 is required for PostgresCopySink')
+        self.conn = psycopg2.connect(dsn)
+        self.sql = f"COPY ml_predictions ({', '.join(COLUMNS)}) FROM STDIN"
+
+    def write(self, rows: List[List[Any]]):
+        with self.conn:
+            with self.conn.cursor() as cursor:
+                cursor.copy_expert(self.sql, io.StringIO(format_copy_rows(rows)))
+
+    def close(self):
+        self.conn.close()
+
+
+class CopyFileSink:
+    """Appends COPY text format to a file for loading with psql \\copy"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, rows: List[List[Any]]):
+        self.file.write(format_copy_rows(rows))
+
+    def close(self):
+        self.file.close()
+
+
+class SQLiteSink:
+    """Local stand-in for ml_predictions with the same columns and indexes"""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SQLITE_SCHEMA)
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(ml_predictions)')}
+        if 'risk_factor_mask' not in columns:
+            # Same change as database/ml_predictions_risk_factor_mask.sql
+            self.conn.execute('ALTER TABLE ml_predictions ADD COLUMN risk_factor_mask INTEGER')
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        self.sql = f"INSERT INTO ml_predictions ({', '.join(COLUMNS)}) VALUES ({placeholders})"
+        self._factors_index = COLUMNS.index('risk_factors')
+
+    def write(self, rows: List[List[Any]]):
+        index = self._factors_index
+        params = [row[:index] + [json.dumps(row[index]) if row[index] is not None else None] + row[index + 1:]
+                  for row in rows]
+        with self.conn:
+            self.conn.executemany(self.sql, params)
+
+    def close(self):
+        self.conn.close()
+
+
+class BulkPredictionWriter:
+    """Buffers prediction rows and flushes them to a sink in large batches"""
+
+    def __init__(self, sink, batch_size: int = 10000, rollups=None):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.rollups = rollups  # optional cohort_rollups.CohortRollups kept current with every written row
+        self.buffer = []
+        self.pending = []  # (prediction, doctor_id) for buffered rows, applied to rollups once written
+        self.stats = {'rows': 0, 'rejected': 0, 'flushes': 0, 'flush_seconds': 0.0}
+
+    def add(self, prediction: Dict[str, Any], patient_data: Dict[str, Any],
+            patient_id: Optional[str] = None, doctor_id: str = 'system'):
+        row = build_row(prediction, patient_data, patient_id, doctor_id)
+        if row is None:
+            self.stats['rejected'] += 1
+            return
+        self.buffer.append(row)
+        if self.rollups is not None:
+            self.pending.append((prediction, doctor_id))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        start = time.perf_counter()
+        self.sink.write(self.buffer)
+        self.stats['flush_seconds'] += time.perf_counter() - start
+        self.stats['rows'] += len(self.buffer)
+        self.stats['flushes'] += 1
+        self.buffer = []
+        if self.rollups is not None:
+            for prediction, doctor_id in self.pending:
+                self.rollups.add_prediction(prediction, doctor_id=doctor_id)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _sample_rows(count: int, seed: int = 42):
+    """Synthetic (prediction, patient) pairs scored with the rule-based service"""
+    from synthetic_patients import generate_chunk
+    from ml_prediction_service import SimplifiedMLService
+
+    service = SimplifiedMLService()
+    frame = generate_chunk(0, count, seed).drop(columns=['readmitted_30_days'])
+    for patient in json.loads(frame.to_json(orient='records')):
+        prediction = service.predict_readmission(patient)
+        prediction.setdefault('ml_probability', 25.0)
+        prediction.setdefault('clinical_score', 0.0)
+        prediction.setdefault('age_multiplier', 1.0)
+        yield prediction, patient
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bulk persistence of predictions')
+    parser.add_argument('--sqlite', default=None, help='SQLite stand-in database path')
+    parser.add_argument('--copy-file', default=None, help='Write COPY text format to this file')
+    parser.add_argument('--dsn', default=None, help='PostgreSQL DSN (requires psycopg2)')
+    parser.add_argument('--rows', type=int, default=50000, help='Synthetic predictions to write')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Rows per transaction')
+    parser.add_argument('--compare-single', action='store_true',
+                        help='Also time one transaction per row (SQLite only)')
+    args = parser.parse_args()
+
+    if args.dsn:
+        sink = PostgresCopySink(args.dsn)
+    elif args.copy_file:
+        sink = CopyFileSink(args.copy_file)
+    else:
+        sink = SQLiteSink(args.sqlite or ':memory:')
+
+    samples = list(_sample_rows(args.rows))
+    report = {}
+
+    start = time.perf_counter()
+    with BulkPredictionWriter(sink, args.batch_size) as writer:
+        for prediction, patient in samples:
+            writer.add(prediction, patient, patient_id=str(uuid.uuid4()))
+    elapsed = time.perf_counter() - start
+    report['bulk'] = dict(writer.stats, seconds=round(elapsed, 3),
+                          rows_per_second=round(writer.stats['rows'] / max(elapsed, 1e-9)))
+
+    if args.compare_single and not (args.dsn or args.copy_file):
+        single = SQLiteSink(args.sqlite + '.single' if args.sqlite else ':memory:')
+        start = time.perf_counter()
+        for prediction, patient in samples:
+            row = build_row(prediction, patient, str(uuid.uuid4()))
+            if row is not None:
+                single.write([row])
+        elapsed = time.perf_counter() - start
+        single.close()
+        report['single_row'] = {'rows': len(samples), 'seconds': round(elapsed, 3),
+                                'rows_per_second': round(len(samples) / max(elapsed, 1e-9))}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
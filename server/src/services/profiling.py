@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stage Profiling for RelayLoop
+Per-stage wall time, CPU time and peak traced memory, plus a sampling CPU
+profile written as collapsed stacks for flamegraph tools.
+
+Code marks its stages with `with stage('csv_load'):` or `@profiled(...)`;
+both are a no-op unless
+a StageProfiler is running. While one runs, a daemon thread samples the
+stacks of every other thread every few milliseconds, and tracemalloc tracks
+the peak allocation inside each stage. tracemalloc slows allocation-heavy
+code noticeably, so profiled timings read high in absolute terms.
+
+Entry points take `--profile PATH`: the JSON stage report is written to PATH
+and the collapsed stacks to PATH.folded (render with flamegraph.pl or
+speedscope). Nothing is written to stdout.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Dict, Any, List, Optional
+
+DEFAULT_INTERVAL = 0.005
+
+_NULL_STAGE = nullcontext()
+
+_active = None
+
+
+def stage(name: str):
+    """Context manager timing one stage of the active profiler (no-op when profiling is off)"""
+    if _active is None:
+        return _NULL_STAGE
+    return _active.stage(name)
+
+
+def profiled(name: str):
+    """Decorator running the whole function as one stage"""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class _StageStats:
+    __slots__ = ('calls', 'wall', 'cpu', 'peak', 'samples')
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak = 0
+        self.samples = 0
+
+
+class StageProfiler:
+    """Collects stage timings, per-stage memory peaks and stack samples for the whole process"""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, trace_memory: bool = True):
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.stats = {}
+        self.stacks = Counter()
+        self.sample_count = 0
+        self.started = None
+        self.wall = 0.0
+        self._open = {}  # thread id -> stack of [name, base_memory, peak] for open stages
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self) -> 'StageProfiler':
+        global _active
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample_loop, name='stage-profiler', daemon=True)
+        self._sampler.start()
+        _active = self
+        return self
+
+    def stop(self) -> Dict[str, Any]:
+        global _active
+        _active = None
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.wall = time.perf_counter() - self.started
+        return self.report()
+
+    def _fold_peak(self):
+        """Credit the traced peak since the last reset to every open stage, then reset it"""
+        if not self.trace_memory:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for frames in self._open.values():
+            for frame in frames:
+                frame[2] = max(frame[2], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name: str):
+        thread = threading.get_ident()
+        with self._lock:
+            self._fold_peak()
+            base = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+            frame = [name, base, base]
+            self._open.setdefault(thread, []).append(frame)
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = _StageStats()
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+            with self._lock:
+                self._fold_peak()
+                frames = self._open[thread]
+                frames.remove(frame)
+                if not frames:
+                    del self._open[thread]
+                stats.calls += 1
+                stats.wall += wall
+                stats.cpu += cpu
+                stats.peak = max(stats.peak, frame[2] - frame[1])
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                open_stages = {thread: [f[0] for f in stack] for thread, stack in self._open.items()}
+            for thread, frame in frames.items():
+                if thread == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                stack.reverse()
+                stages = open_stages.get(thread, [])
+                if thread not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                prefix = [names.get(thread, str(thread))] + [f'[{s}]' for s in stages]
+                self.stacks[';'.join(prefix + stack)] += 1
+                if stages:
+                    self.stats[stages[-1]].samples += 1
+            self.sample_count += 1
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {name: {
+                'calls': s.calls,
+                'wall_seconds': round(s.wall, 4),
+                'cpu_seconds': round(s.cpu, 4),
+                'mean_wall_ms': round(s.wall / s.calls * 1000, 3) if s.calls else None,
+                'peak_alloc_mb': round(s.peak / 1e6, 3) if self.trace_memory else None,
+                'self_samples': s.samples
+            } for name, s in self.stats.items()}
+        return {
+            'wall_seconds': round(self.wall, 3),
+            'sample_interval_ms': self.interval * 1000,
+            'sample_rounds': self.sample_count,
+            'memory_traced': self.trace_memory,
+            'stages': stages
+        }
+
+    def collapsed_stacks(self) -> List[str]:
+        """Lines of 'frame;frame;... count', the input format of flamegraph.pl"""
+        return [f'{stack} {count}' for stack, count in self.stacks.most_common()]
+
+    def write(self, path: str) -> Dict[str, Any]:
+        """Stop if still running and write PATH (JSON report) and PATH.folded (collapsed stacks)"""
+        report = self.stop() if _active is self else self.report()
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        with open(path + '.folded', 'w') as f:
+            f.write('\n'.join(self.collapsed_stacks()) + '\n')
+        return report
+
+
+def pop_profile_arg(argv: List[str]) -> Optional[str]:
+    """Remove `--profile PATH` (or --profile=PATH) from argv and return PATH"""
+    for i, arg in enumerate(argv):
+        if arg == '--profile' and i + 1 < len(argv):
+            path = argv[i + 1]
+            del argv[i:i + 2]
+            return path
+        if arg.startswith('--profile='):
+            del argv[i]
+            return arg.split('=', 1)[1]
+    return None
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Request Coalescing for RelayLoop
+Single-flight scoring: concurrent requests with the same normalized features
+and model version wait on one in-flight computation and share its result.
+
+The key is a hash of the payload after validation (so 81, 81.0 and "81" are
+the same age), its validation errors (so a rejected value and a missing one,
+or two different rejected values, stay apart) and the model version that will
+score it; request-only fields such as deadline_ms and request_id are left
+out. Only requests that overlap in time are coalesced, nothing is cached
+after the computation finishes.
+
+A follower with a deadline waits at most until then and computes on its own
+if the leader has not finished. A leader's result that is not shareable (a
+deadline-degraded prediction) is not handed out either: its followers
+compute their own. A leader's exception is raised in every waiting request.
+Counters report how much duplicate work was avoided.
+
+Fire N identical requests at once and show the counters:
+    python request_coalescing.py --requests 32
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, Any, Callable, Optional, Tuple
+
+from payload_validation import PayloadValidator
+
+# Fields that describe the request rather than the patient
+REQUEST_FIELDS = ('deadline_ms', 'request_id')
+
+_validator = PayloadValidator()
+
+
+def prediction_key(patient_data: Dict[str, Any], model_version: Optional[str]) -> str:
+    """Hash of a payload's normalized features and the model version scoring it"""
+    validation = _validator.validate([patient_data])
+    values = validation.values[0]
+    features = {field: round(float(value), 9) for field, value in zip(validation.fields, values.tolist())
+                if value == value}
+    # Results echo the errors, so payloads that fail differently must not share one
+    errors = validation.errors(0)
+    schema = _validator.schema
+    extra = {field: value for field, value in patient_data.items()
+             if field not in schema and field not in REQUEST_FIELDS}
+    text = json.dumps([model_version, features, errors, extra], sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    """One in-flight computation and the requests waiting on it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.result = None
+        self.error = None
+        self.shared = True
+        self.seconds = 0.0
+
+
+class SingleFlight:
+    """Runs one computation per key at a time; concurrent callers share its result
+
+    shareable(result) decides whether a leader's result may be given to its
+    followers; when it returns False they compute their own.
+    """
+
+    def __init__(self, shareable: Optional[Callable[[Any], bool]] = None):
+        self.shareable = shareable
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.computed = 0
+        self.coalesced = 0
+        self.wait_timeouts = 0
+        self.unshared = 0
+        self.errors = 0
+        self.saved_seconds = 0.0
+        self.max_followers = 0
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """(result, shared) of fn() for key; followers get their own deep copy of the leader's result"""
+        with self._lock:
+            self.requests += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            else:
+                flight.followers += 1
+                leader = False
+
+        if leader:
+            return self._lead(key, flight, fn), False
+
+        if not flight.done.wait(timeout):
+            # Too slow for this request's deadline: score it on its own
+            with self._lock:
+                flight.followers -= 1
+                self.wait_timeouts += 1
+                self.computed += 1
+            return fn(), False
+        if flight.error is None and not flight.shared:
+            # The leader's result only held for its own request (e.g. cut short by its deadline)
+            with self._lock:
+                self.unshared += 1
+                self.computed += 1
+            return fn(), False
+        with self._lock:
+            self.coalesced += 1
+            self.saved_seconds += flight.seconds
+        if flight.error is not None:
+            raise flight.error
+        return copy.deepcopy(flight.result), True
+
+    def _lead(self, key: str, flight: _Flight, fn: Callable[[], Any]):
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            flight.seconds = time.perf_counter() - start
+            with self._lock:
+                # Later arrivals start a new flight
+                self._flights.pop(key, None)
+                self.computed += 1
+                followers = flight.followers
+                self.max_followers = max(self.max_followers, followers)
+            if flight.error is None and followers:
+                flight.shared = self.shareable is None or self.shareable(result)
+                if flight.shared:
+                    # The leader's copy may be modified by its caller; followers copy this snapshot
+                    flight.result = copy.deepcopy(result)
+            flight.done.set()
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'computed': self.computed,
+                'coalesced': self.coalesced,
+                'coalesced_rate': round(self.coalesced / self.requests, 4) if self.requests else 0.0,
+                'wait_timeouts': self.wait_timeouts,
+                'unshared': self.unshared,
+                'errors': self.errors,
+                'saved_seconds': round(self.saved_seconds, 4),
+                'max_followers': self.max_followers,
+                'in_flight': len(self._flights)
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Coalesce concurrent identical predictions')
+    parser.add_argument('--requests', type=int, default=32, help='Concurrent identical requests')
+    parser.add_argument('--distinct', type=int, default=1, help='Distinct payloads among them')
+    args = parser.parse_args()
+
+    from ml_prediction_service import ml_service
+    ml_service.initialize('')
+    flight = SingleFlight()
+    results = [None] * args.requests
+    barrier = threading.Barrier(args.requests)
+
+    def request(i):
+        patient = {'patient_id': f'P{i % args.distinct}', 'age': 70 + i % args.distinct, 'diabetes': 1,
+                   'hemoglobin': 10.5, 'platelets': 210, 'urea': 9.0, 'length_of_stay': 5}
+        key = prediction_key(patient, ml_service.model_version)
+        barrier.wait()
+        results[i], _ = flight.do(key, lambda: ml_service.predict_readmission(dict(patient)))
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(args.requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    probabilities = {r['patient_id']: r['risk_percentage'] for r in results}
+    print(json.dumps({'stats': flight.stats(), 'risk_percentage': probabilities}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Risk Factor Codes for RelayLoop
+Risk factors travel as an integer bitmask plus the numeric values the
+messages quote; English text is rendered only where a response leaves the
+service (the runner) or a person reads it.
+
+Bit positions are persisted (ml_predictions.risk_factor_mask), so codes are
+append-only: never reorder or remove an entry of RISK_FACTOR_CODES.
+"""
+
+from typing import Dict, Any, List, Optional
+
+# Bit i of a mask is RISK_FACTOR_CODES[i]; names match the clinical weight keys
+RISK_FACTOR_CODES = [
+    'age_elderly', 'age_senior',
+    'diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 'respiratory_disease',
+    'multiple_comorbidities', 'icu_admission',
+    'low_hemoglobin', 'low_platelets', 'high_urea',
+    'covid_positive', 'long_stay', 'frequent_admissions', 'high_medications',
+    'critical_conditions',
+    'semi_intensive_admission', 'low_lymphocytes'
+]
+
+BIT = {code: 1 << i for i, code in enumerate(RISK_FACTOR_CODES)}
+
+CONDITION_CODES = ['diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 'respiratory_disease']
+
+CONDITION_LABELS = {
+    'diabetes': 'Diabetes mellitus',
+    'hypertension': 'Hypertension',
+    'heart_disease': 'Heart disease',
+    'kidney_disease': 'Kidney disease',
+    'respiratory_disease': 'Respiratory disease'
+}
+
+# Message per code; {value} is the quoted measurement from the values dict
+MESSAGES = {
+    'age_elderly': 'Advanced age (80+ years) - very high risk',
+    'age_senior': 'Senior age (65-80 years) - increased risk',
+    'icu_admission': 'ICU admission - critical condition',
+    'low_hemoglobin': 'Low hemoglobin (anemia): {value}',
+    'low_platelets': 'Low platelets (thrombocytopenia): {value}',
+    'high_urea': 'Elevated urea (kidney dysfunction): {value}',
+    'covid_positive': 'COVID-19 positive',
+    'long_stay': 'Extended hospitalization ({value} days)',
+    'frequent_admissions': 'Frequent admissions ({value} in past year)',
+    'high_medications': 'Polypharmacy ({value} medications)',
+    'critical_conditions': 'Critical medical conditions detected',
+    'semi_intensive_admission': 'Semi-intensive unit admission',
+    'low_lymphocytes': 'Low lymphocytes (immunocompromised): {value}'
+}
+
+# Primary concerns as (bits that raise it, concern text)
+CONCERNS = [
+    (BIT['age_elderly'] | BIT['age_senior'], 'Age-related increased vulnerability'),
+    (BIT['icu_admission'] | BIT['critical_conditions'], 'Critical care requirements'),
+    (BIT['multiple_comorbidities'], 'Complex medical conditions'),
+    (BIT['covid_positive'], 'COVID-19 complications')
+]
+
+DEFAULT_CONCERN = 'General medical monitoring required'
+
+# Input feature each quoted value comes from, so stored rows can be rendered without a values column
+VALUE_FEATURES = {
+    'low_hemoglobin': 'hemoglobin',
+    'low_platelets': 'platelets',
+    'low_lymphocytes': 'lymphocytes',
+    'high_urea': 'urea',
+    'long_stay': 'length_of_stay',
+    'frequent_admissions': 'previous_admissions',
+    'high_medications': 'num_medications'
+}
+
+
+def factor_codes(mask: int) -> List[str]:
+    """Codes of the bits set in a mask, in bit order"""
+    return [code for i, code in enumerate(RISK_FACTOR_CODES) if mask >> i & 1]
+
+
+def primary_concerns(mask: int) -> List[str]:
+    return [text for bits, text in CONCERNS if mask & bits] or [DEFAULT_CONCERN]
+
+
+def render_risk_factors(mask: int, values: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Human-readable risk factor messages for a mask"""
+    values = values or {}
+    messages = []
+    conditions_rendered = False
+    for code in RISK_FACTOR_CODES:
+        if not mask & BIT[code]:
+            continue
+        if code in CONDITION_LABELS:
+            # All conditions become one group message at the first one set
+            if not conditions_rendered:
+                labels = [CONDITION_LABELS[c] for c in CONDITION_CODES if mask & BIT[c]]
+                if mask & BIT['multiple_comorbidities']:
+                    messages.append(f'Multiple comorbidities: {", ".join(labels)}')
+                else:
+                    messages.extend(labels)
+                conditions_rendered = True
+        elif code != 'multiple_comorbidities':
+            messages.append(MESSAGES[code].format(value=values.get(code)))
+    return messages
+
+
+def values_from_features(mask: int, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Quoted values of a mask, read from an ml_predictions row or patient payload"""
+    return {code: record.get(feature) for code, feature in VALUE_FEATURES.items() if mask & BIT[code]}
+
+
+def render_prediction(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Add risk_factors text to a coded prediction result (the API edge)"""
+    if 'risk_factor_mask' in result and 'risk_factors' not in result:
+        result['risk_factors'] = render_risk_factors(result['risk_factor_mask'], result.get('risk_factor_values'))
+    return result
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shadow Scoring for RelayLoop
+Scores a sampled fraction of live requests with a candidate model next to
+production and aggregates how the two disagree, without touching the
+production response.
+
+The production path only pays for a sampling decision and a non-blocking
+put on a bounded queue; the candidate runs on a daemon thread. When the
+shadow worker falls behind, requests are dropped from the shadow sample
+rather than queued behind it.
+
+Used by the resident runner:
+    python ml_prediction_runner.py --serve --shadow candidate.npz --shadow-rate 0.2
+"""
+
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from load_test import LatencyHistogram
+
+RISK_LEVELS = ['low', 'medium', 'high']
+
+# Upper edges (percentage points) of the |risk_percentage delta| buckets
+DELTA_BUCKETS = [1.0, 5.0, 10.0, 20.0]
+
+MAX_FLIP_EXAMPLES = 20
+
+
+class DivergenceStats:
+    """Running comparison of production and candidate responses"""
+
+    def __init__(self):
+        self.compared = 0
+        self.candidate_errors = 0
+        self.flips = {}
+        self.flip_examples = []
+        self.delta_sum = 0.0
+        self.abs_delta_sum = 0.0
+        self.max_abs_delta = 0.0
+        self.delta_buckets = [0] * (len(DELTA_BUCKETS) + 1)
+        self.candidate_latency = LatencyHistogram()
+
+    def record(self, production: Dict[str, Any], candidate: Dict[str, Any], seconds: float):
+        self.candidate_latency.record(seconds)
+        if 'error' in candidate or candidate.get('risk_level') not in RISK_LEVELS:
+            self.candidate_errors += 1
+            return
+
+        self.compared += 1
+        prod_level, cand_level = production['risk_level'], candidate['risk_level']
+        if prod_level != cand_level:
+            key = f'{prod_level}->{cand_level}'
+            self.flips[key] = self.flips.get(key, 0) + 1
+            if len(self.flip_examples) < MAX_FLIP_EXAMPLES:
+                self.flip_examples.append({
+                    'patient_id': production.get('patient_id'),
+                    'production': [prod_level, production['risk_percentage']],
+                    'candidate': [cand_level, candidate['risk_percentage']]
+                })
+
+        delta = candidate['risk_percentage'] - production['risk_percentage']
+        self.delta_sum += delta
+        self.abs_delta_sum += abs(delta)
+        self.max_abs_delta = max(self.max_abs_delta, abs(delta))
+        bucket = sum(abs(delta) >= edge for edge in DELTA_BUCKETS)
+        self.delta_buckets[bucket] += 1
+
+    def report(self) -> Dict[str, Any]:
+        flipped = sum(self.flips.values())
+        n = max(self.compared, 1)
+        labels = [f'<{DELTA_BUCKETS[0]:g}'] + [f'{lo:g}-{hi:g}' for lo, hi in zip(DELTA_BUCKETS, DELTA_BUCKETS[1:])]
+        labels.append(f'>={DELTA_BUCKETS[-1]:g}')
+        return {
+            'compared': self.compared,
+            'candidate_errors': self.candidate_errors,
+            'risk_level_flips': flipped,
+            'flip_rate': round(flipped / n, 4),
+            'flips': dict(sorted(self.flips.items())),
+            'risk_percentage_delta': {
+                'mean': round(self.delta_sum / n, 3),
+                'mean_abs': round(self.abs_delta_sum / n, 3),
+                'max_abs': round(self.max_abs_delta, 3),
+                'buckets': dict(zip(labels, self.delta_buckets))
+            },
+            'candidate_latency_ms': self.candidate_latency.summary_ms(),
+            'flip_examples': self.flip_examples
+        }
+
+
+class ShadowScorer:
+    """Samples requests into a bounded queue scored by a candidate on a worker thread"""
+
+    def __init__(self, candidate, sample_rate: float = 0.1, max_queue: int = 64,
+                 seed: Optional[int] = None, version: Optional[str] = None):
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError('sample_rate must be between 0 and 1')
+        self.candidate = candidate
+        self.sample_rate = sample_rate
+        self.version = version or getattr(candidate, 'model_version', None)
+        self.stats = DivergenceStats()
+        self.offered = 0
+        self.sampled = 0
+        self.dropped = 0
+        self.submit_overhead = LatencyHistogram()
+        self._random = random.Random(seed)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._worker, name='shadow-scorer', daemon=True)
+        self._thread.start()
+
+    def submit(self, patient_data: Dict[str, Any], production: Dict[str, Any]) -> bool:
+        """Offer one scored request to the shadow; never blocks"""
+        start = time.perf_counter()
+        self.offered += 1
+        accepted = False
+        if production.get('risk_level') in RISK_LEVELS and self._random.random() < self.sample_rate:
+            self.sampled += 1
+            try:
+                self._queue.put_nowait((patient_data, production))
+                accepted = True
+            except queue.Full:
+                self.dropped += 1
+        self.submit_overhead.record(time.perf_counter() - start)
+        return accepted
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            patient_data, production = item
+            start = time.perf_counter()
+            try:
+                candidate = self.candidate.predict_patient_risk(dict(patient_data))
+            except Exception as e:
+                candidate = {'error': str(e)}
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.stats.record(production, candidate, seconds)
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            report = self.stats.report()
+        report.update({
+            'candidate_version': self.version,
+            'sample_rate': self.sample_rate,
+            'offered': self.offered,
+            'sampled': self.sampled,
+            'dropped': self.dropped,
+            'pending': self._queue.qsize(),
+            'production_overhead_ms': self.submit_overhead.summary_ms()
+        })
+        return report
+
+    def close(self, timeout: float = 30.0) -> Dict[str, Any]:
+        """Finish queued work (up to timeout) and return the final report"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._queue.put(None, timeout=max(deadline - time.monotonic(), 0.001))
+                break
+            except queue.Full:
+                if time.monotonic() >= deadline:
+                    break
+        self._thread.join(max(deadline - time.monotonic(), 0))
+        return self.report()
+
+
+def load_shadow(artifact: str, sample_rate: float = 0.1, seed: Optional[int] = None) -> ShadowScorer:
+    """Shadow scorer for a candidate compact artifact"""
+    from model_artifacts import load_compact_predictor
+    return ShadowScorer(load_compact_predictor(artifact), sample_rate, seed=seed)
+
+
+def write_report(report: Dict[str, Any], path: Optional[str] = None):
+    text = json.dumps(report, indent=2)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text)
+    else:
+        print(text, file=sys.stderr)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sparse Lab Panels for RelayLoop
+Carries mostly-empty lab panels (e.g. the viral panel of
+dataset/cleaned_patient_dataset.csv) as scipy CSR blocks with
+measured-indicator columns instead of densifying them with fillna(0).
+
+Every panel column becomes two features: the value (stored only when
+non-zero) and `<name>_measured` (stored only when the test was run), so a
+negative result stays distinguishable from a missing one. Inside pandas the
+panel travels as SparseDtype columns, which concat/filter without
+densifying.
+
+Compare dense vs sparse footprints of a CSV:
+    python sparse_panels.py ../../../dataset/cleaned_patient_dataset.csv
+"""
+
+import argparse
+import json
+import re
+from typing import Dict, Any, List
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from payload_validation import PayloadValidator
+
+# Viral panel and rapid tests of the COVID lab dataset, keyed by feature name
+COVID_VIRAL_PANEL = {
+    'respiratory_syncytial_virus': 'Respiratory Syncytial Virus',
+    'influenza_a': 'Influenza A',
+    'influenza_b': 'Influenza B',
+    'parainfluenza_1': 'Parainfluenza 1',
+    'coronavirus_nl63': 'CoronavirusNL63',
+    'rhinovirus_enterovirus': 'Rhinovirus/Enterovirus',
+    'coronavirus_hku1': 'Coronavirus HKU1',
+    'parainfluenza_3': 'Parainfluenza 3',
+    'chlamydophila_pneumoniae': 'Chlamydophila pneumoniae',
+    'adenovirus': 'Adenovirus',
+    'parainfluenza_4': 'Parainfluenza 4',
+    'coronavirus_229e': 'Coronavirus229E',
+    'coronavirus_oc43': 'CoronavirusOC43',
+    'influenza_a_h1n1_2009': 'Inf A H1N1 2009',
+    'bordetella_pertussis': 'Bordetella pertussis',
+    'metapneumovirus': 'Metapneumovirus',
+    'influenza_b_rapid_test': 'Influenza B, rapid test',
+    'influenza_a_rapid_test': 'Influenza A, rapid test'
+}
+
+SPARSE_FLOAT = pd.SparseDtype(np.float32, np.nan)
+
+
+def feature_slug(column: str) -> str:
+    return re.sub(r'[^0-9a-z]+', '_', column.lower()).strip('_')
+
+
+def detect_sparse_columns(df: pd.DataFrame, max_density: float = 0.5) -> Dict[str, str]:
+    """Numeric columns measured in at most max_density of rows, keyed by feature name"""
+    panel = {}
+    for col in df.columns:
+        if pd.api.types.is_numeric_dtype(df[col]) and df[col].notna().mean() <= max_density:
+            panel[feature_slug(col)] = col
+    return panel
+
+
+class SparsePanel:
+    """A named set of sparse lab columns and how to read them from raw data"""
+
+    def __init__(self, columns: Dict[str, str], name: str = 'panel'):
+        self.name = name
+        self.columns = dict(columns)
+        self.feature_names = list(self.columns) + [f'{c}_measured' for c in self.columns]
+        # Panel results have no physiological limits: only unparseable values and ones that are not
+        # finite in float32 are rejected
+        limit = float(np.finfo(np.float32).max)
+        self.validator = PayloadValidator({feature: ('numeric', -limit, limit) for feature in self.columns})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'columns': self.columns}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'SparsePanel':
+        return cls(data['columns'], data.get('name', 'panel'))
+
+    def sparse_columns(self, df: pd.DataFrame) -> Dict[str, pd.arrays.SparseArray]:
+        """Panel columns of a raw or unified frame as SparseDtype arrays (all-missing when absent)"""
+        out = {}
+        for feature, raw in self.columns.items():
+            col = feature if feature in df.columns else raw
+            if col not in df.columns:
+                out[feature] = pd.arrays.SparseArray(np.full(len(df), np.nan, dtype=np.float32),
+                                                     dtype=SPARSE_FLOAT)
+                continue
+            series = df[col]
+            if isinstance(series.dtype, pd.SparseDtype) and pd.isna(series.dtype.fill_value):
+                out[feature] = series.array.astype(SPARSE_FLOAT)
+            else:
+                values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float32)
+                out[feature] = pd.arrays.SparseArray(values, dtype=SPARSE_FLOAT)
+        return out
+
+    def to_csr(self, df: pd.DataFrame) -> sp.csr_matrix:
+        """(n, 2k) float32 CSR of values and measured flags, built from the stored entries only"""
+        n, k = len(df), len(self.columns)
+        rows, cols, values = [], [], []
+        measured_rows, measured_cols = [], []
+        for j, array in enumerate(self.sparse_columns(df).values()):
+            index = array.sp_index.to_int_index().indices
+            stored = array.sp_values
+            present = ~np.isnan(stored)
+            index, stored = index[present], stored[present]
+            measured_rows.append(index)
+            measured_cols.append(np.full(len(index), k + j, dtype=np.int32))
+            nonzero = stored != 0
+            rows.append(index[nonzero])
+            cols.append(np.full(int(nonzero.sum()), j, dtype=np.int32))
+            values.append(stored[nonzero])
+
+        row = np.concatenate(rows + measured_rows) if k else np.empty(0, dtype=np.int32)
+        col = np.concatenate(cols + measured_cols) if k else np.empty(0, dtype=np.int32)
+        data = np.concatenate(values + [np.ones(len(r), dtype=np.float32) for r in measured_rows]) if k \
+            else np.empty(0, dtype=np.float32)
+        return sp.csr_matrix((data.astype(np.float32), (row, col)), shape=(n, 2 * k))
+
+    def records_to_dense(self, records: List[Dict[str, Any]]) -> np.ndarray:
+        """(n, 2k) float32 block for request payloads keyed by feature or raw column name"""
+        k = len(self.columns)
+        keyed = [{feature: record.get(feature, record.get(raw)) for feature, raw in self.columns.items()}
+                 for record in records]
+        values = self.validator.validate(keyed).values
+        measured = ~np.isnan(values)
+        out = np.empty((len(records), 2 * k), dtype=np.float32)
+        out[:, :k] = np.where(measured, values, 0.0)
+        out[:, k:] = measured
+        return out
+
+
+def hstack_features(dense: np.ndarray, panel_block) -> Any:
+    """Join the dense feature matrix with a panel block, staying sparse when the block is"""
+    if sp.issparse(panel_block):
+        return sp.hstack([sp.csr_matrix(dense), panel_block], format='csr', dtype=np.float32)
+    return np.hstack([dense, panel_block]).astype(np.float32, copy=False)
+
+
+def read_csv_sparse(path: str, panel: SparsePanel, chunksize: int = 100000) -> pd.DataFrame:
+    """Read a CSV in chunks, converting panel columns to SparseDtype as they arrive
+
+    Columns keep their raw names and positions, so the frame matches a plain
+    pd.read_csv apart from the panel dtypes.
+    """
+    frames = []
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        for raw in panel.columns.values():
+            if raw in chunk.columns:
+                values = pd.to_numeric(chunk[raw], errors='coerce').to_numpy(dtype=np.float32)
+                chunk[raw] = pd.arrays.SparseArray(values, dtype=SPARSE_FLOAT)
+        frames.append(chunk)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def footprint_report(path: str, max_density: float = 0.5) -> Dict[str, Any]:
+    df = pd.read_csv(path)
+    panel = SparsePanel(detect_sparse_columns(df, max_density))
+    dense_bytes = len(df) * len(df.columns) * 8
+    panel_dense_bytes = len(df) * len(panel.feature_names) * 8
+    csr = panel.to_csr(df)
+    csr_bytes = csr.data.nbytes + csr.indices.nbytes + csr.indptr.nbytes
+    return {
+        'rows': len(df),
+        'columns': len(df.columns),
+        'panel_columns': len(panel.columns),
+        'panel_density': round(csr.nnz / max(csr.shape[0] * csr.shape[1], 1), 4),
+        'dense_float64_all_columns_bytes': dense_bytes,
+        'panel_dense_float64_bytes': panel_dense_bytes,
+        'panel_csr_bytes': int(csr_bytes)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the sparse panel footprint of a CSV')
+    parser.add_argument('csv', help='Input CSV')
+    parser.add_argument('--max-density', type=float, default=0.5,
+                        help='Columns measured in at most this fraction of rows form the panel')
+    args = parser.parse_args()
+    print(json.dumps(footprint_report(args.csv, args.max_density), indent=2))
+
+
+if __name__ == "__main__":
+    main()
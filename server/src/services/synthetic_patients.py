@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic Patient Generator for RelayLoop
+Streams any number of realistic, fully synthetic patient records to disk in
+chunks for load and scale testing without real PHI.
+
+Every chunk draws from its own generator seeded by (seed, chunk index), so the
+output is identical for a given seed regardless of the number of workers.
+"""
+
+import argparse
+import copy
+import gzip
+import json
+import os
+import sys
+import time
+from collections import deque
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from typing import Dict, Any, Optional
+
+# Baseline prevalence and the odds multiplier applied per decade above 40
+DEFAULT_COMORBIDITIES = {
+    'diabetes': {'prevalence': 0.30, 'odds_per_decade': 1.25},
+    'hypertension': {'prevalence': 0.40, 'odds_per_decade': 1.35},
+    'heart_disease': {'prevalence': 0.20, 'odds_per_decade': 1.40},
+    'kidney_disease': {'prevalence': 0.15, 'odds_per_decade': 1.30},
+    'respiratory_disease': {'prevalence': 0.20, 'odds_per_decade': 1.15}
+}
+
+# Normal distributions clipped to physiological ranges, with a missing rate
+DEFAULT_LABS = {
+    'hemoglobin': {'mean': 13.4, 'std': 2.2, 'min': 6.0, 'max': 18.0, 'missing_rate': 0.0},
+    'hematocrit': {'mean': 40.0, 'std': 6.0, 'min': 25.0, 'max': 55.0, 'missing_rate': 0.0},
+    'platelets': {'mean': 270.0, 'std': 88.0, 'min': 50.0, 'max': 600.0, 'missing_rate': 0.0},
+    'red_blood_cells': {'mean': 4.7, 'std': 0.75, 'min': 2.5, 'max': 7.0, 'missing_rate': 0.0},
+    'lymphocytes': {'mean': 2.1, 'std': 0.85, 'min': 0.5, 'max': 6.0, 'missing_rate': 0.0},
+    'urea': {'mean': 5.5, 'std': 3.0, 'min': 1.0, 'max': 25.0, 'missing_rate': 0.0},
+    'potassium': {'mean': 4.05, 'std': 0.65, 'min': 2.5, 'max': 6.5, 'missing_rate': 0.0},
+    'sodium': {'mean': 139.5, 'std': 4.5, 'min': 120.0, 'max': 160.0, 'missing_rate': 0.0}
+}
+
+DEFAULT_CONFIG = {
+    'age': {'mean': 58.0, 'std': 18.0, 'min': 18, 'max': 95},
+    'comorbidities': DEFAULT_COMORBIDITIES,
+    'labs': DEFAULT_LABS,
+    'admission': {'icu_rate': 0.10, 'semi_intensive_rate': 0.14},
+    'covid_rate': 0.12,
+    'readmission_rate': 0.19
+}
+
+COLUMNS = [
+    'patient_id', 'age', 'gender',
+    'diabetes', 'hypertension', 'heart_disease', 'kidney_disease', 'respiratory_disease',
+    'regular_ward_admission', 'semi_intensive_unit_admission', 'intensive_care_unit_admission',
+    'hemoglobin', 'hematocrit', 'platelets', 'red_blood_cells', 'lymphocytes', 'urea', 'potassium', 'sodium',
+    'sars_cov2_exam_result', 'length_of_stay', 'num_medications', 'previous_admissions',
+    'readmitted_30_days'
+]
+
+
+def load_config(path: Optional[str] = None) -> Dict[str, Any]:
+    """Merge an optional JSON config over the default distributions"""
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if path:
+        with open(path, 'r') as f:
+            overrides = json.load(f)
+        for key, value in overrides.items():
+            if isinstance(value, dict) and isinstance(config.get(key), dict):
+                for sub_key, sub_value in value.items():
+                    if isinstance(sub_value, dict) and isinstance(config[key].get(sub_key), dict):
+                        config[key][sub_key].update(sub_value)
+                    else:
+                        config[key][sub_key] = sub_value
+            else:
+                config[key] = value
+    return config
+
+
+def chunk_rng(seed: int, chunk_index: int) -> np.random.Generator:
+    """Independent generator for one chunk, stable across worker counts"""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(chunk_index,)))
+
+
+def generate_chunk(chunk_index: int, rows: int, seed: int = 42,
+                   config: Optional[Dict[str, Any]] = None, first_row: Optional[int] = None) -> pd.DataFrame:
+    """Generate one chunk of synthetic patients"""
+    config = config or DEFAULT_CONFIG
+    rng = chunk_rng(seed, chunk_index)
+    first_row = chunk_index * rows if first_row is None else first_row
+
+    age_cfg = config['age']
+    age = np.clip(rng.normal(age_cfg['mean'], age_cfg['std'], rows), age_cfg['min'], age_cfg['max']).astype(np.int16)
+    decades_over_40 = np.maximum(age - 40, 0) / 10.0
+
+    data = {
+        'patient_id': np.char.add(f'SYN{seed}_', np.char.zfill(np.arange(first_row, first_row + rows).astype(str), 10)),
+        'age': age,
+        'gender': np.where(rng.random(rows) < 0.5, 'M', 'F')
+    }
+
+    # Comorbidities: logistic model with age-dependent odds
+    for name, cfg in config['comorbidities'].items():
+        base_logit = np.log(cfg['prevalence'] / (1 - cfg['prevalence']))
+        logit = base_logit + np.log(cfg['odds_per_decade']) * (decades_over_40 - 2.0)
+        data[name] = (rng.random(rows) < 1 / (1 + np.exp(-logit))).astype(np.int8)
+    comorbidity_count = sum(data[name].astype(np.int16) for name in config['comorbidities'])
+
+    # Admission type: sicker and older patients land in intensive units more often
+    severity = 0.35 * comorbidity_count + 0.15 * decades_over_40
+    adm_cfg = config['admission']
+    icu = rng.random(rows) < np.clip(adm_cfg['icu_rate'] * (0.6 + severity), 0, 0.9)
+    semi = ~icu & (rng.random(rows) < np.clip(adm_cfg['semi_intensive_rate'] * (0.7 + 0.5 * severity), 0, 0.9))
+    data['regular_ward_admission'] = (~icu & ~semi).astype(np.int8)
+    data['semi_intensive_unit_admission'] = semi.astype(np.int8)
+    data['intensive_care_unit_admission'] = icu.astype(np.int8)
+
+    for name, cfg in config['labs'].items():
+        values = np.clip(rng.normal(cfg['mean'], cfg['std'], rows), cfg['min'], cfg['max'])
+        if name == 'urea':
+            values = np.clip(values + 1.5 * data.get('kidney_disease', 0), cfg['min'], cfg['max'])
+        values = np.round(values, 1).astype(np.float32)
+        if cfg.get('missing_rate', 0) > 0:
+            values[rng.random(rows) < cfg['missing_rate']] = np.nan
+        data[name] = values
+
+    data['sars_cov2_exam_result'] = (rng.random(rows) < config['covid_rate']).astype(np.int8)
+    data['length_of_stay'] = np.clip(np.round(rng.exponential(4.0 + 3.0 * icu + 1.5 * semi)), 1, 60).astype(np.int16)
+    data['num_medications'] = rng.poisson(5 + 1.5 * comorbidity_count).astype(np.int16)
+    data['previous_admissions'] = rng.poisson(0.6 + 0.3 * comorbidity_count).astype(np.int16)
+
+    # Outcome follows the clinical risk factors, centred on the target readmission rate
+    risk = (
+        0.35 * comorbidity_count + 0.9 * icu + 0.4 * semi + 0.25 * decades_over_40
+        + 0.6 * data['sars_cov2_exam_result'] + 0.3 * (data['length_of_stay'] > 10)
+        + 0.35 * np.minimum(data['previous_admissions'], 4)
+        + 0.4 * (np.nan_to_num(data.get('hemoglobin', 13.0), nan=13.0) < 12)
+    )
+    rate = config['readmission_rate']
+    logit = np.log(rate / (1 - rate)) + risk - np.mean(risk)
+    data['readmitted_30_days'] = (rng.random(rows) < 1 / (1 + np.exp(-logit))).astype(np.int8)
+
+    return pd.DataFrame(data, columns=[col for col in COLUMNS if col in data])
+
+
+def _render_chunk(task) -> bytes:
+    """Worker entry point: generate one chunk and render it as CSV bytes"""
+    chunk_index, rows, first_row, seed, config, header = task
+    df = generate_chunk(chunk_index, rows, seed, config, first_row)
+    return df.to_csv(index=False, header=header, float_format='%.1f').encode('utf-8')
+
+
+def stream_to_csv(output: str, total_rows: int, chunk_size: int = 100000, seed: int = 42,
+                  workers: Optional[int] = None, config: Optional[Dict[str, Any]] = None,
+                  progress: bool = True) -> Dict[str, Any]:
+    """Generate total_rows patients in parallel and stream them to one CSV (gzip if .gz)"""
+    config = config or DEFAULT_CONFIG
+    n_chunks = (total_rows + chunk_size - 1) // chunk_size
+    tasks = [
+        (i, min(chunk_size, total_rows - i * chunk_size), i * chunk_size, seed, config, i == 0)
+        for i in range(n_chunks)
+    ]
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    opener = gzip.open if output.endswith('.gz') else open
+    start = time.perf_counter()
+    written = 0
+
+    processes = workers or os.cpu_count() or 1
+    window = 2 * processes
+
+    with opener(output, 'wb') as f, Pool(processes=processes) as pool:
+        # At most `window` chunks are generated or waiting to be written, so memory stays bounded
+        # when the writer (e.g. gzip) is slower than the workers; results are written in order
+        pending = deque()
+        submitted = 0
+        for task in tasks:
+            while submitted < n_chunks and len(pending) < window:
+                pending.append(pool.apply_async(_render_chunk, (tasks[submitted],)))
+                submitted += 1
+            f.write(pending.popleft().get())
+            written += task[1]
+            if progress:
+                elapsed = time.perf_counter() - start
+                print(f"\r{written:,}/{total_rows:,} rows ({written / max(elapsed, 1e-9):,.0f} rows/s)",
+                      end='', file=sys.stderr)
+    if progress:
+        print(file=sys.stderr)
+
+    return {
+        'output': output,
+        'rows': written,
+        'chunks': n_chunks,
+        'seed': seed,
+        'seconds': round(time.perf_counter() - start, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream synthetic patient records to a CSV file')
+    parser.add_argument('--rows', type=int, required=True, help='Number of patients to generate')
+    parser.add_argument('--output', required=True, help='Output CSV path (.csv or .csv.gz)')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='Rows per chunk')
+    parser.add_argument('--seed', type=int, default=42, help='Base seed; chunk seeds derive from it')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--config', default=None, help='JSON file overriding comorbidity and lab distributions')
+    args = parser.parse_args()
+
+    summary = stream_to_csv(args.output, args.rows, args.chunk_size, args.seed,
+                            args.workers, load_config(args.config))
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Risk Threshold Analysis for RelayLoop
+Evaluates every possible low/medium/high cut-off on a labelled validation
+set so thresholds can be chosen per department instead of hard-coded.
+
+Scores are sorted once; walking the sorted order with cumulative counts
+gives the confusion matrix at every distinct score in O(n log n) total, so
+no cut-off requires re-scoring. Any threshold is then read back with a
+binary search.
+
+    python threshold_analysis.py ../../../dataset/hospital_readmissions.csv \\
+        --artifact model.npz --group-by medical_specialty --output thresholds.csv
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, Any, Optional
+
+import numpy as np
+import pandas as pd
+
+COUNT_COLUMNS = ['alerts', 'tp', 'fp', 'fn', 'tn']
+METRIC_COLUMNS = ['sensitivity', 'specificity', 'ppv', 'npv', 'f1', 'alert_rate']
+
+# Groups smaller than this are reported but get no suggested cut-offs
+MIN_GROUP_SIZE = 100
+
+
+def _ratio(numerator: np.ndarray, denominator) -> np.ndarray:
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.broadcast_to(np.asarray(denominator, dtype=np.float64), numerator.shape)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+def threshold_sweep(scores, labels) -> Dict[str, np.ndarray]:
+    """Confusion counts and rates for 'alert when score >= threshold' at every distinct score
+
+    Rows are ordered by descending threshold, so alerts grow along the arrays.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    labels = np.asarray(labels).astype(bool)
+    order = np.argsort(-scores, kind='stable')
+    sorted_scores, sorted_labels = scores[order], labels[order]
+
+    # Last position of each run of tied scores: all of a tie alerts together
+    last = np.r_[np.flatnonzero(np.diff(sorted_scores)), len(sorted_scores) - 1] if len(scores) else \
+        np.empty(0, dtype=np.int64)
+    positives = int(sorted_labels.sum())
+    negatives = len(sorted_labels) - positives
+
+    alerts = last + 1
+    tp = np.cumsum(sorted_labels)[last]
+    fp = alerts - tp
+    return _with_metrics({
+        'threshold': sorted_scores[last],
+        'alerts': alerts, 'tp': tp, 'fp': fp, 'fn': positives - tp, 'tn': negatives - fp
+    })
+
+
+def _with_metrics(sweep: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    tp, fp, fn, tn, alerts = (sweep[c] for c in ['tp', 'fp', 'fn', 'tn', 'alerts'])
+    n = tp + fp + fn + tn
+    sweep['sensitivity'] = _ratio(tp, tp + fn)
+    sweep['specificity'] = _ratio(tn, tn + fp)
+    sweep['ppv'] = _ratio(tp, alerts)
+    sweep['npv'] = _ratio(tn, tn + fn)
+    sweep['f1'] = _ratio(2 * tp, 2 * tp + fp + fn)
+    sweep['alert_rate'] = _ratio(alerts, n)
+    return sweep
+
+
+def operating_points(sweep: Dict[str, np.ndarray], thresholds, positives: int, negatives: int) -> Dict[str, np.ndarray]:
+    """Sweep rows for arbitrary thresholds, found by binary search"""
+    thresholds = np.atleast_1d(np.asarray(thresholds, dtype=np.float64))
+    # Number of distinct scores >= threshold, minus one, is the row that applies
+    index = np.searchsorted(-sweep['threshold'], -thresholds, side='right') - 1
+    none = index < 0
+    index = np.maximum(index, 0)
+    points = {'threshold': thresholds}
+    if len(sweep['threshold']):
+        for column in COUNT_COLUMNS:
+            points[column] = np.where(none, 0, sweep[column][index])
+    else:
+        points.update({column: np.zeros(len(thresholds), dtype=np.int64) for column in COUNT_COLUMNS})
+    # Above every score nothing alerts: all positives are missed
+    points['fn'] = np.where(none, positives, points['fn'])
+    points['tn'] = np.where(none, negatives, points['tn'])
+    return _with_metrics(points)
+
+
+def suggest_cutoffs(sweep: Dict[str, np.ndarray], medium_sensitivity: float, high_alert_rate: float) -> Dict[str, Any]:
+    """Medium: highest cut-off reaching the sensitivity target; high: lowest cut-off within the alert budget"""
+    if not len(sweep['threshold']):
+        return {}
+    # Sensitivity and alert rate both grow as the threshold falls
+    reaching = np.flatnonzero(sweep['sensitivity'] >= medium_sensitivity)
+    within = np.flatnonzero(sweep['alert_rate'] <= high_alert_rate)
+    medium = float(sweep['threshold'][reaching[0]]) if len(reaching) else float(sweep['threshold'][-1])
+    high = float(sweep['threshold'][within[-1]]) if len(within) else float(sweep['threshold'][0])
+    return {'medium': round(medium, 4), 'high': round(max(high, medium), 4)}
+
+
+def compact_table(sweep: Dict[str, np.ndarray], grid: np.ndarray, positives: int, negatives: int) -> pd.DataFrame:
+    points = operating_points(sweep, grid, positives, negatives)
+    table = pd.DataFrame({column: points[column] for column in ['threshold'] + COUNT_COLUMNS + METRIC_COLUMNS})
+    table[METRIC_COLUMNS] = table[METRIC_COLUMNS].round(4)
+    return table
+
+
+def analyze(scores, labels, groups=None, current: Optional[Dict[str, float]] = None, step: float = 0.01,
+            medium_sensitivity: float = 0.85, high_alert_rate: float = 0.15):
+    """Per-group threshold table and summary (current operating points and suggested cut-offs)"""
+    scores = np.asarray(scores, dtype=np.float64)
+    labels = np.asarray(labels).astype(bool)
+    grid = np.round(np.arange(0.0, 1.0 + step / 2, step), 6)
+    current = current or {'medium': 0.25, 'high': 0.55}
+
+    selections = [('all', np.ones(len(scores), dtype=bool))]
+    if groups is not None:
+        groups = pd.Series(groups).fillna('Unknown').astype(str).to_numpy()
+        selections += [(group, groups == group) for group in sorted(set(groups))]
+
+    tables, summary = [], {}
+    for group, mask in selections:
+        group_scores, group_labels = scores[mask], labels[mask]
+        positives = int(group_labels.sum())
+        negatives = len(group_labels) - positives
+        sweep = threshold_sweep(group_scores, group_labels)
+
+        table = compact_table(sweep, grid, positives, negatives)
+        table.insert(0, 'group', group)
+        tables.append(table)
+
+        at_current = operating_points(sweep, [current['medium'], current['high']], positives, negatives)
+        entry = {
+            'patients': len(group_scores),
+            'readmission_rate': round(positives / max(len(group_scores), 1), 4),
+            'distinct_thresholds': len(sweep['threshold']),
+            'current': {level: {metric: round(float(at_current[metric][i]), 4) for metric in METRIC_COLUMNS}
+                        for i, level in enumerate(['medium', 'high'])}
+        }
+        if len(group_scores) >= MIN_GROUP_SIZE and positives and negatives:
+            entry['suggested'] = suggest_cutoffs(sweep, medium_sensitivity, high_alert_rate)
+        summary[group] = entry
+
+    return pd.concat(tables, ignore_index=True), summary
+
+
+def score_validation(df: pd.DataFrame, artifact: Optional[str] = None, data_path: Optional[str] = None):
+    """Final risk probabilities and readmission labels for a labelled frame"""
+    from batch_score import load_predictor
+
+    predictor = load_predictor(artifact, data_path)
+    labels = predictor._readmission_target(df[predictor._find_readmission_column(df)])
+    known = labels.notna().to_numpy()
+    results = predictor.predict_batch(df[known])
+    current = {level: predictor.risk_thresholds[level][0] for level in ['medium', 'high']}
+    return results['risk_percentage'].to_numpy() / 100.0, labels[known].to_numpy(), known, current
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep low/medium/high risk cut-offs on a labelled validation set')
+    parser.add_argument('input', help='Labelled validation CSV')
+    parser.add_argument('--artifact', default=None, help='Compact model artifact (.npz); trains from --data-path if omitted')
+    parser.add_argument('--data-path', default=None, help='Training data directory when no artifact is given')
+    parser.add_argument('--score-column', default=None,
+                        help='Use precomputed scores from this column (0-1 or percentages) instead of the model')
+    parser.add_argument('--label-column', default=None, help='Readmission label column (default: auto-detect)')
+    parser.add_argument('--group-by', default=None, help='Column to analyse separately, e.g. medical_specialty')
+    parser.add_argument('--step', type=float, default=0.01, help='Threshold spacing of the output table')
+    parser.add_argument('--medium-sensitivity', type=float, default=0.85,
+                        help='Suggested medium cut-off catches at least this fraction of readmissions')
+    parser.add_argument('--high-alert-rate', type=float, default=0.15,
+                        help='Suggested high cut-off flags at most this fraction of patients')
+    parser.add_argument('--output', default=None, help='Write the threshold table CSV here')
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input)
+    current = None
+    if args.score_column:
+        from enhanced_predictor import EnhancedMedicalPredictor
+        predictor = EnhancedMedicalPredictor()
+        label_column = args.label_column or predictor._find_readmission_column(df)
+        labels = predictor._readmission_target(df[label_column])
+        known = labels.notna().to_numpy()
+        scores = pd.to_numeric(df[args.score_column], errors='coerce').fillna(0).to_numpy()[known]
+        if scores.max(initial=0) > 1:
+            scores = scores / 100.0
+        labels = labels[known].to_numpy()
+    else:
+        if args.label_column:
+            df = df.rename(columns={args.label_column: 'readmitted'})
+        stdout, sys.stdout = sys.stdout, sys.stderr
+        try:
+            scores, labels, known, current = score_validation(df, args.artifact, args.data_path)
+        finally:
+            sys.stdout = stdout
+
+    groups = df[args.group_by].to_numpy()[known] if args.group_by else None
+    table, summary = analyze(scores, labels, groups, current, args.step,
+                             args.medium_sensitivity, args.high_alert_rate)
+    if args.output:
+        table.to_csv(args.output, index=False)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Training Pipeline for RelayLoop
+Runs EnhancedMedicalPredictor training as explicit stages with an on-disk
+cache, so changing one model's hyperparameters does not re-parse CSVs or
+rebuild features.
+
+    load -> preprocess -> features -> split -> model:<name> (one per model)
+
+Each stage's key is a SHA-256 over its parameters, the source code of the
+methods it runs and the keys of its upstream stages (the load stage hashes
+the CSV contents). A stage whose key is already cached is loaded from disk;
+everything downstream of a change re-runs. Every stage logs its duration
+and whether it was a cache hit.
+
+    python training_pipeline.py --data-path ../../../dataset --output model.npz
+    python training_pipeline.py --set gradient_boosting.max_depth=6
+    python training_pipeline.py --no-cache --profile train-profile.json
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import joblib
+
+from profiling import StageProfiler, stage as profile_stage
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '.cache', 'training')
+
+# Bumped when the cached payload layout changes
+CACHE_FORMAT = 1
+
+
+def _hash(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source(*objects) -> List[str]:
+    return [inspect.getsource(obj) for obj in objects]
+
+
+class StageCache:
+    """Stage outputs stored as <stage>-<key>.joblib files"""
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, stage: str, key: str) -> str:
+        return os.path.join(self.directory, f"{stage.replace(':', '-')}-{key[:20]}.joblib")
+
+    def get(self, stage: str, key: str):
+        path = self._path(stage, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            payload = joblib.load(path)
+        except Exception:
+            return None
+        return payload['output'] if payload.get('key') == key else None
+
+    def put(self, stage: str, key: str, output):
+        path = self._path(stage, key)
+        tmp_path = path + '.tmp'
+        joblib.dump({'key': key, 'output': output}, tmp_path)
+        os.replace(tmp_path, path)
+
+
+class TrainingPipeline:
+    """Stage-cached equivalent of MLPredictionService.initialize"""
+
+    def __init__(self, data_path: Optional[str] = None, cache_dir: str = DEFAULT_CACHE_DIR,
+                 model_params: Optional[Dict[str, Tuple[type, Dict[str, Any]]]] = None,
+                 sparse_panel=None, force: Optional[List[str]] = None, categorical_encoder=None):
+        from enhanced_predictor import EnhancedMedicalPredictor, ENHANCED_MODEL_PARAMS
+
+        self.predictor = EnhancedMedicalPredictor(data_path)
+        self.predictor.sparse_panel = sparse_panel
+        self.predictor.categorical_encoder = categorical_encoder
+        self.model_params = model_params or ENHANCED_MODEL_PARAMS
+        self.cache = StageCache(cache_dir)
+        self.force = set(force or [])
+        self.log = []
+
+    def _run(self, stage: str, key: str, compute):
+        start = time.perf_counter()
+        output = None if stage in self.force or '*' in self.force else self.cache.get(stage, key)
+        hit = output is not None
+        if not hit:
+            with profile_stage(f'pipeline:{stage}'):
+                output = compute()
+            self.cache.put(stage, key, output)
+        seconds = time.perf_counter() - start
+        self.log.append({'stage': stage, 'key': key[:12], 'cache_hit': hit, 'seconds': round(seconds, 3)})
+        print(f"[stage] {stage:<28} {'cache hit' if hit else 'computed':<9} {seconds:8.2f}s  {key[:12]}")
+        return output
+
+    def _input_files(self) -> Dict[str, str]:
+        path = self.predictor.data_path
+        if not os.path.isdir(path):
+            return {}
+        return {name: _file_digest(os.path.join(path, name))
+                for name in sorted(os.listdir(path)) if name.endswith('.csv')}
+
+    def run(self):
+        """Train (or restore) every stage and return a ready EnhancedMedicalPredictor"""
+        import categorical_encoding
+        import feature_spec
+        import sparse_panels
+
+        p = self.predictor
+        cls = type(p)
+
+        load_key = _hash('load', CACHE_FORMAT, self._input_files(),
+                         _source(cls.load_datasets, cls._create_synthetic_dataset, cls._create_enhanced_sample_datasets))
+        datasets = self._run('load', load_key, p.load_datasets)
+
+        panel = p.sparse_panel.to_dict() if p.sparse_panel is not None else None
+        encoder = p.categorical_encoder.to_dict() if p.categorical_encoder is not None else None
+        preprocess_key = _hash('preprocess', load_key, panel, encoder,
+                               _source(cls.preprocess_datasets, cls._find_age_column, cls._find_readmission_column,
+                                       cls._readmission_target, cls._create_enhanced_unified_features,
+                                       cls._create_risk_features, type(p.age_merger), feature_spec, sparse_panels,
+                                       categorical_encoding))
+        # preprocess_datasets adds an age_group column to its inputs, so hand it copies
+        combined = self._run('preprocess', preprocess_key,
+                             lambda: p.preprocess_datasets(datasets[0].copy(), datasets[1].copy()))
+        p.historical_data = combined
+        del datasets
+
+        features_key = _hash('features', preprocess_key,
+                             _source(cls._prepare_enhanced_features, cls._sparse_blocks, feature_spec))
+
+        def build_features():
+            X, y = p._prepare_enhanced_features(combined.copy())
+            return {'X': X, 'y': y, 'label_encoders': p.label_encoders,
+                    'feature_spec': p.feature_spec.to_dict(), 'feature_columns': p.feature_columns,
+                    'categorical_encoder': encoder and p.categorical_encoder.to_dict()}
+
+        features = self._run('features', features_key, build_features)
+        p.label_encoders = features['label_encoders']
+        p.feature_spec = feature_spec.FeatureSpec.from_dict(features['feature_spec'])
+        p.feature_columns = features['feature_columns']
+        if features['categorical_encoder']:
+            p.categorical_encoder = categorical_encoding.SparseCategoricalEncoder.from_dict(
+                features['categorical_encoder'])
+
+        split_key = _hash('split', features_key, _source(cls._split_and_scale))
+
+        def build_split():
+            split = p._split_and_scale(features['X'], features['y'])
+            return {'split': split, 'scalers': p.scalers}
+
+        split_state = self._run('split', split_key, build_split)
+        p.scalers = split_state['scalers']
+        split = split_state['split']
+
+        import sklearn
+        model_keys = []
+        for name, (model_class, params) in self.model_params.items():
+            model_key = _hash('model', split_key, name, f'{model_class.__module__}.{model_class.__name__}',
+                              params, sklearn.__version__, _source(cls._fit_model))
+            model_keys.append(model_key)
+            try:
+                p.models[name] = self._run(f'model:{name}', model_key,
+                                           lambda: p._fit_model(name, model_class(**params), split)[0])
+            except Exception as e:
+                print(f"  Error training {name}: {e}")
+
+        p.is_trained = True
+        p.model_version = 'pipeline-' + _hash(*model_keys)[:12]
+        return p
+
+
+def _parse_value(text: str):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def apply_overrides(model_params: Dict[str, Tuple[type, Dict[str, Any]]], overrides: List[str]):
+    """Apply model.param=value overrides to a copy of the model parameter table"""
+    params = {name: (model_class, dict(values)) for name, (model_class, values) in model_params.items()}
+    for override in overrides:
+        target, _, value = override.partition('=')
+        name, _, param = target.partition('.')
+        if name not in params or not param or not _:
+            raise ValueError(f'Invalid override: {override} (expected model.param=value)')
+        params[name][1][param] = _parse_value(value)
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the enhanced models with cached pipeline stages')
+    parser.add_argument('--data-path', default=None, help='Directory containing the training CSV files')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Stage cache directory')
+    parser.add_argument('--set', action='append', default=[], metavar='MODEL.PARAM=VALUE',
+                        help='Override a model hyperparameter (repeatable)')
+    parser.add_argument('--force', action='append', default=[], metavar='STAGE',
+                        help='Recompute a stage even if cached (e.g. load, model:extra_trees)')
+    parser.add_argument('--sparse-panel', action='store_true', help='Also train on the COVID viral panel')
+    parser.add_argument('--categoricals', choices=['onehot', 'hash'], default=None,
+                        help='Also train on diagnosis/specialty categoricals, one-hot or hashed into a sparse block')
+    parser.add_argument('--no-cache', action='store_true', help='Recompute every stage (cache is still updated)')
+    parser.add_argument('--output', default=None, help='Export the trained models as a compact artifact')
+    parser.add_argument('--profile', default=None, metavar='PATH',
+                        help='Write a per-stage CPU/memory report to PATH and collapsed stacks to PATH.folded')
+    args = parser.parse_args()
+
+    from enhanced_predictor import ENHANCED_MODEL_PARAMS
+
+    panel = None
+    if args.sparse_panel:
+        from sparse_panels import SparsePanel, COVID_VIRAL_PANEL
+        panel = SparsePanel(COVID_VIRAL_PANEL, 'covid_viral')
+
+    encoder = None
+    if args.categoricals:
+        from categorical_encoding import SparseCategoricalEncoder
+        encoder = SparseCategoricalEncoder(mode=args.categoricals)
+
+    force = args.force + (['*'] if args.no_cache else [])
+    pipeline = TrainingPipeline(args.data_path, args.cache_dir, apply_overrides(ENHANCED_MODEL_PARAMS, args.set),
+                                panel, force, encoder)
+    profiler = StageProfiler().start() if args.profile else None
+    start = time.perf_counter()
+    try:
+        predictor = pipeline.run()
+
+        if args.output:
+            from model_artifacts import export_compact_artifact
+            export_compact_artifact(predictor, args.output)
+    finally:
+        if profiler is not None:
+            profiler.write(args.profile)
+
+    print(json.dumps({'model_version': predictor.model_version, 'seconds': round(time.perf_counter() - start, 2),
+                      'stages': pipeline.log}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
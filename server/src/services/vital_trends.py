@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rolling Trend Features for RelayLoop
+Keeps per-patient rolling-window aggregates (latest, slope, min, max,
+variance) of lab and vital-sign series so models can see trends instead of a
+single snapshot.
+
+Each (patient, signal) series lives in a fixed-size ring buffer. Every
+window keeps running sums for the count, mean, variance and least-squares
+slope, plus monotonic deques for min/max, so adding an observation costs
+O(1) amortized and reading features never rescans history.
+
+Benchmark ingestion on synthetic observations:
+    python vital_trends.py --patients 5000 --observations 40
+"""
+
+import argparse
+import json
+import time
+from array import array
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from feature_spec import BASE_DEFAULTS
+
+# Lab series the models already see as snapshots
+DEFAULT_SIGNALS = ['hemoglobin', 'platelets', 'urea', 'potassium', 'sodium']
+
+# Vital-sign module fields that can be tracked as well
+VITAL_SIGNALS = ['temperature', 'heart_rate', 'blood_pressure_systolic', 'blood_pressure_diastolic',
+                 'respiratory_rate', 'oxygen_saturation', 'blood_glucose']
+
+DEFAULT_WINDOWS_HOURS = (24, 72)
+
+# Observations kept per series; older ones fall out of every window
+DEFAULT_CAPACITY = 128
+
+STATISTICS = ['slope', 'min', 'max', 'var', 'count']
+
+
+def trend_feature_names(signals: List[str] = DEFAULT_SIGNALS,
+                        windows_hours: Tuple[int, ...] = DEFAULT_WINDOWS_HOURS) -> List[str]:
+    names = []
+    for signal in signals:
+        names.append(f'{signal}_latest')
+        for hours in windows_hours:
+            names.extend(f'{signal}_{stat}_{hours:g}h' for stat in STATISTICS)
+    return names
+
+
+def trend_feature_defaults(signals: List[str] = DEFAULT_SIGNALS,
+                           windows_hours: Tuple[int, ...] = DEFAULT_WINDOWS_HOURS) -> Dict[str, float]:
+    """Values for patients without observations: snapshot defaults, flat trend"""
+    defaults = {}
+    for signal in signals:
+        level = float(BASE_DEFAULTS.get(signal, 0.0))
+        defaults[f'{signal}_latest'] = level
+        for hours in windows_hours:
+            suffix = f'_{hours:g}h'
+            defaults.update({f'{signal}_slope{suffix}': 0.0, f'{signal}_min{suffix}': level,
+                             f'{signal}_max{suffix}': level, f'{signal}_var{suffix}': 0.0,
+                             f'{signal}_count{suffix}': 0.0})
+    return defaults
+
+
+def _to_hours(timestamp) -> float:
+    """Epoch hours from a number (epoch seconds), datetime or ISO string"""
+    if isinstance(timestamp, (int, float, np.integer, np.floating)):
+        return float(timestamp) / 3600.0
+    return pd.Timestamp(timestamp).value / 3.6e12
+
+
+class _Window:
+    """Running sums over the most recent `hours` of one series"""
+
+    __slots__ = ('hours', 'start', 'n', 's_t', 's_v', 's_tt', 's_tv', 's_vv', 'mins', 'maxs')
+
+    def __init__(self, hours: float):
+        self.hours = hours
+        self.start = 0  # sequence number of the oldest observation inside the window
+        self.n = 0
+        self.s_t = self.s_v = self.s_tt = self.s_tv = self.s_vv = 0.0
+        self.mins = deque()
+        self.maxs = deque()
+
+    def add(self, seq: int, t: float, v: float, values: array):
+        self.n += 1
+        self.s_t += t
+        self.s_v += v
+        self.s_tt += t * t
+        self.s_tv += t * v
+        self.s_vv += v * v
+        cap = len(values)
+        while self.mins and values[self.mins[-1] % cap] >= v:
+            self.mins.pop()
+        self.mins.append(seq)
+        while self.maxs and values[self.maxs[-1] % cap] <= v:
+            self.maxs.pop()
+        self.maxs.append(seq)
+
+    def evict(self, seq: int, t: float, v: float):
+        self.n -= 1
+        self.s_t -= t
+        self.s_v -= v
+        self.s_tt -= t * t
+        self.s_tv -= t * v
+        self.s_vv -= v * v
+        if self.mins and self.mins[0] == seq:
+            self.mins.popleft()
+        if self.maxs and self.maxs[0] == seq:
+            self.maxs.popleft()
+        self.start = seq + 1
+
+
+class RollingSeries:
+    """Ring buffer of one patient's observations of one signal"""
+
+    __slots__ = ('times', 'values', 'next_seq', 't0', 'v0', 'latest', 'latest_time', 'windows')
+
+    def __init__(self, windows_hours: Tuple[int, ...], capacity: int):
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.next_seq = 0
+        self.t0 = None  # times and values are stored relative to the first observation
+        self.v0 = 0.0
+        self.latest = None
+        self.latest_time = None
+        self.windows = [_Window(hours) for hours in windows_hours]
+
+    def _evict_until(self, cutoff: float, force_seq: int = -1):
+        """Drop observations older than cutoff (relative hours) or with seq <= force_seq"""
+        cap = len(self.times)
+        for window in self.windows:
+            while window.start < self.next_seq:
+                slot = window.start % cap
+                t = self.times[slot]
+                if t >= cutoff - window.hours and window.start > force_seq:
+                    break
+                window.evict(window.start, t, self.values[slot])
+
+    def add(self, hours: float, value: float):
+        if self.t0 is None:
+            self.t0, self.v0 = hours, value
+        t, v = hours - self.t0, value - self.v0
+        if self.latest_time is not None and hours < self.latest_time:
+            raise ValueError('Observations must arrive in time order per series')
+
+        cap = len(self.times)
+        # A full ring forces its oldest observation out of every window
+        self._evict_until(t, self.next_seq - cap)
+
+        slot = self.next_seq % cap
+        self.times[slot] = t
+        self.values[slot] = v
+        for window in self.windows:
+            window.add(self.next_seq, t, v, self.values)
+        self.next_seq += 1
+        self.latest, self.latest_time = value, hours
+
+    def _window_at(self, window: _Window, t_now: Optional[float]) -> Optional[Tuple[float, ...]]:
+        """(n, s_t, s_v, s_tt, s_tv, s_vv, min, max) of a window at relative time t_now, read only"""
+        cap = len(self.times)
+        if t_now is not None and t_now < self.latest_time - self.t0:
+            # A time before the last observation: rescan what the ring still holds
+            n = s_t = s_v = s_tt = s_tv = s_vv = 0.0
+            lo = hi = None
+            for seq in range(max(self.next_seq - cap, 0), self.next_seq):
+                t, v = self.times[seq % cap], self.values[seq % cap]
+                if t_now - window.hours <= t <= t_now:
+                    n += 1
+                    s_t += t
+                    s_v += v
+                    s_tt += t * t
+                    s_tv += t * v
+                    s_vv += v * v
+                    lo = v if lo is None else min(lo, v)
+                    hi = v if hi is None else max(hi, v)
+            return (n, s_t, s_v, s_tt, s_tv, s_vv, lo, hi) if n else None
+
+        # Later times only drop the oldest observations: subtract them from copies of the sums
+        n, s_t, s_v, s_tt, s_tv, s_vv = window.n, window.s_t, window.s_v, window.s_tt, window.s_tv, window.s_vv
+        seq = window.start
+        if t_now is not None:
+            while seq < self.next_seq and self.times[seq % cap] < t_now - window.hours:
+                t, v = self.times[seq % cap], self.values[seq % cap]
+                n -= 1
+                s_t -= t
+                s_v -= v
+                s_tt -= t * t
+                s_tv -= t * v
+                s_vv -= v * v
+                seq += 1
+        if n == 0:
+            return None
+        lo = next(i for i in window.mins if i >= seq)
+        hi = next(i for i in window.maxs if i >= seq)
+        return n, s_t, s_v, s_tt, s_tv, s_vv, self.values[lo % cap], self.values[hi % cap]
+
+    def features(self, signal: str, out: Dict[str, float], defaults: Dict[str, float],
+                 now: Optional[float] = None):
+        """Write features as of `now` (epoch hours; default: the last observation) without changing state"""
+        t_now = now - self.t0 if now is not None and self.t0 is not None else None
+        out[f'{signal}_latest'] = self.latest if self.latest is not None else defaults[f'{signal}_latest']
+        for window in self.windows:
+            suffix = f'_{window.hours:g}h'
+            sums = self._window_at(window, t_now) if self.t0 is not None else None
+            if sums is None:
+                for stat in STATISTICS:
+                    out[f'{signal}_{stat}{suffix}'] = defaults[f'{signal}_{stat}{suffix}']
+                continue
+            n, s_t, s_v, s_tt, s_tv, s_vv, lo, hi = sums
+            mean = s_v / n
+            denominator = n * s_tt - s_t * s_t
+            slope = (n * s_tv - s_t * s_v) / denominator if n > 1 and denominator > 1e-9 else 0.0
+            out[f'{signal}_slope{suffix}'] = slope
+            out[f'{signal}_min{suffix}'] = lo + self.v0
+            out[f'{signal}_max{suffix}'] = hi + self.v0
+            out[f'{signal}_var{suffix}'] = max(s_vv / n - mean * mean, 0.0)
+            out[f'{signal}_count{suffix}'] = float(n)
+
+
+class TrendStore:
+    """Rolling trend state for every patient, fed one observation at a time"""
+
+    def __init__(self, signals: Optional[List[str]] = None,
+                 windows_hours: Tuple[int, ...] = DEFAULT_WINDOWS_HOURS, capacity: int = DEFAULT_CAPACITY):
+        self.signals = list(signals or DEFAULT_SIGNALS)
+        self.windows_hours = tuple(windows_hours)
+        self.capacity = capacity
+        self.feature_names = trend_feature_names(self.signals, self.windows_hours)
+        self.defaults = trend_feature_defaults(self.signals, self.windows_hours)
+        self.series = {}
+        self.observations = 0
+
+    def add(self, patient_id, timestamp, signal: str, value: float):
+        """Record one observation in O(1) amortized time"""
+        if signal not in self.signals or value is None or value != value:
+            return
+        key = (str(patient_id), signal)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = RollingSeries(self.windows_hours, self.capacity)
+        series.add(_to_hours(timestamp), float(value))
+        self.observations += 1
+
+    def add_record(self, record: Dict[str, Any], timestamp_field: str = 'recorded_at'):
+        """Record every tracked signal present in a vital-sign or lab row"""
+        timestamp = record[timestamp_field]
+        for signal in self.signals:
+            if record.get(signal) is not None:
+                self.add(record['patient_id'], timestamp, signal, record[signal])
+
+    def ingest_frame(self, df: pd.DataFrame, timestamp_field: str = 'recorded_at'):
+        """Bulk load a long (one row per observation) or wide frame sorted by time"""
+        df = df.sort_values(timestamp_field, kind='stable')
+        if 'signal' in df.columns:
+            for patient_id, timestamp, signal, value in zip(df['patient_id'], df[timestamp_field],
+                                                            df['signal'], df['value']):
+                self.add(patient_id, timestamp, signal, value)
+        else:
+            for record in df.to_dict('records'):
+                self.add_record(record, timestamp_field)
+
+    def features(self, patient_id, now=None) -> Dict[str, float]:
+        """Trend features of one patient as of `now` (defaults when nothing was observed)
+
+        Without `now` each series is read at its last observation. Reading
+        never changes the store; observations only leave a window on add().
+        """
+        out = {}
+        now_hours = _to_hours(now) if now is not None else None
+        for signal in self.signals:
+            series = self.series.get((str(patient_id), signal))
+            if series is None:
+                out.update({name: self.defaults[name] for name in self.feature_names
+                            if name.startswith(signal + '_')})
+                continue
+            series.features(signal, out, self.defaults, now_hours)
+        return out
+
+    def join(self, df: pd.DataFrame, id_column: str = 'patient_id', now=None) -> pd.DataFrame:
+        """Add trend feature columns to df as of `now` (one time, or one per row), one lookup per row"""
+        ids = df[id_column].astype(str).to_numpy() if id_column in df.columns else [None] * len(df)
+        times = now if isinstance(now, (list, np.ndarray, pd.Series)) else [now] * len(df)
+        rows = [self.features(patient_id, t) for patient_id, t in zip(ids, times)]
+        trends = pd.DataFrame(rows, columns=self.feature_names, index=df.index, dtype=np.float32)
+        return pd.concat([df.drop(columns=[c for c in self.feature_names if c in df.columns]), trends], axis=1)
+
+
+def synthetic_observations(patients: int, per_patient: int, seed: int = 42) -> pd.DataFrame:
+    """Random-walk lab series, one row per observation"""
+    rng = np.random.default_rng(seed)
+    n = patients * per_patient
+    start = pd.Timestamp('2024-01-01').value / 1e9
+    patient = np.repeat(np.arange(patients), per_patient)
+    step_hours = rng.exponential(6.0, n)
+    hours = np.concatenate([np.cumsum(row) for row in step_hours.reshape(patients, per_patient)])
+    frame = {'patient_id': patient.astype(str), 'recorded_at': start + hours * 3600.0}
+    scales = {'hemoglobin': 0.3, 'platelets': 12.0, 'urea': 0.5, 'potassium': 0.1, 'sodium': 0.8}
+    for signal, scale in scales.items():
+        walk = rng.normal(0.0, scale, (patients, per_patient)).cumsum(axis=1)
+        frame[signal] = (BASE_DEFAULTS[signal] + walk).ravel().round(2)
+    return pd.DataFrame(frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark incremental trend feature maintenance')
+    parser.add_argument('--patients', type=int, default=2000)
+    parser.add_argument('--observations', type=int, default=40, help='Observations per patient')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    observations = synthetic_observations(args.patients, args.observations, args.seed)
+    store = TrendStore()
+    start = time.perf_counter()
+    store.ingest_frame(observations)
+    ingest_seconds = time.perf_counter() - start
+
+    patients = pd.DataFrame({'patient_id': [str(i) for i in range(args.patients)]})
+    start = time.perf_counter()
+    joined = store.join(patients)
+    join_seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        'observations': store.observations,
+        'series': len(store.series),
+        'features_per_patient': len(store.feature_names),
+        'ingest_us_per_observation': round(ingest_seconds / max(store.observations, 1) * 1e6, 2),
+        'join_us_per_patient': round(join_seconds / max(len(joined), 1) * 1e6, 2)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
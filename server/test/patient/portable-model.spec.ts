@@ -0,0 +1,24 @@
+import { readFileSync } from 'fs';
+import { join } from 'path';
+import { goldenPath, PortableModel, verifyGoldenSet } from '../../src/modules/patient/portable-model';
+
+// Small ensemble exported by server/src/services/portable_export.py, with its golden set
+const MODEL_PATH = join(__dirname, 'fixtures', 'portable-model.json');
+
+describe('PortableModel', () => {
+  const model = PortableModel.load(MODEL_PATH);
+
+  it('reproduces the golden outputs of the Python predictor', () => {
+    const golden = JSON.parse(readFileSync(goldenPath(MODEL_PATH), 'utf-8'));
+    const report = verifyGoldenSet(model, golden);
+
+    expect(report.failures).toEqual([]);
+    expect(report.passed).toBe(true);
+  });
+
+  it('scores an absent gender as the exported default', () => {
+    const patient = { age: 72, diabetes: 1, hemoglobin: 10.5 };
+
+    expect(model.predict(patient)).toEqual(model.predict({ ...patient, gender: 'Unknown' }));
+  });
+});